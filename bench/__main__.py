@@ -0,0 +1,106 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from werkzeug.serving import make_server
+from .load import SCENARIOS, Workload, run
+
+# builds the app through create_app() against a local database, seeds it
+# and drives the main endpoints, for example
+#   python -m bench --datasets 50000 --concurrency 16 --duration 30
+#   python -m bench --database-uri postgresql://localhost/seps_bench
+# --url benchmarks an already running server, such as gunicorn, that uses
+# the same database
+
+
+def parse_weights(value):
+    weights = {}
+
+    for item in value.split(","):
+        scenario, _, weight = item.partition("=")
+        if scenario not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {scenario}")
+        weights[scenario] = float(weight or 1)
+
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument(
+        "--database-uri",
+        default="sqlite:///" + os.path.join(tempfile.gettempdir(), "seps-bench.db"),
+    )
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--datasets", type=int, default=10000)
+    parser.add_argument("--predicted", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--weights",
+        type=parse_weights,
+        default="login=1,predict=4,upload_predict=2,dataset=4,predictions=4",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report to this file")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URI"] = args.database_uri
+    os.environ.setdefault("SECRET_KEY", "bench")
+
+    from server import create_app
+    from .seed import seed
+
+    app = create_app()
+
+    unpredicted_ids = seed(
+        app, args.users, args.datasets, args.predicted, seed_value=args.seed
+    )
+
+    server = None
+    base_url = args.url
+
+    if base_url is None:
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    workload = Workload(
+        unpredicted_ids, pages=max(args.datasets // 10, 1), seed_value=args.seed
+    )
+
+    try:
+        results = run(
+            base_url,
+            workload,
+            args.users,
+            args.weights,
+            concurrency=args.concurrency,
+            duration=args.duration,
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    report["config"]["database_uri"] = args.database_uri.split("@")[-1]
+
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
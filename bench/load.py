@@ -0,0 +1,232 @@
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+import numpy as np
+from .seed import BENCH_EMAIL, BENCH_PASSWORD
+
+# access tokens expire after a minute, clients log in again before that
+TOKEN_MAX_AGE = 45
+
+SCENARIOS = ("login", "predict", "upload_predict", "dataset", "predictions")
+
+ENDPOINTS = {
+    "login": "user.login_user",
+    "predict": "predict.predict",
+    "upload_predict": "predict.upload_predict",
+    "dataset": "dataset.get_dataset",
+    "predictions": "predict.get_predictions",
+}
+
+METRIC_LINE = re.compile(
+    r'^db_request_queries_(sum|count)\{blueprint="[^"]*",endpoint="([^"]*)"\} (\S+)$'
+)
+
+
+class Client:
+    def __init__(self, base_url, user_index):
+        self.base_url = base_url
+        self.email = BENCH_EMAIL.format(user_index)
+        self.token = None
+        self.token_time = 0.0
+
+    def request(self, method, path, body=None, auth=True):
+        headers = {"Content-Type": "application/json"}
+
+        if auth:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, headers=headers, method=method
+        )
+
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    def login(self):
+        status, body = self.request(
+            "POST",
+            "/login",
+            {"email": self.email, "password": BENCH_PASSWORD},
+            auth=False,
+        )
+
+        if status != 200:
+            raise RuntimeError(f"Login failed with status {status}")
+
+        self.token = json.loads(body)["accessToken"]
+        self.token_time = time.time()
+
+
+# every scenario returns the method, path, body and whether it needs a token
+# /predict draws dataset ids that were left unpredicted by the seed, and
+# /upload_predict uses student ids that can not collide with seeded ones
+
+
+class Workload:
+    def __init__(self, unpredicted_ids, pages, seed_value=0):
+        self.unpredicted_ids = list(unpredicted_ids)
+        self.pages = pages
+        self.student_ids = iter(range(3000000000, 4000000000))
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed_value)
+
+        random.Random(seed_value).shuffle(self.unpredicted_ids)
+
+    def next_request(self, scenario, client):
+        with self.lock:
+            if scenario == "login":
+                return (
+                    "POST",
+                    "/login",
+                    {"email": client.email, "password": BENCH_PASSWORD},
+                    False,
+                )
+
+            if scenario == "predict":
+                if not self.unpredicted_ids:
+                    return None
+                return (
+                    "POST",
+                    "/predict",
+                    {"datasetId": self.unpredicted_ids.pop()},
+                    True,
+                )
+
+            if scenario == "upload_predict":
+                return (
+                    "POST",
+                    "/upload_predict",
+                    {
+                        "studentId": next(self.student_ids),
+                        "features": [self.rng.randint(1, 5) for _ in range(8)],
+                    },
+                    True,
+                )
+
+            page = self.rng.randint(1, self.pages)
+            return "GET", f"/{scenario}?page={page}&limit=10", None, True
+
+
+def query_counts(base_url):
+    totals = defaultdict(lambda: [0.0, 0.0])
+
+    with urllib.request.urlopen(base_url + "/metrics") as response:
+        for line in response.read().decode("utf-8").splitlines():
+            match = METRIC_LINE.match(line)
+            if match:
+                kind, endpoint, value = match.groups()
+                totals[endpoint][0 if kind == "sum" else 1] += float(value)
+
+    return totals
+
+
+def summarize(latencies, statuses, duration, queries):
+    if not latencies:
+        return {"requests": 0}
+
+    values = np.array(latencies) * 1000
+
+    return {
+        "requests": len(values),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "status_codes": {str(status): count for status, count in statuses.items()},
+        "requests_per_second": len(values) / duration,
+        "latency_ms": {
+            "mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)),
+            "p99": float(np.percentile(values, 99)),
+            "max": float(values.max()),
+        },
+        "queries_per_request": queries,
+    }
+
+
+# runs every scenario with the given weights from `concurrency` threads for
+# `duration` seconds and returns the report
+
+
+def run(base_url, workload, users, weights, concurrency=8, duration=10.0):
+    scenarios = [scenario for scenario in SCENARIOS if weights.get(scenario)]
+    scenario_weights = [weights[scenario] for scenario in scenarios]
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    results_lock = threading.Lock()
+
+    before = query_counts(base_url)
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        client = Client(base_url, index % users)
+        rng = random.Random(index)
+
+        while time.perf_counter() < deadline:
+            scenario = rng.choices(scenarios, scenario_weights)[0]
+            next_request = workload.next_request(scenario, client)
+
+            if next_request is None:
+                continue
+
+            method, path, body, auth = next_request
+
+            # logging in again is kept out of the measured latency
+            if auth and (
+                client.token is None or time.time() - client.token_time > TOKEN_MAX_AGE
+            ):
+                client.login()
+
+            start_time = time.perf_counter()
+            status, _ = client.request(method, path, body, auth)
+            elapsed = time.perf_counter() - start_time
+
+            with results_lock:
+                latencies[scenario].append(elapsed)
+                statuses[scenario][status] += 1
+
+    start_time = time.perf_counter()
+    threads = [
+        threading.Thread(target=worker, args=(index,)) for index in range(concurrency)
+    ]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start_time
+    after = query_counts(base_url)
+
+    report = {}
+
+    for scenario in scenarios:
+        endpoint = ENDPOINTS[scenario]
+        query_sum = after[endpoint][0] - before[endpoint][0]
+        query_count = after[endpoint][1] - before[endpoint][1]
+
+        report[scenario] = summarize(
+            latencies[scenario],
+            statuses[scenario],
+            elapsed,
+            query_sum / query_count if query_count else None,
+        )
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    all_statuses = defaultdict(int)
+
+    for scenario_statuses in statuses.values():
+        for status, count in scenario_statuses.items():
+            all_statuses[status] += count
+
+    report["total"] = summarize(all_latencies, all_statuses, elapsed, None)
+
+    return report
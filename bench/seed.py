@@ -0,0 +1,91 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
+from server.config import db, bcrypt
+from server.schema.classifications import Classification
+from server.schema.dataset import Dataset, FEATURE_COLUMNS
+from server.schema.predictions import Prediction
+from server.schema.users import User
+from server.utils.analyticsUtils import rebuild_summary
+
+CHUNK_SIZE = 5000
+
+BENCH_EMAIL = "bench-{}@example.com"
+BENCH_PASSWORD = "bench-password"
+
+
+def chunks(rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        yield rows[start : start + CHUNK_SIZE]
+
+
+# recreate every table and fill them with synthetic rows using bulk inserts
+# the password is hashed once and shared by every user, so seeding does not
+# spend minutes in bcrypt
+# returns the ids of the datasets left unpredicted for /predict
+
+
+def seed(app, users=100, datasets=10000, predicted=0.5, seed_value=0):
+    rng = random.Random(seed_value)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        Classification.initialize_default_class()
+
+        password = bcrypt.generate_password_hash(BENCH_PASSWORD).decode("utf-8")
+        now = datetime.now()
+
+        user_rows = [
+            {
+                "user_id": uuid.UUID(int=rng.getrandbits(128)).hex,
+                "username": f"bench-{index}",
+                "email": BENCH_EMAIL.format(index),
+                "verified": True,
+                "password": password,
+                "created_at": now,
+            }
+            for index in range(users)
+        ]
+        db.session.execute(insert(User.__table__), user_rows)
+
+        dataset_rows = [
+            {
+                "student_id": 2000000000 + index,
+                **{column: rng.randint(1, 5) for column in FEATURE_COLUMNS},
+                "uploaded_at": now - timedelta(minutes=index),
+                "already_predicted": rng.random() < predicted,
+            }
+            for index in range(datasets)
+        ]
+
+        for rows in chunks(dataset_rows):
+            db.session.execute(insert(Dataset.__table__), rows)
+
+        # ids are assigned by the database so its sequences stay in sync
+        data_rows = db.session.execute(
+            select(Dataset.data_id, Dataset.already_predicted, Dataset.uploaded_at)
+        ).all()
+
+        prediction_rows = [
+            {
+                "data_id": row.data_id,
+                "classification_id": rng.randint(1, 2),
+                "user_id": rng.choice(user_rows)["user_id"],
+                "prediction_time": row.uploaded_at,
+            }
+            for row in data_rows
+            if row.already_predicted
+        ]
+
+        for rows in chunks(prediction_rows):
+            db.session.execute(insert(Prediction.__table__), rows)
+
+        db.session.commit()
+
+        # the predictions bypass the routes, so the summary is built once
+        rebuild_summary()
+
+        return [row.data_id for row in data_rows if not row.already_predicted]
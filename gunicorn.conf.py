@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# the master imports the app, and with it the memory-mapped model, before
+# forking so workers start without loading anything
+os.environ.setdefault("GUNICORN_PRELOAD", "true")
+
+preload_app = os.environ["GUNICORN_PRELOAD"].lower() == "true"
+
+# workers write their metrics here so /metrics can aggregate all of them,
+# it has to be set and emptied before the app is preloaded
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "seps-metrics")
+)
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+
+
+def memory_usage():
+    usage = {}
+
+    with open("/proc/self/status") as status:
+        for line in status:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile", "RssShmem"):
+                usage[key] = value.strip()
+
+    return usage
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    worker.fork_time = time.perf_counter()
+
+    if preload_app:
+        from server import init_worker
+
+        init_worker(worker.app.wsgi())
+
+
+def post_worker_init(worker):
+    # the model module is only imported by roles that score
+    bagged_tree = sys.modules.get("server.model.bagged_tree")
+
+    worker.log.info(
+        "Worker %s (%s) ready in %.3fs (model load %.3fs) %s",
+        worker.pid,
+        os.getenv("SERVER_ROLE", "all"),
+        time.perf_counter() - worker.fork_time,
+        bagged_tree.load_time if bagged_tree is not None else 0.0,
+        " ".join(f"{key}={value}" for key, value in memory_usage().items()),
+    )
@@ -1,40 +1,322 @@
+import time
+
+# measured from here so the startup metrics include the imports below
+import_start = time.perf_counter()
+
+import importlib
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from .config import db, migrate, cors, mail, bcrypt
-from .routes import index, dataset, emails, predict, users
+from .utils import (
+    admissionUtils,
+    analyticsUtils,
+    cacheUtils,
+    databaseUtils,
+    metricsUtils,
+    outboxUtils,
+    passwordUtils,
+    periodicUtils,
+    profilerUtils,
+    refreshTokenUtils,
+    revocationUtils,
+    userCacheUtils,
+)
 from .utils.tokenUtils import jwt
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
 
+import_time = time.perf_counter() - import_start
+
+# route modules are only imported for the roles that serve them, auth
+# workers never import the model registry or the scoring routes
+# the ml stack (numpy, joblib and sklearn) is only imported when the model
+# is loaded, in create_app with MODEL_LOADING=eager and on first use with
+# lazy or background
+BLUEPRINTS = {
+    "index": "index_bp",
+    "users": "user_bp",
+    "emails": "mail_bp",
+    "dataset": "dataset_bp",
+    "predict": "predict_bp",
+    "jobs": "jobs_bp",
+    "metrics": "metrics_bp",
+    "analytics": "analytics_bp",
+    "models": "models_bp",
+}
+
+ROLES = {
+    "all": tuple(BLUEPRINTS),
+    "auth": ("index", "users", "emails", "metrics"),
+    "predict": (
+        "index",
+        "dataset",
+        "predict",
+        "jobs",
+        "metrics",
+        "analytics",
+        "models",
+    ),
+}
+
+MODEL_ROLES = ("all", "predict")
+
+
+def uses_model(app):
+    return app.config["SERVER_ROLE"] in MODEL_ROLES
+
 
 def create_app():
     app = Flask(__name__)
     load_dotenv()
 
     app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URI")
+    app.config["DATABASE_REPLICA_URIS"] = [
+        uri.strip()
+        for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",")
+        if uri.strip()
+    ]
+    app.config["DB_POOL_SIZE"] = int(os.getenv("DB_POOL_SIZE", 5))
+    app.config["DB_MAX_OVERFLOW"] = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    app.config["DB_POOL_TIMEOUT"] = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    app.config["DB_POOL_RECYCLE"] = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    app.config["DB_POOL_PRE_PING"] = (
+        os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    )
+    app.config["DB_STATEMENT_TIMEOUT_MS"] = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+    app.config["DB_REPLICA_STICKY_SECONDS"] = float(
+        os.getenv("DB_REPLICA_STICKY_SECONDS", 5)
+    )
+    app.config["DB_RECENT_WRITES_FILE"] = os.getenv("DB_RECENT_WRITES_FILE")
+    app.config["SQL_PROFILER"] = os.getenv("SQL_PROFILER", "false").lower() == "true"
+    app.config["SQL_PROFILER_FLAG_FILE"] = os.getenv("SQL_PROFILER_FLAG_FILE")
+    app.config["SQL_PROFILER_SYNC_INTERVAL"] = float(
+        os.getenv("SQL_PROFILER_SYNC_INTERVAL", 10)
+    )
+    app.config["SQL_SLOW_QUERY_MS"] = float(os.getenv("SQL_SLOW_QUERY_MS", 100))
+    app.config["SQL_N_PLUS_ONE_THRESHOLD"] = int(
+        os.getenv("SQL_N_PLUS_ONE_THRESHOLD", 5)
+    )
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+    # credentials are only sent cross-origin by the listed origins
+    app.config["CORS_ORIGINS"] = [
+        origin.strip()
+        for origin in os.getenv("CORS_ORIGINS", "").split(",")
+        if origin.strip()
+    ]
 
     app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")
     app.config["MAIL_PORT"] = os.getenv("MAIL_PORT")
-    app.config["MAIL_USE_TLS"] = False
-    app.config["MAIL_USE_SSL"] = True
+    app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "false").lower() == "true"
+    app.config["MAIL_USE_SSL"] = os.getenv("MAIL_USE_SSL", "true").lower() == "true"
     app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
     app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
+    app.config["MAIL_TIMEOUT"] = float(os.getenv("MAIL_TIMEOUT", 30))
+    app.config["MAIL_OUTBOX_INTERVAL"] = float(os.getenv("MAIL_OUTBOX_INTERVAL", 5))
+    app.config["MAIL_OUTBOX_BATCH_SIZE"] = int(os.getenv("MAIL_OUTBOX_BATCH_SIZE", 50))
+    app.config["MAIL_OUTBOX_LEASE"] = int(os.getenv("MAIL_OUTBOX_LEASE", 300))
+    app.config["MAIL_OUTBOX_MAX_ATTEMPTS"] = int(
+        os.getenv("MAIL_OUTBOX_MAX_ATTEMPTS", 8)
+    )
+    app.config["MAIL_OUTBOX_BACKOFF"] = float(os.getenv("MAIL_OUTBOX_BACKOFF", 30))
+    app.config["MAIL_OUTBOX_MAX_BACKOFF"] = float(
+        os.getenv("MAIL_OUTBOX_MAX_BACKOFF", 3600)
+    )
+    app.config["MAIL_OUTBOX_RETENTION_DAYS"] = int(
+        os.getenv("MAIL_OUTBOX_RETENTION_DAYS", 7)
+    )
 
     app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=1)
     app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=30)
 
+    app.config["PREDICT_LOOKUP_TABLE"] = (
+        os.getenv("PREDICT_LOOKUP_TABLE", "false").lower() == "true"
+    )
+    app.config["PREDICT_LOOKUP_MIN"] = int(os.getenv("PREDICT_LOOKUP_MIN", 1))
+    app.config["PREDICT_LOOKUP_MAX"] = int(os.getenv("PREDICT_LOOKUP_MAX", 5))
+
+    app.config["PREDICT_BATCH_MAX_WAIT_MS"] = float(
+        os.getenv("PREDICT_BATCH_MAX_WAIT_MS", 0)
+    )
+    app.config["PREDICT_BATCH_MAX_SIZE"] = int(os.getenv("PREDICT_BATCH_MAX_SIZE", 64))
+
+    app.config["FEATURE_MIN"] = int(os.getenv("FEATURE_MIN", 1))
+    app.config["FEATURE_MAX"] = int(os.getenv("FEATURE_MAX", 5))
+    app.config["BULK_UPLOAD_CHUNK_SIZE"] = int(
+        os.getenv("BULK_UPLOAD_CHUNK_SIZE", 1000)
+    )
+
+    app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", 2))
+    app.config["JOB_CHUNK_SIZE"] = int(os.getenv("JOB_CHUNK_SIZE", 1000))
+    app.config["JOB_LEASE_SECONDS"] = int(os.getenv("JOB_LEASE_SECONDS", 120))
+
+    app.config["EXPORT_CHUNK_SIZE"] = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+
+    app.config["MODEL_RELOAD_INTERVAL"] = float(os.getenv("MODEL_RELOAD_INTERVAL", 5))
+
+    app.config["PAGINATION_COUNT_TTL"] = float(os.getenv("PAGINATION_COUNT_TTL", 30))
+
+    app.config["RESPONSE_CACHE_ENABLED"] = (
+        os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    )
+    app.config["RESPONSE_CACHE_SIZE"] = int(os.getenv("RESPONSE_CACHE_SIZE", 512))
+    app.config["RESPONSE_CACHE_TTL"] = float(os.getenv("RESPONSE_CACHE_TTL", 30))
+    app.config["RESPONSE_CACHE_VERSIONS_FILE"] = os.getenv(
+        "RESPONSE_CACHE_VERSIONS_FILE"
+    )
+
+    app.config["TOKEN_BLOOM_BITS"] = int(os.getenv("TOKEN_BLOOM_BITS", 1 << 20))
+    app.config["TOKEN_BLOOM_FILE"] = os.getenv("TOKEN_BLOOM_FILE")
+    app.config["TOKEN_BLOCKLIST_SYNC_INTERVAL"] = float(
+        os.getenv("TOKEN_BLOCKLIST_SYNC_INTERVAL", 1)
+    )
+    app.config["TOKEN_BLOCKLIST_PRUNE_INTERVAL"] = float(
+        os.getenv("TOKEN_BLOCKLIST_PRUNE_INTERVAL", 300)
+    )
+
+    app.config["REFRESH_COOKIE_SECURE"] = (
+        os.getenv("REFRESH_COOKIE_SECURE", "true").lower() == "true"
+    )
+    app.config["REFRESH_TOKEN_REQUIRED"] = (
+        os.getenv("REFRESH_TOKEN_REQUIRED", "true").lower() == "true"
+    )
+    app.config["REFRESH_TOKEN_PURGE_INTERVAL"] = float(
+        os.getenv("REFRESH_TOKEN_PURGE_INTERVAL", 3600)
+    )
+
+    app.config["BCRYPT_LOG_ROUNDS"] = int(os.getenv("BCRYPT_LOG_ROUNDS", 12))
+    app.config["BCRYPT_WORKERS"] = int(os.getenv("BCRYPT_WORKERS", 2))
+    app.config["BCRYPT_QUEUE_SIZE"] = int(os.getenv("BCRYPT_QUEUE_SIZE", 8))
+    app.config["BCRYPT_TIMEOUT"] = float(os.getenv("BCRYPT_TIMEOUT", 5))
+    app.config["BCRYPT_RETRY_AFTER"] = int(os.getenv("BCRYPT_RETRY_AFTER", 1))
+
+    app.config["ADMISSION_ENABLED"] = (
+        os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    )
+    app.config["ADMISSION_STATE_DIR"] = os.getenv("ADMISSION_STATE_DIR")
+    # number of proxies in front of the app that set X-Forwarded-For, without
+    # it every client behind a proxy shares the login bucket of its address
+    app.config["PROXY_FIX_X_FOR"] = int(os.getenv("PROXY_FIX_X_FOR", 0))
+
+    # scoring requests are limited per user, logins per ip
+    app.config["ADMISSION_PREDICT_CONCURRENCY"] = int(
+        os.getenv("ADMISSION_PREDICT_CONCURRENCY", 8)
+    )
+    app.config["ADMISSION_PREDICT_QUEUE_SIZE"] = int(
+        os.getenv("ADMISSION_PREDICT_QUEUE_SIZE", 16)
+    )
+    app.config["ADMISSION_PREDICT_QUEUE_TIMEOUT"] = float(
+        os.getenv("ADMISSION_PREDICT_QUEUE_TIMEOUT", 2)
+    )
+    app.config["ADMISSION_PREDICT_RATE"] = float(
+        os.getenv("ADMISSION_PREDICT_RATE", 20)
+    )
+    app.config["ADMISSION_PREDICT_BURST"] = float(
+        os.getenv("ADMISSION_PREDICT_BURST", 40)
+    )
+
+    app.config["ADMISSION_LOGIN_CONCURRENCY"] = int(
+        os.getenv("ADMISSION_LOGIN_CONCURRENCY", 4)
+    )
+    app.config["ADMISSION_LOGIN_QUEUE_SIZE"] = int(
+        os.getenv("ADMISSION_LOGIN_QUEUE_SIZE", 16)
+    )
+    app.config["ADMISSION_LOGIN_QUEUE_TIMEOUT"] = float(
+        os.getenv("ADMISSION_LOGIN_QUEUE_TIMEOUT", 2)
+    )
+    app.config["ADMISSION_LOGIN_RATE"] = float(os.getenv("ADMISSION_LOGIN_RATE", 5))
+    app.config["ADMISSION_LOGIN_BURST"] = float(os.getenv("ADMISSION_LOGIN_BURST", 30))
+
+    app.config["USER_CACHE_SIZE"] = int(os.getenv("USER_CACHE_SIZE", 4096))
+    app.config["USER_CACHE_TTL"] = float(os.getenv("USER_CACHE_TTL", 300))
+
+    app.config["PRELOAD_APP"] = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+    app.config["SERVER_ROLE"] = os.getenv("SERVER_ROLE", "all").lower()
+    app.config["MODEL_LOADING"] = os.getenv("MODEL_LOADING", "eager").lower()
+
+    if app.config["SERVER_ROLE"] not in ROLES:
+        raise ValueError(f"Unknown SERVER_ROLE {app.config['SERVER_ROLE']}")
+
+    if app.config["MODEL_LOADING"] not in ("eager", "background", "lazy"):
+        raise ValueError(f"Unknown MODEL_LOADING {app.config['MODEL_LOADING']}")
+
+    create_start = time.perf_counter()
+
+    if app.config["PROXY_FIX_X_FOR"] > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["PROXY_FIX_X_FOR"])
+
+    databaseUtils.configure(app)
     db.init_app(app)
     migrate.init_app(app, db, compare_type=True)
-    cors.init_app(app, supports_credentials=True)
+    cors.init_app(app, origins=app.config["CORS_ORIGINS"], supports_credentials=True)
     mail.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
+    metricsUtils.init_app(app)
+    databaseUtils.init_app(app)
+    profilerUtils.init_app(app)
+    admissionUtils.init_app(app)
+    analyticsUtils.init_app(app)
+    cacheUtils.init_app(app)
+    revocationUtils.init_app(app)
+    refreshTokenUtils.init_app(app)
+    outboxUtils.init_app(app)
+    userCacheUtils.init_app(app)
+
+    role = app.config["SERVER_ROLE"]
+    phase_start = time.perf_counter()
+
+    for name in ROLES[role]:
+        module = importlib.import_module(f".routes.{name}", __name__)
+        app.register_blueprint(getattr(module, BLUEPRINTS[name]))
+
+    metricsUtils.APP_STARTUP.labels(role, "blueprints").set(
+        time.perf_counter() - phase_start
+    )
+
+    if uses_model(app):
+        from .model import bagged_tree, scheduler
 
-    app.register_blueprint(index.index_bp)
-    app.register_blueprint(users.user_bp)
-    app.register_blueprint(emails.mail_bp)
-    app.register_blueprint(dataset.dataset_bp)
-    app.register_blueprint(predict.predict_bp)
+        phase_start = time.perf_counter()
+        bagged_tree.init_app(app)
+        scheduler.init_app(app)
+
+        metricsUtils.APP_STARTUP.labels(role, "model").set(
+            time.perf_counter() - phase_start
+        )
+
+    metricsUtils.APP_STARTUP.labels(role, "import").set(import_time)
+    metricsUtils.APP_STARTUP.labels(role, "create_app").set(
+        time.perf_counter() - create_start
+    )
+
+    if not app.config["PRELOAD_APP"]:
+        init_worker(app)
 
     return app
+
+
+# runs in every process that serves requests, after the fork when the
+# gunicorn master preloads the app
+
+
+def init_worker(app):
+    with app.app_context():
+        # connections opened by the master must not be shared with workers
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    # the password pool is forked before this process starts any thread
+    if app.config["SERVER_ROLE"] != "predict":
+        passwordUtils.start(app)
+
+    if uses_model(app):
+        from .model import bagged_tree
+        from .utils import jobUtils
+
+        jobUtils.init_app(app)
+        bagged_tree.warm_up(app)
+
+    outboxUtils.start(app)
+    periodicUtils.start(app)
@@ -4,8 +4,9 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from flask_mail import Mail
 from flask_bcrypt import Bcrypt
+from .utils.databaseUtils import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 cors = CORS()
 mail = Mail()
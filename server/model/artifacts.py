@@ -0,0 +1,35 @@
+import hashlib
+import os
+
+# files derived from a model are cached next to it and keyed by the hash of
+# its contents, so they are rebuilt whenever the model file changes
+
+
+def model_hash(path):
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as model_file:
+        for block in iter(lambda: model_file.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def artifact_path(model_path, suffix):
+    name = os.path.splitext(os.path.basename(model_path))[0]
+
+    return os.path.join(
+        os.path.dirname(model_path), f"{name}.{model_hash(model_path)[:16]}.{suffix}"
+    )
+
+
+# written to a temporary file first so a worker never loads a partial file
+
+
+def write_atomic(path, write):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(temp_path, "wb") as artifact_file:
+        write(artifact_file)
+
+    os.replace(temp_path, path)
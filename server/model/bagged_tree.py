@@ -1,8 +1,278 @@
 import os
-import joblib
+import threading
+import time
+from .artifacts import artifact_path, write_atomic
+from ..utils.metricsUtils import MODEL_BATCH_SIZE, MODEL_INFERENCE
 
 current_dir = os.path.dirname(__file__)
 
 cadmlm_model = os.path.join(current_dir, "cadmlm-bt.pkl")
 
-model = joblib.load(cadmlm_model)
\ No newline at end of file
+# every <version>.pkl in the registry directory is a model version and the
+# active one is named in the active-model file, the registry is read when
+# the module is imported so it is set from the environment and not from
+# the app config
+registry_dir = os.getenv("MODEL_REGISTRY_DIR", current_dir)
+
+DEFAULT_VERSION = "cadmlm-bt"
+ACTIVE_FILE = "active-model"
+
+# joblib, numpy and sklearn are only imported when a version is loaded, so
+# workers that load the model lazily start without the ml stack
+
+# the compiled evaluator skips sklearn's per-call overhead, which dominates
+# small batches, large batches are left to sklearn's cython tree walk
+COMPILED_MAX_BATCH = 512
+
+
+def load_compiled_model(model_path, get_model):
+    import joblib
+    from .compiled import FORMAT_VERSION, check_parity, compile_model
+
+    compiled_path = artifact_path(model_path, f"v{FORMAT_VERSION}.compiled.joblib")
+
+    if not os.path.exists(compiled_path):
+        model = get_model()
+        compiled_model = compile_model(model)
+        check_parity(model, compiled_model)
+        write_atomic(
+            compiled_path,
+            lambda compiled_file: joblib.dump(compiled_model, compiled_file),
+        )
+
+    # the arrays are mapped read-only so every worker shares the same pages
+    return joblib.load(compiled_path, mmap_mode="r")
+
+
+# one loaded model version, the sklearn ensemble is only unpickled to
+# compile it and to score large batches, the request path runs on the
+# memory-mapped compiled arrays
+
+
+class ModelVersion:
+    def __init__(self, version, path):
+        start_time = time.perf_counter()
+
+        self.version = version
+        self.path = path
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.compiled_model = load_compiled_model(path, self.get_model)
+        self.lookup_table = None
+
+        self.load_time = time.perf_counter() - start_time
+
+    def get_model(self):
+        import joblib
+
+        with self._model_lock:
+            if self._model is None:
+                self._model = joblib.load(self.path)
+
+        return self._model
+
+    def predict_live(self, X):
+        if len(X) <= COMPILED_MAX_BATCH:
+            return self.compiled_model.predict(X)
+
+        return self.get_model().predict(X)
+
+    def predict(self, X):
+        if self.lookup_table is not None:
+            return self.lookup_table.predict(X, self.predict_live)
+
+        return self.predict_live(X)
+
+    # scores the whole feature space once so predictions become array lookups
+
+    def enable_lookup_table(self, low, high):
+        from .lookup import load_or_build
+
+        self.lookup_table = load_or_build(
+            self.path,
+            self.predict_live,
+            self.compiled_model.classes_,
+            low,
+            high,
+            self.compiled_model.n_features_in_,
+        )
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+_active_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_last_check = 0.0
+
+lookup_range = None
+
+
+def model_path(version):
+    return os.path.join(registry_dir, f"{version}.pkl")
+
+
+def list_versions():
+    return sorted(
+        os.path.splitext(name)[0]
+        for name in os.listdir(registry_dir)
+        if name.endswith(".pkl")
+    )
+
+
+def read_active_version():
+    try:
+        with open(os.path.join(registry_dir, ACTIVE_FILE)) as active_file:
+            return active_file.read().strip() or DEFAULT_VERSION
+    except FileNotFoundError:
+        return DEFAULT_VERSION
+
+
+# loaded versions are kept so jobs re-scoring with a version and the
+# request path share the same arrays
+# versions come from clients, only the names listed in the registry are
+# loaded so a name can never point to a pickle outside of it
+
+
+def load_version(version):
+    with _versions_lock:
+        if version not in _versions:
+            if version not in list_versions():
+                raise LookupError(f"Model version {version} not found")
+
+            model = ModelVersion(version, model_path(version))
+
+            if lookup_range is not None:
+                model.enable_lookup_table(*lookup_range)
+
+            _versions[version] = model
+
+        return _versions[version]
+
+
+# the active version is loaded on first use, at startup with
+# MODEL_LOADING=eager or by a background thread with MODEL_LOADING=background
+active_model = None
+
+load_time = 0.0
+
+
+def get_active_model():
+    global active_model, load_time
+
+    model = active_model
+
+    if model is None:
+        with _active_lock:
+            if active_model is None:
+                active_model = load_version(read_active_version())
+                load_time = active_model.load_time
+
+            model = active_model
+
+    return model
+
+
+# the new version is fully loaded before it replaces the active one, the
+# swap is a single reference assignment so requests already scoring keep
+# the version they started with and none of them waits
+
+
+def activate(version):
+    global active_model
+
+    model = load_version(version)
+
+    write_atomic(
+        os.path.join(registry_dir, ACTIVE_FILE),
+        lambda active_file: active_file.write(version.encode("utf-8")),
+    )
+
+    active_model = model
+
+    return model
+
+
+# other workers notice an activation through the active-model file, it is
+# checked at most every MODEL_RELOAD_INTERVAL seconds and only one thread
+# loads the new version while the others keep serving the old one
+
+
+def check_for_update(interval):
+    global active_model, _last_check
+
+    now = time.monotonic()
+
+    if now - _last_check < interval or not _reload_lock.acquire(blocking=False):
+        return
+
+    try:
+        _last_check = now
+        version = read_active_version()
+
+        # a version that is not loaded yet is read from the file when it is
+        if active_model is not None and version != active_model.version:
+            active_model = load_version(version)
+    except Exception as e:
+        print(e)
+    finally:
+        _reload_lock.release()
+
+
+def predict_versioned(X):
+    model = get_active_model()
+    start_time = time.perf_counter()
+
+    predictions = model.predict(X)
+
+    MODEL_INFERENCE.observe(time.perf_counter() - start_time)
+    MODEL_BATCH_SIZE.observe(len(X))
+
+    return predictions, model.version
+
+
+def predict(X):
+    return predict_versioned(X)[0]
+
+
+def enable_lookup_table(low, high):
+    global lookup_range
+
+    lookup_range = (low, high)
+
+    with _versions_lock:
+        models = list(_versions.values())
+
+    for model in models:
+        model.enable_lookup_table(low, high)
+
+
+# loads the active version in a thread once the worker serves requests,
+# requests that need the model before it is ready wait for the same lock
+
+
+def warm_up(app):
+    if app.config["MODEL_LOADING"] != "background":
+        return
+
+    def load():
+        try:
+            get_active_model()
+        except Exception as e:
+            print(e)
+
+    threading.Thread(target=load, name="model-warm-up", daemon=True).start()
+
+
+def init_app(app):
+    if app.config["MODEL_LOADING"] == "eager":
+        get_active_model()
+
+    if app.config["PREDICT_LOOKUP_TABLE"]:
+        enable_lookup_table(
+            app.config["PREDICT_LOOKUP_MIN"], app.config["PREDICT_LOOKUP_MAX"]
+        )
+
+    interval = app.config["MODEL_RELOAD_INTERVAL"]
+
+    if interval > 0:
+        app.before_request(lambda: check_for_update(interval))
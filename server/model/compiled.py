@@ -0,0 +1,215 @@
+import numpy as np
+
+TREE_LEAF = -1
+
+# part of the file name of the dumped model, raised whenever the layout of
+# CompiledBaggedTree changes so files dumped by an older layout are rebuilt
+FORMAT_VERSION = 1
+
+# batches up to this size are walked row by row in plain python
+SMALL_BATCH = 8
+
+# flattens a fitted BaggingClassifier of decision trees into plain arrays
+# so it can be evaluated without sklearn's per-call validation and
+# per-estimator dispatch
+# the node arrays of every tree are concatenated and children holds the
+# global indices of the left and right child of every node, leaves point
+# to themselves so every row can be walked for max_depth steps without
+# masking
+# values hold the normalized class probabilities of each tree mapped to
+# the classes of the ensemble
+# the object only holds plain arrays, so it can be dumped once and loaded
+# back memory-mapped by every worker
+
+
+class CompiledBaggedTree:
+    def __init__(
+        self,
+        classes,
+        n_features,
+        max_depth,
+        roots,
+        feature,
+        threshold,
+        children,
+        values,
+    ):
+        self.classes_ = classes
+        self.n_features_in_ = n_features
+        self.max_depth = max_depth
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.values = values
+        self._lists = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lists"] = None
+        return state
+
+    # memory-mapped arrays are unwrapped into plain ndarray views of the
+    # same pages, np.memmap adds overhead to every operation
+
+    def __setstate__(self, state):
+        self.__dict__.update(
+            {
+                key: np.asarray(value) if isinstance(value, np.ndarray) else value
+                for key, value in state.items()
+            }
+        )
+
+    def is_leaf(self):
+        return self.children[:, 0] == np.arange(len(self.children))
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(
+                f"X has {X.shape[1]} features, but the model expects {self.n_features_in_}"
+            )
+
+        if len(X) <= SMALL_BATCH:
+            return np.array([self._predict_row_proba(row) for row in X.tolist()])
+
+        leaves = self.apply(X)
+        proba = np.zeros((len(X), len(self.classes_)), dtype=np.float64)
+
+        # summed tree by tree in estimator order, like sklearn does,
+        # so the probabilities match to the last bit
+        for tree in range(self.n_estimators):
+            proba += self.values[leaves[:, tree]]
+
+        return proba / self.n_estimators
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    # returns the global index of the leaf reached in every tree
+
+    def apply(self, X):
+        children = self.children.ravel()
+        offsets = np.arange(len(X))[:, None] * self.n_features_in_
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        X = X.ravel()
+
+        for _ in range(self.max_depth):
+            go_right = ~(
+                X.take(offsets + self.feature.take(nodes)) <= self.threshold.take(nodes)
+            )
+            nodes = children.take(2 * nodes + go_right)
+
+        return nodes
+
+    # small batches are walked with plain python lists, numpy dispatch
+    # costs more than the traversal itself at this size
+
+    def _predict_row_proba(self, row):
+        if self._lists is None:
+            self._lists = (
+                self.roots.tolist(),
+                self.feature.tolist(),
+                self.threshold.tolist(),
+                self.children.tolist(),
+                self.values.tolist(),
+            )
+
+        roots, feature, threshold, children, values = self._lists
+        proba = [0.0] * len(self.classes_)
+
+        for node in roots:
+            while children[node][0] != node:
+                if row[feature[node]] <= threshold[node]:
+                    node = children[node][0]
+                else:
+                    node = children[node][1]
+
+            leaf = values[node]
+            for index in range(len(proba)):
+                proba[index] += leaf[index]
+
+        return [value / len(roots) for value in proba]
+
+
+def compile_model(model):
+    n_classes = len(model.classes_)
+    roots, feature, threshold, children, values = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+
+    for estimator, features in zip(model.estimators_, model.estimators_features_):
+        tree = estimator.tree_
+        is_leaf = tree.children_left == TREE_LEAF
+        nodes = np.arange(tree.node_count) + offset
+
+        # sklearn normalizes the leaf counts in DecisionTreeClassifier.predict_proba
+        counts = tree.value[:, 0, : estimator.n_classes_]
+        normalizer = counts.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+
+        tree_values = np.zeros((tree.node_count, n_classes), dtype=np.float64)
+        tree_values[:, estimator.classes_.astype(np.intp)] = counts / normalizer
+
+        roots.append(offset)
+        feature.append(np.where(is_leaf, 0, np.asarray(features)[tree.feature]))
+        threshold.append(tree.threshold)
+        children.append(
+            np.where(
+                is_leaf[:, None],
+                nodes[:, None],
+                np.stack([tree.children_left, tree.children_right], axis=1) + offset,
+            )
+        )
+        values.append(tree_values)
+
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    return CompiledBaggedTree(
+        classes=np.asarray(model.classes_),
+        n_features=model.n_features_in_,
+        max_depth=max_depth,
+        roots=np.array(roots, dtype=np.intp),
+        feature=np.concatenate(feature).astype(np.intp),
+        threshold=np.concatenate(threshold).astype(np.float64),
+        children=np.ascontiguousarray(np.concatenate(children), dtype=np.intp),
+        values=np.concatenate(values),
+    )
+
+
+# compares the compiled ensemble with the original model on random rows
+# that cover every split threshold of the trees
+
+
+def check_parity(model, compiled, n_samples=500, seed=0):
+    rng = np.random.default_rng(seed)
+    thresholds = compiled.threshold[~compiled.is_leaf()]
+    low, high = np.floor(thresholds.min()) - 1, np.ceil(thresholds.max()) + 1
+
+    X = np.vstack(
+        [
+            rng.integers(low, high + 1, size=(n_samples, compiled.n_features_in_)),
+            rng.uniform(low, high, size=(n_samples, compiled.n_features_in_)),
+        ]
+    )
+
+    expected = model.predict_proba(X)
+
+    if not np.array_equal(compiled.predict_proba(X), expected):
+        raise AssertionError("Compiled model probabilities differ from the model")
+
+    if not np.array_equal(compiled.predict(X), model.predict(X)):
+        raise AssertionError("Compiled model predictions differ from the model")
+
+    for row in X[:: max(len(X) // 20, 1)]:
+        if not np.array_equal(compiled.predict_proba(row), model.predict_proba([row])):
+            raise AssertionError("Compiled model single row prediction differs")
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+from .artifacts import artifact_path, write_atomic
+
+BUILD_CHUNK_SIZE = 65536
+
+# every feature is a bounded integer rating, so the model output for the
+# whole feature space fits in one small array indexed by the mixed radix
+# encoding of the features
+# the table stores the index of the predicted class, vectors with a value
+# outside of the range are scored by the fallback model
+
+
+class PredictionLookupTable:
+    def __init__(self, classes, table, low, high, n_features):
+        self.classes_ = classes
+        self.table = table
+        self.low = low
+        self.high = high
+        self.n_features = n_features
+        self.radix = high - low + 1
+        self.place_values = self.radix ** np.arange(n_features - 1, -1, -1)
+
+    def encode(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        in_range = (X >= self.low) & (X <= self.high) & (X == np.floor(X))
+        in_range = in_range.all(axis=1)
+        digits = np.where(in_range[:, None], X, self.low).astype(np.int64) - self.low
+
+        return digits @ self.place_values, in_range
+
+    def predict(self, X, fallback):
+        X = np.asarray(X, dtype=np.float64)
+
+        if len(X) == 1:
+            return self._predict_row(X, fallback)
+
+        codes, in_range = self.encode(X)
+        predictions = self.classes_.take(self.table.take(codes))
+
+        if not in_range.all():
+            predictions[~in_range] = fallback(X[~in_range])
+
+        return predictions
+
+    # a single row is encoded in plain python, numpy dispatch costs more
+    # than the lookup itself
+
+    def _predict_row(self, X, fallback):
+        code = 0
+
+        for value in X[0].tolist():
+            if not (self.low <= value <= self.high and value == int(value)):
+                return fallback(X)
+            code = code * self.radix + int(value) - self.low
+
+        return self.classes_[[self.table[code]]]
+
+
+def feature_space(low, high, n_features, start, stop):
+    radix = high - low + 1
+    codes = np.arange(start, stop, dtype=np.int64)
+    place_values = radix ** np.arange(n_features - 1, -1, -1)
+
+    return (codes[:, None] // place_values % radix + low).astype(np.float64)
+
+
+def build_table(predict, classes, low, high, n_features):
+    size = (high - low + 1) ** n_features
+    table = np.empty(size, dtype=np.uint8)
+    class_index = {label: index for index, label in enumerate(classes.tolist())}
+
+    for start in range(0, size, BUILD_CHUNK_SIZE):
+        stop = min(start + BUILD_CHUNK_SIZE, size)
+        predictions = predict(feature_space(low, high, n_features, start, stop))
+        table[start:stop] = [class_index[label] for label in predictions.tolist()]
+
+    return table
+
+
+# the table is cached next to the model file and keyed by its hash, so it
+# is only built again when the model or the feature range changes
+
+
+def load_or_build(model_path, predict, classes, low, high, n_features):
+    table_path = artifact_path(model_path, f"{low}-{high}.lut.npy")
+
+    if not os.path.exists(table_path):
+        table = build_table(predict, classes, low, high, n_features)
+        write_atomic(table_path, lambda table_file: np.save(table_file, table))
+
+    # read-only mapping, every worker shares the same pages of the table
+    table = np.asarray(np.load(table_path, mmap_mode="r"))
+
+    return PredictionLookupTable(classes, table, low, high, n_features)
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from .bagged_tree import predict_versioned
+from ..schema.dataset import FEATURE_COLUMNS
+from ..utils.metricsUtils import INFERENCE_QUEUE_DELAY
+
+# merges the feature vectors of concurrent requests into a single
+# vectorized model call, predict returns the predictions and the model
+# version that made them and every request gets (prediction, version)
+# max_wait is how long the first vector of a batch waits for others to
+# join it, with 0 only the vectors that are already queued are merged
+# every vector is checked before it is queued, so a bad one fails only its
+# own request and never the batch it would have joined
+
+
+class InferenceScheduler:
+    def __init__(
+        self, predict, max_wait=0.0, max_batch_size=64, window=1000, n_features=None
+    ):
+        self.predict_batch = predict
+        self.n_features = n_features
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+        self._batches = 0
+        self._items = 0
+        self._max_batch = 0
+        self._batch_sizes = deque(maxlen=window)
+        self._queue_delays = deque(maxlen=window)
+        self._model_times = deque(maxlen=window)
+
+    def configure(self, max_wait=None, max_batch_size=None):
+        if max_wait is not None:
+            self.max_wait = max_wait
+        if max_batch_size is not None:
+            self.max_batch_size = max_batch_size
+
+    def predict(self, features):
+        features = self.check_features(features)
+        future = Future()
+
+        with self._condition:
+            self._ensure_started()
+            self._pending.append((features, future, time.perf_counter()))
+            self._condition.notify()
+
+        return future.result()
+
+    # raises ValueError in the calling request for anything that is not a
+    # flat vector of n_features finite numbers
+
+    def check_features(self, features):
+        import numpy as np
+
+        try:
+            features = np.asarray(features, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("Features must be numbers")
+
+        if features.ndim != 1 or (
+            self.n_features is not None and len(features) != self.n_features
+        ):
+            raise ValueError(f"Expected {self.n_features} features")
+
+        if not np.isfinite(features).all():
+            raise ValueError("Features must be finite numbers")
+
+        return features
+
+    # the dispatcher thread is started lazily and again after a fork
+    # since threads do not survive in the child process
+
+    def _ensure_started(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._pending.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="inference-scheduler", daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            deadline = self._pending[0][2] + self.max_wait
+
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            size = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _run(self):
+        import numpy as np
+
+        while True:
+            batch = self._next_batch()
+            start_time = time.perf_counter()
+
+            try:
+                results, version = self.predict_batch(
+                    np.array([features for features, _, _ in batch], dtype=np.float64)
+                )
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._run_one_by_one(batch)
+                continue
+
+            end_time = time.perf_counter()
+
+            for (_, future, queued_at), result in zip(batch, results):
+                future.set_result((result, version))
+                INFERENCE_QUEUE_DELAY.observe(start_time - queued_at)
+
+            with self._condition:
+                self._batches += 1
+                self._items += len(batch)
+                self._max_batch = max(self._max_batch, len(batch))
+                self._batch_sizes.append(len(batch))
+                self._model_times.append(end_time - start_time)
+                self._queue_delays.extend(
+                    start_time - queued_at for _, _, queued_at in batch
+                )
+
+    # a batch the model failed on is scored again vector by vector, so only
+    # the requests whose vectors fail get the error
+
+    def _run_one_by_one(self, batch):
+        for features, future, _ in batch:
+            try:
+                results, version = self.predict_batch(features.reshape(1, -1))
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result((results[0], version))
+
+    def stats(self):
+        import numpy as np
+
+        with self._condition:
+            batch_sizes = np.array(self._batch_sizes, dtype=np.float64)
+            queue_delays = np.array(self._queue_delays, dtype=np.float64) * 1000
+            model_times = np.array(self._model_times, dtype=np.float64) * 1000
+
+            return {
+                "max_wait_ms": self.max_wait * 1000,
+                "max_batch_size": self.max_batch_size,
+                "pending": len(self._pending),
+                "batches": self._batches,
+                "items": self._items,
+                "largest_batch": self._max_batch,
+                "batch_size": _summary(batch_sizes),
+                "queue_delay_ms": _summary(queue_delays),
+                "model_time_ms": _summary(model_times),
+            }
+
+
+def _summary(values):
+    import numpy as np
+
+    if not len(values):
+        return {"mean": 0.0, "p50": 0.0, "p99": 0.0}
+
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+
+scheduler = InferenceScheduler(predict_versioned, n_features=len(FEATURE_COLUMNS))
+
+
+def init_app(app):
+    scheduler.configure(
+        max_wait=app.config["PREDICT_BATCH_MAX_WAIT_MS"] / 1000,
+        max_batch_size=app.config["PREDICT_BATCH_MAX_SIZE"],
+    )
@@ -0,0 +1,58 @@
+from datetime import date
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required
+from ..utils.analyticsUtils import counts_by_period, counts_by_user, feature_averages
+from ..utils.cacheUtils import cached
+
+analytics_bp = Blueprint("analytics", __name__)
+
+
+# employability statistics read from the prediction summary
+# accepts period (day or month), from and to (YYYY-MM-DD) and user_id
+# returns the counts per class by period and by predicting user and the
+# average of every feature per class
+
+
+@analytics_bp.route("/analytics/summary", methods=["GET"])
+@jwt_required()
+@cached("prediction_summary", "users", "class")
+def get_summary():
+    try:
+        period = request.args.get("period", "day")
+
+        if period not in ("day", "month"):
+            return jsonify({"message": "Period must be day or month"}), 400
+
+        filters = {
+            "start": (
+                date.fromisoformat(request.args["from"])
+                if request.args.get("from")
+                else None
+            ),
+            "end": (
+                date.fromisoformat(request.args["to"])
+                if request.args.get("to")
+                else None
+            ),
+            "user_id": request.args.get("user_id"),
+        }
+    except ValueError:
+        return jsonify({"message": "Dates must use the YYYY-MM-DD format"}), 400
+
+    try:
+        return (
+            jsonify(
+                {
+                    "periods": counts_by_period(period, **filters),
+                    "users": counts_by_user(**filters),
+                    "features": feature_averages(**filters),
+                }
+            ),
+            200,
+        )
+    except Exception as e:
+        print(e)
+        return (
+            jsonify({"message": "Something went wrong when getting the analytics"}),
+            500,
+        )
@@ -1,9 +1,19 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required
-from sqlalchemy import desc
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import current_user, jwt_required
+from sqlalchemy import select
 from ..config import db
 from ..middleware.middleware import required_new_student
+from ..utils.cacheUtils import cached
+from ..utils.databaseUtils import read_replica
 from ..schema import dataset
+from ..utils.exportUtils import dataset_statement, export_response
+from ..utils.paginationUtils import paginate, paginate_offset, requested_total
+from ..utils.serializerUtils import (
+    DATASET_COLUMNS,
+    DATASET_FORMATTERS,
+    serialize_rows,
+)
+from ..utils.uploadUtils import parse_rows, save_chunk
 
 dataset_bp = Blueprint("dataset", __name__)
 
@@ -53,35 +63,196 @@ def upload_data():
         )
 
 
+# streams a csv (text/csv or format=csv) or ndjson body of evaluations and
+# saves it chunk by chunk, predict=true also scores the inserted rows
+# returns the accept or reject result of every row
+
+
+@dataset_bp.route("/upload/bulk", methods=["POST"])
+@jwt_required()
+def bulk_upload():
+    upload_format = request.args.get("format")
+
+    if upload_format is None:
+        upload_format = "csv" if request.mimetype == "text/csv" else "ndjson"
+
+    if upload_format not in ("csv", "ndjson"):
+        return jsonify({"message": "Upload format must be csv or ndjson"}), 400
+
+    predict = request.args.get("predict", "false").lower() == "true"
+    chunk_size = current_app.config["BULK_UPLOAD_CHUNK_SIZE"]
+
+    results = []
+    seen_ids = set()
+    chunk = []
+    chunk_lines = []
+
+    def save():
+        existing, predictions = save_chunk(chunk, current_user.user_id, predict)
+
+        for line_number, row in zip(chunk_lines, chunk):
+            student_id = row["student_id"]
+
+            if student_id in existing:
+                results.append(
+                    {
+                        "line": line_number,
+                        "student_id": student_id,
+                        "status": "rejected",
+                        "reason": "Student Id Already Exists",
+                    }
+                )
+            else:
+                result = {
+                    "line": line_number,
+                    "student_id": student_id,
+                    "status": "accepted",
+                }
+                if predict:
+                    result["prediction"] = predictions.get(student_id)
+                results.append(result)
+
+        chunk.clear()
+        chunk_lines.clear()
+
+    try:
+        for line_number, student_id, features, error in parse_rows(
+            request.stream,
+            upload_format,
+            (current_app.config["FEATURE_MIN"], current_app.config["FEATURE_MAX"]),
+        ):
+            if error is None and student_id in seen_ids:
+                error = "Student Id is repeated in the upload"
+
+            if error is not None:
+                results.append(
+                    {
+                        "line": line_number,
+                        "student_id": student_id,
+                        "status": "rejected",
+                        "reason": error,
+                    }
+                )
+                continue
+
+            seen_ids.add(student_id)
+            chunk.append(
+                {
+                    "student_id": student_id,
+                    **dict(zip(dataset.FEATURE_COLUMNS, features)),
+                }
+            )
+            chunk_lines.append(line_number)
+
+            if len(chunk) >= chunk_size:
+                save()
+
+        if chunk:
+            save()
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+
+        saved = sum(result["status"] == "accepted" for result in results)
+        return (
+            jsonify(
+                {
+                    "title": "Opss! Something went wrong",
+                    "message": f"Something went wrong saving the data after <b>{saved}</b> evaluations were saved. Please try again.",
+                    "accepted": saved,
+                }
+            ),
+            500,
+        )
+
+    results.sort(key=lambda result: result["line"])
+    accepted = sum(result["status"] == "accepted" for result in results)
+
+    return (
+        jsonify(
+            {
+                "title": "Evaluations Uploaded",
+                "message": f"<b>{accepted}</b> evaluations have been added to the datasets and <b>{len(results) - accepted}</b> were rejected.",
+                "accepted": accepted,
+                "rejected": len(results) - accepted,
+                "results": results,
+            }
+        ),
+        200,
+    )
+
+
 @dataset_bp.route("/dataset", methods=["GET"])
 @jwt_required()
+@read_replica
+@cached("dataset")
 def get_dataset():
     try:
-        page = request.args.get("page", 1, type=int)
         limit = request.args.get("limit", 10, type=int)
+        page = request.args.get("page", type=int)
+        cursor = request.args.get("cursor")
 
-        paginated_dataset = dataset.Dataset.query.order_by(
-            desc(dataset.Dataset.data_id)
-        ).paginate(page=page, per_page=limit)
+        statement = select(*DATASET_COLUMNS)
+        columns = [dataset.Dataset.data_id]
+        next_cursor = None
+        prev_cursor = None
 
-        total_items = paginated_dataset.total
-        dataset_result = paginated_dataset.items
+        if page is not None and cursor is None:
+            dataset_result = paginate_offset(statement, columns, page, limit)
+        else:
+            dataset_result, next_cursor, prev_cursor = paginate(
+                statement,
+                columns,
+                lambda row: [row.data_id],
+                limit,
+                cursor=cursor,
+            )
 
-        datasets = []
+        total_items = requested_total(dataset.Dataset)
 
-        if dataset_result:
-            for datapoint in dataset_result:
-                datapoint_dict = datapoint.__dict__
-                datapoint_dict = {
-                    key: value
-                    for key, value in datapoint_dict.items()
-                    if not key.startswith("_")
-                }
-                datasets.append(datapoint_dict)
+        datasets = serialize_rows(dataset_result, DATASET_FORMATTERS)
 
-        return jsonify({"total_items": total_items, "datasets": datasets}), 200
+        return (
+            jsonify(
+                {
+                    "total_items": total_items,
+                    "datasets": datasets,
+                    "next_cursor": next_cursor,
+                    "prev_cursor": prev_cursor,
+                }
+            ),
+            200,
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         return (
             jsonify({"message": "Something went wrong when getting the datasets"}),
             500,
         )
+
+
+# streams every dataset row as csv or ndjson, accepts the format, gzip, from,
+# to, class and predicted query parameters
+
+
+@dataset_bp.route("/dataset/export", methods=["GET"])
+@jwt_required()
+def export_dataset():
+    export_format = request.args.get("format", "csv")
+
+    if export_format not in ("csv", "ndjson"):
+        return jsonify({"message": "Export format must be csv or ndjson"}), 400
+
+    try:
+        statement = dataset_statement(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Invalid filter: {e}"}), 400
+
+    return export_response(
+        statement,
+        "dataset",
+        export_format,
+        current_app.config["EXPORT_CHUNK_SIZE"],
+        request.args.get("gzip", "false").lower() == "true",
+    )
@@ -3,6 +3,8 @@ from flask import Blueprint
 from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
 from ..config import db
 from ..schema.users import User
+from ..utils.databaseUtils import mark_written
+from ..utils.userCacheUtils import invalidate_user
 
 mail_bp = Blueprint("mail", __name__)
 
@@ -16,6 +18,9 @@ def confirm_email(token):
         if user:
             user.verified = True
             db.session.commit()
+            # the request has no token, the user's reads go to the primary
+            mark_written(f"user:{user.user_id}")
+            invalidate_user(user.user_id)
             return (
                 "Email successfully verified! You can now log into your account.",
                 200,
@@ -0,0 +1,88 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import current_user, jwt_required
+from datetime import datetime
+from ..config import db
+from ..schema.jobs import ScoringJob
+from ..model import bagged_tree
+from ..utils.jobUtils import submit_job, submit_rescore_job
+
+jobs_bp = Blueprint("jobs", __name__)
+
+
+# queue a job that scores every dataset that has not been predicted yet, or
+# with kind rescore every stored prediction again with modelVersion (the
+# active model by default)
+# returns the job id right away, the progress is polled from /jobs/<job_id>
+
+
+@jobs_bp.route("/jobs", methods=["POST"])
+@jwt_required()
+def create_job():
+    try:
+        request_data = request.get_json(silent=True) or {}
+
+        if request_data.get("kind", "predict") == "rescore":
+            job = submit_rescore_job(
+                current_user.user_id,
+                request_data.get("modelVersion") or bagged_tree.get_active_model().version,
+                request_data.get("chunkSize"),
+            )
+            message = f"The system is predicting the employability of <b>{job.total}</b> students again with model <b>{job.model_version}</b> in the background."
+        else:
+            job = submit_job(current_user.user_id, request_data.get("chunkSize"))
+            message = f"The system is predicting the employability of <b>{job.total}</b> students in the background."
+
+        return (
+            jsonify(
+                {
+                    "title": "Prediction Job Submitted",
+                    "message": message,
+                    "job_id": job.job_id,
+                    "status": job.status,
+                }
+            ),
+            202,
+        )
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 404
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"message": "Error submitting the prediction job"}), 500
+
+
+@jobs_bp.route("/jobs/<string:job_id>", methods=["GET"])
+@jwt_required()
+def get_job(job_id):
+    job = db.session.get(ScoringJob, job_id)
+
+    if not job:
+        return jsonify({"message": "Job not found"}), 404
+
+    elapsed = 0.0
+
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.now()) - job.started_at).total_seconds()
+
+    return (
+        jsonify(
+            {
+                "job_id": job.job_id,
+                "kind": job.kind,
+                "model_version": job.model_version,
+                "status": job.status,
+                "total": job.total,
+                "processed": job.processed,
+                "remaining": max(job.total - job.processed, 0),
+                "progress": job.processed / job.total if job.total else 1.0,
+                "elapsed": elapsed,
+                "throughput": job.processed / elapsed if elapsed else 0.0,
+                "error": job.error,
+                "created_at": job.created_at,
+                "started_at": job.started_at,
+                "finished_at": job.finished_at,
+            }
+        ),
+        200,
+    )
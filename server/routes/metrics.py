@@ -0,0 +1,30 @@
+from flask import Blueprint, Response, jsonify, request
+from flask_jwt_extended import jwt_required
+from ..utils import profilerUtils
+from ..utils.metricsUtils import generate_metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = generate_metrics()
+    return Response(body, content_type=content_type)
+
+
+# switches the sql profiler of every worker, the others follow within
+# SQL_PROFILER_SYNC_INTERVAL seconds
+
+
+@metrics_bp.route("/profiler", methods=["GET", "POST"])
+@jwt_required()
+def profiler():
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+
+        if not isinstance(data.get("enabled"), bool):
+            return jsonify({"message": "enabled must be true or false"}), 400
+
+        profilerUtils.switch(data["enabled"])
+
+    return jsonify({"enabled": profilerUtils.enabled}), 200
@@ -0,0 +1,70 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import current_user, jwt_required
+from ..config import db
+from ..model import bagged_tree
+from ..utils.jobUtils import submit_rescore_job
+
+models_bp = Blueprint("models", __name__)
+
+
+# lists the model versions of the registry and the active one
+
+
+@models_bp.route("/models", methods=["GET"])
+@jwt_required()
+def get_models():
+    try:
+        return (
+            jsonify(
+                {
+                    "active": bagged_tree.get_active_model().version,
+                    "versions": bagged_tree.list_versions(),
+                }
+            ),
+            200,
+        )
+    except Exception as e:
+        print(e)
+        return jsonify({"message": "Something went wrong when getting the models"}), 500
+
+
+# loads a model version and swaps it in as the active model, the other
+# workers follow within MODEL_RELOAD_INTERVAL seconds
+# rescore set to true also queues a job scoring every stored prediction
+# again with the new version
+
+
+@models_bp.route("/models/<string:version>/activate", methods=["POST"])
+@jwt_required()
+def activate_model(version):
+    if version not in bagged_tree.list_versions():
+        return jsonify({"message": "Model version not found"}), 404
+
+    try:
+        request_data = request.get_json(silent=True) or {}
+
+        model = bagged_tree.activate(version)
+
+        job = None
+
+        if request_data.get("rescore"):
+            job = submit_rescore_job(
+                current_user.user_id, version, request_data.get("chunkSize")
+            )
+
+        return (
+            jsonify(
+                {
+                    "title": "Model Activated",
+                    "message": f"Predictions are now made with model <b>{version}</b>.",
+                    "version": model.version,
+                    "load_time": model.load_time,
+                    "job_id": job.job_id if job else None,
+                }
+            ),
+            200,
+        )
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"message": "Error activating the model"}), 500
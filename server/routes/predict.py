@@ -1,11 +1,31 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import current_user, jwt_required
-from sqlalchemy import desc
-from server.middleware.middleware import required_new_student
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from ..config import db
-from ..schema import predictions, dataset, classifications
-from ..model.bagged_tree import model
+from ..schema import predictions, dataset
+from ..model.scheduler import scheduler
+from ..utils.cacheUtils import cached
+from ..utils.databaseUtils import read_replica
+from ..utils.exportUtils import export_response, predictions_statement
+from ..utils.paginationUtils import paginate, paginate_offset, requested_total
+from ..utils.serializerUtils import (
+    PREDICTION_COLUMNS,
+    PREDICTION_FORMATTERS,
+    prediction_joins,
+    serialize_rows,
+)
+from ..utils.predictionUtils import (
+    claim_dataset,
+    get_class_names,
+    insert_dataset,
+    insert_prediction,
+    load_unpredicted,
+    score_rows,
+)
+from ..utils.uploadUtils import read_record
 from datetime import datetime
+import time
 
 predict_bp = Blueprint("predict", __name__)
 
@@ -15,42 +35,29 @@ predict_bp = Blueprint("predict", __name__)
 def predict():
     try:
         request_data = request.get_json()
+        data_id = int(request_data["datasetId"])
 
-        already_predicted = predictions.Prediction.query.filter_by(
-            data_id=request_data["datasetId"]
-        ).first()
+        data = claim_dataset(data_id)
 
-        if already_predicted:
-            return jsonify({"message": "Dataset already predicted!"}), 400
-
-        data = dataset.Dataset.query.filter_by(
-            data_id=request_data["datasetId"]
-        ).first()
-
-        features = []
+        if data is None:
+            db.session.rollback()
 
-        features.append(data.general_appearance)
-        features.append(data.manner_of_speaking)
-        features.append(data.physical_condition)
-        features.append(data.mental_alertness)
-        features.append(data.self_confidence)
-        features.append(data.ability_to_present_ideas)
-        features.append(data.communication_skills)
-        features.append(data.performance_rating)
+            if db.session.get(dataset.Dataset, data_id) is None:
+                return jsonify({"message": "Dataset not found"}), 404
 
-        start_time = datetime.utcnow()
+            return jsonify({"message": "Dataset already predicted!"}), 400
 
-        model_prediction = model.predict([features])
+        start_time = time.perf_counter()
 
-        end_time = datetime.utcnow()
+        model_prediction, model_version = scheduler.predict(list(data[1:]))
 
-        prediction_time = (end_time - start_time).total_seconds()
+        prediction_time = time.perf_counter() - start_time
 
-        class_prediction = classifications.Classification.query.filter_by(
-            class_id=int(model_prediction) + 1
-        ).first()
+        class_id = int(model_prediction) + 1
+        class_names = get_class_names()
 
-        if not class_prediction:
+        if class_id not in class_names:
+            db.session.rollback()
             return (
                 jsonify(
                     {"message": "Classification not found for the predicted value"}
@@ -58,76 +65,113 @@ def predict():
                 404,
             )
 
-        prediction = predictions.Prediction(
-            data_id=request_data["datasetId"],
-            classification_id=int(model_prediction) + 1,
-            user=current_user,
-        )
+        predicted_at = datetime.now()
 
-        data.already_predicted = True
-        db.session.add(prediction)
+        insert_prediction(
+            data_id,
+            class_id,
+            current_user.user_id,
+            predicted_at,
+            data[1:],
+            model_version,
+        )
         db.session.commit()
 
         return (
             jsonify(
                 {
                     "title": "Employability Predicted!",
-                    "body": f"The system has identified student <b>#{data.student_id}</b> as <b>{class_prediction.class_name}</b>! <br> Timestamp: {prediction.prediction_time}",
-                    "prediction": class_prediction.class_name,
+                    "body": f"The system has identified student <b>#{data.student_id}</b> as <b>{class_names[class_id]}</b>! <br> Timestamp: {predicted_at}",
+                    "prediction": class_names[class_id],
                     "prediction_time": prediction_time,
                 }
             ),
             200,
         )
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "Dataset already predicted!"}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "Error inserting prediction"}), 500
 
 
-@predict_bp.route("/upload_predict", methods=["POST"])
+# accepts a list of dataset ids in datasetIds or all set to true to score
+# every dataset that has not been predicted yet
+# rows are scored with a single model call and saved in one transaction
+
+
+@predict_bp.route("/predict/batch", methods=["POST"])
 @jwt_required()
-@required_new_student
-def upload_predict():
+def predict_batch():
     try:
+        start_time = time.perf_counter()
         request_data = request.get_json()
 
-        data_features = dataset.Dataset()
+        if request_data.get("all"):
+            dataset_ids = None
+        else:
+            dataset_ids = [int(data_id) for data_id in request_data["datasetIds"]]
+
+            if not dataset_ids:
+                return jsonify({"message": "No dataset ids to predict"}), 400
+
+        rows = load_unpredicted(dataset_ids)
 
-        data_features.student_id = (request_data["studentId"],)
-        data_features.general_appearance = (request_data["features"][0],)
-        data_features.manner_of_speaking = (request_data["features"][1],)
-        data_features.physical_condition = (request_data["features"][2],)
-        data_features.mental_alertness = (request_data["features"][3],)
-        data_features.self_confidence = (request_data["features"][4],)
-        data_features.ability_to_present_ideas = (request_data["features"][5],)
-        data_features.communication_skills = (request_data["features"][6],)
-        data_features.performance_rating = (request_data["features"][7],)
+        results, prediction_time = score_rows(rows, current_user.user_id)
 
-        db.session.add(data_features)
         db.session.commit()
 
-        data_id = data_features.data_id
+        skipped = []
 
-        data = dataset.Dataset.query.filter_by(data_id=data_id).first()
+        if dataset_ids is not None:
+            scored_ids = {row.data_id for row in rows}
+            skipped = [
+                data_id
+                for data_id in dict.fromkeys(dataset_ids)
+                if data_id not in scored_ids
+            ]
 
-        features = []
+        return (
+            jsonify(
+                {
+                    "title": "Employability Predicted!",
+                    "message": f"The system has predicted the employability of <b>{len(results)}</b> students.",
+                    "predictions": results,
+                    "skipped": skipped,
+                    "prediction_time": prediction_time,
+                    "total_time": time.perf_counter() - start_time,
+                }
+            ),
+            200,
+        )
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"message": "Error inserting predictions"}), 500
 
-        features.append(data.general_appearance)
-        features.append(data.manner_of_speaking)
-        features.append(data.physical_condition)
-        features.append(data.mental_alertness)
-        features.append(data.self_confidence)
-        features.append(data.ability_to_present_ideas)
-        features.append(data.communication_skills)
-        features.append(data.performance_rating)
 
-        model_prediction = model.predict([features])
+@predict_bp.route("/upload_predict", methods=["POST"])
+@jwt_required()
+def upload_predict():
+    try:
+        request_data = request.get_json()
+
+        # checked before the features join a batch shared with other requests
+        try:
+            student_id, features = read_record(
+                request_data,
+                (current_app.config["FEATURE_MIN"], current_app.config["FEATURE_MAX"]),
+            )
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+            return jsonify({"message": f"Invalid evaluation: {e}"}), 400
+
+        model_prediction, model_version = scheduler.predict(features)
 
-        class_prediction = classifications.Classification.query.filter_by(
-            class_id=int(model_prediction) + 1
-        ).first()
+        class_id = int(model_prediction) + 1
+        class_names = get_class_names()
 
-        if not class_prediction:
+        if class_id not in class_names:
             return (
                 jsonify(
                     {"message": "Classification not found for the predicted value"}
@@ -135,75 +179,142 @@ def upload_predict():
                 404,
             )
 
-        prediction = predictions.Prediction(
-            data_id=data_id,
-            classification_id=int(model_prediction) + 1,
-            user=current_user,
-        )
+        predicted_at = datetime.now()
 
-        data.already_predicted = True
-        db.session.add(prediction)
+        # the unique student id rejects students that already exist, so there
+        # is no need to look them up first
+        data_id = insert_dataset(
+            {
+                "student_id": student_id,
+                **dict(zip(dataset.FEATURE_COLUMNS, features)),
+                "uploaded_at": predicted_at,
+                "already_predicted": True,
+            }
+        )
+        insert_prediction(
+            data_id,
+            class_id,
+            current_user.user_id,
+            predicted_at,
+            features,
+            model_version,
+        )
         db.session.commit()
 
         return (
             jsonify(
                 {
                     "title": "Employability Predicted!",
-                    "message": f"Dataset has been successfully uploaded in the database and has identified student <b>#{data.student_id}</b> as <b>{class_prediction.class_name}</b>! <br> Timestamp: <b>{prediction.prediction_time}</b>",
+                    "message": f"Dataset has been successfully uploaded in the database and has identified student <b>#{student_id}</b> as <b>{class_names[class_id]}</b>! <br> Timestamp: <b>{predicted_at}</b>",
                 }
             ),
             200,
         )
 
+    except IntegrityError:
+        db.session.rollback()
+        return (
+            jsonify(
+                {
+                    "title": "Student Id Already Exists!",
+                    "message": "The data you are trying to upload already exists. Please check the student id and try again.",
+                }
+            ),
+            400,
+        )
     except Exception as e:
         print(e)
         db.session.rollback()
         return (
             jsonify(
                 {
-                    "title": "Employability Predicted!",
-                    "message": f"Dataset has been successfully uploaded in the database and has identified student <b>#{data.student_id}</b> as <b>{class_prediction.class_name}</b>! <br> Timestamp: <b>{prediction.prediction_time}</b>",
+                    "title": "Opss! Something went wrong",
+                    "message": "Something went wrong saving the data. Please try again.",
                 }
             ),
             500,
         )
 
 
+@predict_bp.route("/predict/scheduler", methods=["GET"])
+@jwt_required()
+def scheduler_stats():
+    return jsonify(scheduler.stats()), 200
+
+
 @predict_bp.route("/predictions", methods=["GET"])
 @jwt_required()
+@read_replica
+@cached("predictions", "users", "class")
 def get_predictions():
     try:
-        page = request.args.get("page", 1, type=int)
         limit = request.args.get("limit", 10, type=int)
+        page = request.args.get("page", type=int)
+        cursor = request.args.get("cursor")
+
+        statement = prediction_joins(select(*PREDICTION_COLUMNS))
+        columns = [predictions.Prediction.prediction_id]
+        next_cursor = None
+        prev_cursor = None
+
+        if page is not None and cursor is None:
+            rows = paginate_offset(statement, columns, page, limit)
+        else:
+            rows, next_cursor, prev_cursor = paginate(
+                statement,
+                columns,
+                lambda row: [row.prediction_id],
+                limit,
+                cursor=cursor,
+            )
 
-        paginated_predictions = predictions.Prediction.query.order_by(
-            desc(predictions.Prediction.prediction_id)
-        ).paginate(page=page, per_page=limit)
-
-        total_items = paginated_predictions.total
-
-        prediction_items = []
+        total_items = requested_total(predictions.Prediction)
 
-        for prediction_item in paginated_predictions:
-            prediction_dict = {
-                "prediction_id": prediction_item.prediction_id,
-                "classification": prediction_item.classification.class_name,
-                "dataset_id": prediction_item.data_id,
-                "predicted_by": prediction_item.user.username,
-                "email": prediction_item.user.email,
-                "prediction_time": prediction_item.prediction_time.strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                ),
-            }
-            prediction_items.append(prediction_dict)
+        prediction_items = serialize_rows(rows, PREDICTION_FORMATTERS)
 
         return (
-            jsonify({"total_items": total_items, "predictions": prediction_items}),
+            jsonify(
+                {
+                    "total_items": total_items,
+                    "predictions": prediction_items,
+                    "next_cursor": next_cursor,
+                    "prev_cursor": prev_cursor,
+                }
+            ),
             200,
         )
 
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     except Exception as e:
         return (
             jsonify({"message": "Something went wrong when getting the datasets"}),
             500,
         )
+
+
+# streams every predictions row as csv or ndjson, accepts the format, gzip, from,
+# to, class and predicted query parameters
+
+
+@predict_bp.route("/predictions/export", methods=["GET"])
+@jwt_required()
+def export_predictions():
+    export_format = request.args.get("format", "csv")
+
+    if export_format not in ("csv", "ndjson"):
+        return jsonify({"message": "Export format must be csv or ndjson"}), 400
+
+    try:
+        statement = predictions_statement(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Invalid filter: {e}"}), 400
+
+    return export_response(
+        statement,
+        "predictions",
+        export_format,
+        current_app.config["EXPORT_CHUNK_SIZE"],
+        request.args.get("gzip", "false").lower() == "true",
+    )
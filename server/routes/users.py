@@ -1,60 +1,116 @@
 import os
 from flask import Blueprint, request, url_for, jsonify
 from ..schema.blocklist import TokenBlocklist
-from ..schema.refresh_token import RefreshToken
 from ..schema.users import User
 from datetime import datetime, timezone
-from ..config import db, mail
-from flask_mail import Message
+from ..config import db
+from ..utils.cacheUtils import cached
+from ..utils.databaseUtils import mark_written, read_replica
+from ..utils.outboxUtils import notify, queue_email
+from ..utils.paginationUtils import paginate, paginate_offset, requested_total
+from ..utils.passwordUtils import PasswordPoolBusy
+from ..utils.refreshTokenUtils import (
+    REFRESH_HEADER,
+    has_active_refresh_token,
+    issue_refresh_token,
+    presented_token,
+    revoke_refresh_tokens,
+    rotate_refresh_token,
+    set_refresh_cookie,
+    unset_refresh_cookie,
+)
+from ..utils.revocationUtils import revoke
+from ..utils.serializerUtils import USER_COLUMNS, USER_FORMATTERS, serialize_rows
 from flask_jwt_extended import (
     create_access_token,
-    create_refresh_token,
     current_user,
     get_jwt,
     jwt_required,
 )
 from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import select
 from flask import current_app
 
 
 user_bp = Blueprint("user", __name__)
 
+# only indexed columns can be sorted on
+USER_SORT_KEYS = {
+    "user_id": User.user_id,
+    "username": User.username,
+    "email": User.email,
+    "created_at": User.created_at,
+}
+
+
+def password_pool_busy(error):
+    return (
+        jsonify({"message": "Too many requests right now, please try again shortly"}),
+        503,
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
 # get list of users by page with a default size of 10
 # accepts sorting query by using sort_by and sort_order
+# pages are read with the cursor of the previous response, page is still
+# accepted for older clients
 # returns a list of users
 
 
 @user_bp.route("/users", methods=["GET"])
+@read_replica
+@cached("users")
 def get_users():
     try:
-        page = request.args.get("page", 1, type=int)
+        page = request.args.get("page", type=int)
         item = request.args.get("item", 10, type=int)
+        cursor = request.args.get("cursor")
         sort_by = request.args.get("sort_by", "user_id")
         sort_order = request.args.get("sort_order", "asc")
 
-        sort_column = getattr(User, sort_by)
+        if sort_by not in USER_SORT_KEYS or sort_order not in ("asc", "desc"):
+            return jsonify({"message": "Invalid sort_by or sort_order"}), 400
 
-        if sort_order == "asc":
-            sort_column = sort_column.asc()
-        elif sort_order == "desc":
-            sort_column = sort_column.desc()
+        # user_id breaks ties so the order stays total for the cursors
+        columns = [USER_SORT_KEYS[sort_by]]
+        if sort_by != "user_id":
+            columns.append(User.user_id)
 
-        users = User.query.order_by(sort_column).paginate(page=page, per_page=item)
+        statement = select(*USER_COLUMNS)
+        descending = sort_order == "desc"
+        next_cursor = None
+        prev_cursor = None
+
+        if page is not None and cursor is None:
+            users = paginate_offset(statement, columns, page, item, descending)
+        else:
+            users, next_cursor, prev_cursor = paginate(
+                statement,
+                columns,
+                lambda row: [getattr(row, column.key) for column in columns],
+                item,
+                descending,
+                cursor,
+            )
 
         if users:
-            users_list = []
-            for user in users:
-                user_dict = {
-                    "user_id": user.user_id,
-                    "username": user.username,
-                    "email": user.email,
-                    "verified": user.verified,
-                    "created_at": user.created_at,
-                }
-                users_list.append(user_dict)
-            return jsonify({"users": users_list}), 200
+            users_list = serialize_rows(users, USER_FORMATTERS)
+            return (
+                jsonify(
+                    {
+                        "users": users_list,
+                        "total_items": requested_total(User),
+                        "next_cursor": next_cursor,
+                        "prev_cursor": prev_cursor,
+                    }
+                ),
+                200,
+            )
         else:
             return jsonify({"message": "No users found"}), 404
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         return jsonify({"message": str(e)}), 500
 
@@ -63,7 +119,7 @@ def get_users():
 # check empty fields
 # store credentials
 # initialize email token
-# create and send email msg
+# queue the email msg with the new user
 # return creation message
 
 
@@ -85,21 +141,23 @@ def register_user():
         )
 
         db.session.add(new_user)
-        db.session.commit()
 
         serializer = URLSafeTimedSerializer(os.getenv("SECRET_KEY"))
         token = serializer.dumps(data["email"], salt="email-confirm")
 
         verification_url = url_for("mail.confirm_email", token=token, _external=True)
 
-        message = Message(
+        # the email is stored with the user and sent by the outbox dispatcher
+        queue_email(
             subject="Confirm Your Email",
             sender=os.getenv("MAIL_USERNAME"),
             recipients=[data["email"]],
             body=f"Please click the following link to verify your email: \n{verification_url}",
         )
 
-        mail.send(message)
+        db.session.commit()
+        mark_written(f"user:{new_user.user_id}")
+        notify()
 
         return (
             jsonify(
@@ -111,6 +169,9 @@ def register_user():
             201,
         )
 
+    except PasswordPoolBusy as e:
+        db.session.rollback()
+        return password_pool_busy(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "Oops! Something went wrong"}), 400
@@ -121,6 +182,8 @@ def register_user():
 # check if the email exists in the database
 # check if password is correct
 # Generate JWT token
+# clients that send X-Refresh-Token also get the refresh token in the body,
+# the others only in the httpOnly cookie
 
 
 @user_bp.route("/login", methods=["POST"])
@@ -156,26 +219,28 @@ def login_user():
             "create_at": user.created_at.strftime("%Y-%m-%d %H:%M:%S"),
         }
 
-        access_token = create_access_token(identity=user.user_id)
-        refresh_token = create_refresh_token(identity=user.user_id)
+        if user.needs_rehash():
+            user.hash_password(data["password"])
 
-        stored_refresh = RefreshToken(
-            token=refresh_token,
-            user=user,
-        )
+        access_token = create_access_token(identity=user.user_id)
+        refresh_token = issue_refresh_token(user.user_id)
 
-        db.session.add(stored_refresh)
         db.session.commit()
+        # the new refresh token is written before the user has a token
+        mark_written(f"user:{user.user_id}")
 
-        return (
-            jsonify(
-                {
-                    "user": user_metadata,
-                    "accessToken": access_token,
-                }
-            ),
-            200,
-        )
+        body = {
+            "user": user_metadata,
+            "accessToken": access_token,
+        }
+
+        if REFRESH_HEADER in request.headers:
+            body["refreshToken"] = refresh_token
+
+        return set_refresh_cookie(jsonify(body), refresh_token), 200
+    except PasswordPoolBusy as e:
+        db.session.rollback()
+        return password_pool_busy(e)
     except Exception as e:
         print(e)
         db.session.rollback()
@@ -188,17 +253,17 @@ def logout_user():
     jti = get_jwt()["jti"]
     sub = get_jwt()["sub"]
     now = datetime.now(timezone.utc)
-    current_refresh_token = RefreshToken.query.filter_by(
-        user_id=sub, blocklisted=False
-    ).first()
-    current_refresh_token.blocklisted = True
+    # without a presented token every session of the user is ended
+    revoke_refresh_tokens(sub, presented_token())
     db.session.add(TokenBlocklist(jti=jti, created_at=now))
     db.session.commit()
-    return jsonify(msg="JWT revoked")
+    revoke(jti, now)
+    return unset_refresh_cookie(jsonify(msg="JWT revoked"))
 
 
 @user_bp.route("/user", methods=["GET"])
 @jwt_required()
+@cached("users", per_user=True)
 def user_details():
     try:
         return (
@@ -218,23 +283,40 @@ def user_details():
         return jsonify(message="Error")
 
 
-@user_bp.route("/<string:user_id>/refresh_token", methods=["GET"])
+# the presented refresh token is looked up by its hash and rotated, the new
+# one replaces the cookie and is returned in the body to header clients
+# only POST is accepted, so the cookie is not sent along by navigations
+# from other sites
+
+
+@user_bp.route("/<string:user_id>/refresh_token", methods=["POST"])
 def new_access_token(user_id):
+    try:
+        token = presented_token()
+
+        if token is None:
+            required = current_app.config["REFRESH_TOKEN_REQUIRED"]
 
-    user = User.query.get_or_404(user_id)
+            if required or not has_active_refresh_token(user_id):
+                return jsonify({"message": "No valid token found"}), 404
 
-    if not user:
-        return jsonify({"message": "User not found"}), 404
+            return jsonify({"accessToken": create_access_token(identity=user_id)}), 200
 
-    refresh_tokens = user.refresh_token
-    access_token = None
+        new_token = rotate_refresh_token(user_id, token)
+
+        if new_token is None:
+            return (
+                unset_refresh_cookie(jsonify({"message": "No valid token found"})),
+                404,
+            )
 
-    for token in refresh_tokens:
-        if not token.blocklisted:
-            access_token = create_access_token(identity=user.user_id)
-            break
+        body = {"accessToken": create_access_token(identity=user_id)}
 
-    if access_token:
-        return jsonify({"accessToken": access_token}), 200
-    else:
-        return jsonify({"message": "No valid token found"}), 404
+        if request.headers.get(REFRESH_HEADER):
+            body["refreshToken"] = new_token
+
+        return set_refresh_cookie(jsonify(body), new_token), 200
+    except Exception as e:
+        print(e)
+        db.session.rollback()
+        return jsonify({"message": "Oops! Something went wrong"}), 500
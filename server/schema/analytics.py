@@ -0,0 +1,25 @@
+from ..config import db
+
+# one row per day, predicting user and class with the number of predictions
+# and the sum of every feature, kept up to date as predictions are inserted
+# so the analytics never scan the predictions table
+# feature sums are named <feature>_total
+
+
+class PredictionSummary(db.Model):
+    __tablename__ = "prediction_summary"
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.String(36), db.ForeignKey("users.user_id"), primary_key=True)
+    classification_id = db.Column(
+        db.Integer, db.ForeignKey("class.class_id"), primary_key=True
+    )
+    predictions = db.Column(db.Integer, nullable=False, default=0)
+    general_appearance_total = db.Column(db.BigInteger, nullable=False, default=0)
+    manner_of_speaking_total = db.Column(db.BigInteger, nullable=False, default=0)
+    physical_condition_total = db.Column(db.BigInteger, nullable=False, default=0)
+    mental_alertness_total = db.Column(db.BigInteger, nullable=False, default=0)
+    self_confidence_total = db.Column(db.BigInteger, nullable=False, default=0)
+    ability_to_present_ideas_total = db.Column(db.BigInteger, nullable=False, default=0)
+    communication_skills_total = db.Column(db.BigInteger, nullable=False, default=0)
+    performance_rating_total = db.Column(db.BigInteger, nullable=False, default=0)
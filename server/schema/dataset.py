@@ -2,6 +2,18 @@ from ..config import db
 from datetime import datetime
 import pytz
 
+FEATURE_COLUMNS = (
+    "general_appearance",
+    "manner_of_speaking",
+    "physical_condition",
+    "mental_alertness",
+    "self_confidence",
+    "ability_to_present_ideas",
+    "communication_skills",
+    "performance_rating",
+)
+
+
 class Dataset(db.Model):
     __tablename__ = "dataset"
 
@@ -0,0 +1,25 @@
+from ..config import db
+from datetime import datetime
+import uuid
+
+
+class ScoringJob(db.Model):
+    __tablename__ = "scoring_jobs"
+
+    job_id = db.Column(
+        db.String(36), primary_key=True, default=lambda: uuid.uuid4().hex
+    )
+    user_id = db.Column(db.String(36), db.ForeignKey("users.user_id"), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued", index=True)
+    kind = db.Column(db.String(20), nullable=False, default="predict")
+    model_version = db.Column(db.String(64), nullable=True)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    max_data_id = db.Column(db.Integer, nullable=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    worker_id = db.Column(db.String(64), nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,28 @@
+from ..config import db
+from datetime import datetime
+
+# emails are written here in the transaction of the change that sends them
+# and delivered by the outbox dispatcher, a row is claimed by setting it to
+# sending until claimed_until and goes back to pending with a later
+# next_attempt_at when delivery fails
+
+
+class OutboxEmail(db.Model):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(120), nullable=True)
+    recipients = db.Column(db.JSON, nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(64), nullable=True)
+    claimed_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True, index=True)
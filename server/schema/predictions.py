@@ -7,12 +7,15 @@ class Prediction(db.Model):
     __tablename__ = "predictions"
 
     prediction_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    data_id = db.Column(db.Integer, db.ForeignKey("dataset.data_id"), nullable=False)
+    data_id = db.Column(
+        db.Integer, db.ForeignKey("dataset.data_id"), unique=True, nullable=False
+    )
     classification_id = db.Column(
         db.Integer, db.ForeignKey("class.class_id"), nullable=False
     )
     user_id = db.Column(db.String(36), db.ForeignKey("users.user_id"), nullable=False)
     prediction_time = db.Column(db.DateTime, default=datetime.now)
+    model_version = db.Column(db.String(64), nullable=True, index=True)
     classification = db.relationship(
         "Classification", back_populates="prediction_details"
     )
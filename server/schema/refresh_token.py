@@ -2,12 +2,21 @@ from datetime import datetime
 from ..config import db
 import uuid
 
+# only the sha256 of a refresh token is stored, a token is looked up by the
+# hash of the one the client presents
+# the (user_id, blocklisted) index serves the active tokens of a user and
+# expires_at the periodic purge
+
 
 class RefreshToken(db.Model):
     __tablename__ = "refresh_token"
+    __table_args__ = (
+        db.Index("ix_refresh_token_user_id_blocklisted", "user_id", "blocklisted"),
+    )
 
     token_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String, db.ForeignKey("users.user_id"), nullable=False)
-    token = db.Column(db.String, unique=True, nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
     blocklisted = db.Column(db.Boolean, nullable=False, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
@@ -1,4 +1,5 @@
-from ..config import db, bcrypt
+from ..config import db
+from ..utils import passwordUtils
 import uuid
 from datetime import datetime
 import pytz
@@ -12,7 +13,7 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     verified = db.Column(db.Boolean, default=False)
     password = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now(tz=pytz.UTC))
+    created_at = db.Column(db.DateTime, default=datetime.now(tz=pytz.UTC), index=True)
     predictions = db.relationship("Prediction", backref="user")
     refresh_token = db.relationship("RefreshToken", backref="user")
 
@@ -22,10 +23,13 @@ class User(db.Model):
         self.hash_password(password)
 
     def hash_password(self, password):
-        self.password = bcrypt.generate_password_hash(password).decode("utf-8")
+        self.password = passwordUtils.hash_password(password)
 
     def authenticate(self, password):
-        return bcrypt.check_password_hash(self.password, password)
+        return passwordUtils.check_password(password, self.password)
+
+    def needs_rehash(self):
+        return passwordUtils.needs_rehash(self.password)
 
     def __repr__(self):
         return "<User %r>" % self.username
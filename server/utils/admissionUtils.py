@@ -0,0 +1,315 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, jsonify, request
+from flask_jwt_extended import decode_token
+from .metricsUtils import ADMISSION_DECISIONS, ADMISSION_QUEUE_WAIT
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# scoring requests and logins are admitted before the view runs, every
+# group of routes has a number of requests it serves at once across all
+# workers of the host, a bounded queue of requests waiting up to a deadline
+# for one of them, and a token bucket per user, or per ip without a token
+# anything over those limits is answered at once with 429 or 503 and a
+# Retry-After instead of waiting for a worker until the client gives up
+# the state lives in one memory-mapped file per group like the table
+# versions, slots hold the pid of their process so the slots of a worker
+# that died are taken over
+
+SLOT = struct.Struct("Q")
+BUCKET = struct.Struct("Qdd")
+BUCKETS = 4096
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+class AdmissionGroup:
+    def __init__(self, name, concurrency, queue_size, queue_timeout, rate, burst):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+        self.path = None
+        self.lock = threading.Lock()
+        self._map = None
+        self._fd = None
+        self._pid = None
+
+    @property
+    def size(self):
+        return SLOT.size * (self.concurrency + self.queue_size) + BUCKET.size * BUCKETS
+
+    # the file is mapped again after a fork so every process holds its own
+    # descriptor for the record locks, without fcntl the limits only apply
+    # to this process
+
+    def _mapped(self):
+        if self._pid != os.getpid():
+            if self.path is None or fcntl is None:
+                self._map = mmap.mmap(-1, self.size)
+                self._fd = None
+            else:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+                if os.fstat(fd).st_size < self.size:
+                    os.ftruncate(fd, self.size)
+
+                self._map = mmap.mmap(fd, self.size)
+                self._fd = fd
+
+            self._pid = os.getpid()
+
+        return self._map
+
+    @contextmanager
+    def _locked(self):
+        with self.lock:
+            state = self._mapped()
+
+            if self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+
+            try:
+                yield state
+            finally:
+                if self._fd is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    # slots 0 to concurrency - 1 are running requests, the rest are the queue
+
+    def _take_slot(self, state, first, count):
+        free = None
+
+        for index in range(first, first + count):
+            pid = SLOT.unpack_from(state, index * SLOT.size)[0]
+
+            if pid == 0:
+                free = index
+                break
+
+        if free is None:
+            for index in range(first, first + count):
+                if not alive(SLOT.unpack_from(state, index * SLOT.size)[0]):
+                    free = index
+                    break
+
+        if free is not None:
+            SLOT.pack_into(state, free * SLOT.size, os.getpid())
+
+        return free
+
+    def _acquire(self, queue_slot=None):
+        with self._locked() as state:
+            slot = self._take_slot(state, 0, self.concurrency)
+
+            if slot is not None and queue_slot is not None:
+                SLOT.pack_into(state, queue_slot * SLOT.size, 0)
+
+            return slot
+
+    def _enqueue(self):
+        with self._locked() as state:
+            return self._take_slot(state, self.concurrency, self.queue_size)
+
+    def release(self, slot):
+        with self._locked() as state:
+            SLOT.pack_into(state, slot * SLOT.size, 0)
+
+    # returns 0 when the request may go on, otherwise the seconds until the
+    # bucket of the key holds a token again
+    # buckets are direct mapped by the hash of the key, a key that lands on
+    # the bucket of another starts with a full one
+    # the file outlives the processes and reboots, so buckets hold wall
+    # clock times, a time from the future after the clock was set back
+    # adds no tokens instead of taking them away
+
+    def take_token(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little") or 1
+        offset = SLOT.size * (self.concurrency + self.queue_size)
+        offset += (key_hash % BUCKETS) * BUCKET.size
+        now = time.time()
+
+        with self._locked() as state:
+            stored_hash, tokens, updated_at = BUCKET.unpack_from(state, offset)
+
+            if stored_hash != key_hash:
+                tokens, updated_at = float(self.burst), now
+
+            elapsed = max(now - updated_at, 0)
+            tokens = min(self.burst, tokens + elapsed * self.rate)
+
+            if tokens < 1:
+                BUCKET.pack_into(state, offset, key_hash, tokens, now)
+                return (1 - tokens) / self.rate
+
+            BUCKET.pack_into(state, offset, key_hash, tokens - 1, now)
+            return 0
+
+    # returns the running slot of the request or the rejection
+
+    def admit(self, key):
+        if self.rate > 0:
+            retry_after = self.take_token(key)
+
+            if retry_after:
+                ADMISSION_DECISIONS.labels(self.name, "rate_limited").inc()
+                return None, rejection(429, retry_after)
+
+        if self.concurrency <= 0:
+            ADMISSION_DECISIONS.labels(self.name, "admitted").inc()
+            return None, None
+
+        slot = self._acquire()
+
+        if slot is not None:
+            ADMISSION_DECISIONS.labels(self.name, "admitted").inc()
+            return slot, None
+
+        queue_slot = self._enqueue() if self.queue_size > 0 else None
+
+        if queue_slot is None:
+            ADMISSION_DECISIONS.labels(self.name, "queue_full").inc()
+            return None, rejection(503, self.queue_timeout)
+
+        # other processes release their slots without notifying anyone, so
+        # the queue polls with a growing pause
+        start_time = time.monotonic()
+        deadline = start_time + self.queue_timeout
+        pause = 0.001
+
+        while True:
+            slot = self._acquire(queue_slot)
+
+            if slot is not None:
+                ADMISSION_QUEUE_WAIT.labels(self.name).observe(
+                    time.monotonic() - start_time
+                )
+                ADMISSION_DECISIONS.labels(self.name, "queued").inc()
+                return slot, None
+
+            if time.monotonic() >= deadline:
+                self.release(queue_slot)
+                ADMISSION_DECISIONS.labels(self.name, "timeout").inc()
+                return None, rejection(503, self.queue_timeout)
+
+            time.sleep(min(pause, max(deadline - time.monotonic(), 0)))
+            pause = min(pause * 2, 0.02)
+
+
+def rejection(status, retry_after):
+    message = (
+        "Too many requests, please slow down"
+        if status == 429
+        else "The server is busy, please try again shortly"
+    )
+
+    return (
+        jsonify({"message": message}),
+        status,
+        {"Retry-After": str(max(math.ceil(retry_after), 1))},
+    )
+
+
+groups = {}
+
+
+def request_group():
+    if request.endpoint == "user.login_user":
+        return groups.get("login")
+
+    if request.blueprint == "predict" and request.method == "POST":
+        return groups.get("predict")
+
+    return None
+
+
+# the bucket of a request with a valid access token belongs to its user,
+# the token is only decoded here, jwt_required still checks it in the view
+
+
+def client_key():
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+
+    if scheme == "Bearer" and token:
+        try:
+            return f"user:{decode_token(token)['sub']}"
+        except Exception:
+            pass
+
+    return f"ip:{request.remote_addr}"
+
+
+def before_request():
+    group = request_group()
+
+    if group is None:
+        return None
+
+    slot, response = group.admit(client_key())
+
+    if slot is not None:
+        g.admission_slot = (group, slot)
+
+    return response
+
+
+def teardown_request(exception):
+    admission_slot = g.pop("admission_slot", None)
+
+    if admission_slot is not None:
+        group, slot = admission_slot
+        group.release(slot)
+
+
+def load_group(app, name):
+    prefix = f"ADMISSION_{name.upper()}_"
+    group = AdmissionGroup(
+        name,
+        app.config[prefix + "CONCURRENCY"],
+        app.config[prefix + "QUEUE_SIZE"],
+        app.config[prefix + "QUEUE_TIMEOUT"],
+        app.config[prefix + "RATE"],
+        app.config[prefix + "BURST"],
+    )
+    state_dir = app.config["ADMISSION_STATE_DIR"] or tempfile.gettempdir()
+    os.makedirs(state_dir, exist_ok=True)
+
+    # the layout of the file follows the limits, so it is named after them
+    group.path = os.path.join(
+        state_dir, f"seps-admission-{name}-{group.concurrency}-{group.queue_size}"
+    )
+
+    return group
+
+
+def init_app(app):
+    if not app.config["ADMISSION_ENABLED"]:
+        return
+
+    for name in ("predict", "login"):
+        groups[name] = load_group(app, name)
+
+    app.before_request(before_request)
+    app.teardown_request(teardown_request)
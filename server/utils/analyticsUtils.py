@@ -0,0 +1,235 @@
+from collections import defaultdict
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from ..config import db
+from ..schema.analytics import PredictionSummary
+from ..schema.classifications import Classification
+from ..schema.dataset import Dataset, FEATURE_COLUMNS
+from ..schema.predictions import Prediction
+from ..schema.users import User
+
+TOTAL_COLUMNS = [f"{column}_total" for column in FEATURE_COLUMNS]
+SUMMARY_KEY = ["day", "user_id", "classification_id"]
+SUMMARY_VALUES = ["predictions", *TOTAL_COLUMNS]
+
+analytics_cli = AppGroup("analytics", help="Maintain the prediction summary.")
+
+
+# adds a list of (prediction_time, user_id, class_id, features) to the
+# summary in the current transaction, predictions are grouped first so a
+# batch costs one upsert per day, user and class
+# sign=-1 takes predictions out again, for example when they are re-scored
+# the caller commits together with the predictions
+
+
+def record_predictions(entries, sign=1):
+    groups = defaultdict(lambda: [0] * len(SUMMARY_VALUES))
+
+    for prediction_time, user_id, class_id, features in entries:
+        totals = groups[(prediction_time.date(), user_id, class_id)]
+        totals[0] += sign
+        for index, value in enumerate(features, start=1):
+            totals[index] += sign * int(value)
+
+    if not groups:
+        return
+
+    # rows are always upserted in key order so concurrent batches lock the
+    # summary rows in the same order
+    rows = [
+        {**dict(zip(SUMMARY_KEY, key)), **dict(zip(SUMMARY_VALUES, totals))}
+        for key, totals in sorted(groups.items())
+    ]
+
+    statement = upsert_statement()
+
+    if statement is not None:
+        db.session.execute(statement, rows)
+        return
+
+    for row in rows:
+        add_to_summary(row)
+
+
+def upsert_statement():
+    table = PredictionSummary.__table__
+    dialect = db.engine.dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = dialect_insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=SUMMARY_KEY,
+            set_={
+                column: table.c[column] + statement.excluded[column]
+                for column in SUMMARY_VALUES
+            },
+        )
+
+    if dialect in ("mysql", "mariadb"):
+        statement = mysql.insert(table)
+        return statement.on_duplicate_key_update(
+            {
+                column: table.c[column] + statement.inserted[column]
+                for column in SUMMARY_VALUES
+            }
+        )
+
+    return None
+
+
+# fallback for backends without an upsert
+
+
+def add_to_summary(row):
+    table = PredictionSummary.__table__
+    updated = db.session.execute(
+        update(table)
+        .where(*[table.c[column] == row[column] for column in SUMMARY_KEY])
+        .values({column: table.c[column] + row[column] for column in SUMMARY_VALUES})
+    )
+
+    if updated.rowcount == 0:
+        db.session.execute(insert(table).values(row))
+
+
+# recomputes the whole summary from the predictions table, used once to
+# cover predictions made before the summary existed or to repair it
+
+
+def rebuild_summary():
+    day = func.date(Prediction.prediction_time)
+    aggregate = (
+        select(
+            day,
+            Prediction.user_id,
+            Prediction.classification_id,
+            func.count(Prediction.prediction_id),
+            *[func.sum(getattr(Dataset, column)) for column in FEATURE_COLUMNS],
+        )
+        .join(Dataset, Dataset.data_id == Prediction.data_id)
+        .group_by(day, Prediction.user_id, Prediction.classification_id)
+    )
+
+    db.session.execute(delete(PredictionSummary))
+    db.session.execute(
+        insert(PredictionSummary).from_select(
+            [*SUMMARY_KEY, *SUMMARY_VALUES], aggregate
+        )
+    )
+    db.session.commit()
+
+    return db.session.execute(
+        select(func.count()).select_from(PredictionSummary)
+    ).scalar()
+
+
+def summary_filters(statement, start=None, end=None, user_id=None):
+    if start is not None:
+        statement = statement.where(PredictionSummary.day >= start)
+    if end is not None:
+        statement = statement.where(PredictionSummary.day <= end)
+    if user_id is not None:
+        statement = statement.where(PredictionSummary.user_id == user_id)
+
+    return statement
+
+
+# predictions per class for every day or month of the range
+
+
+def counts_by_period(period="day", **filters):
+    statement = summary_filters(
+        select(
+            PredictionSummary.day,
+            Classification.class_name,
+            func.sum(PredictionSummary.predictions),
+        )
+        .join(
+            Classification,
+            Classification.class_id == PredictionSummary.classification_id,
+        )
+        .group_by(PredictionSummary.day, Classification.class_name)
+        .order_by(PredictionSummary.day),
+        **filters,
+    )
+
+    periods = {}
+
+    for day, class_name, count in db.session.execute(statement):
+        key = day.strftime("%Y-%m" if period == "month" else "%Y-%m-%d")
+        counts = periods.setdefault(key, {"period": key, "total": 0})
+        counts[class_name] = counts.get(class_name, 0) + int(count)
+        counts["total"] += int(count)
+
+    return list(periods.values())
+
+
+def counts_by_user(**filters):
+    statement = summary_filters(
+        select(
+            PredictionSummary.user_id,
+            User.username,
+            Classification.class_name,
+            func.sum(PredictionSummary.predictions),
+        )
+        .join(User, User.user_id == PredictionSummary.user_id)
+        .join(
+            Classification,
+            Classification.class_id == PredictionSummary.classification_id,
+        )
+        .group_by(PredictionSummary.user_id, User.username, Classification.class_name),
+        **filters,
+    )
+
+    users = {}
+
+    for user_id, username, class_name, count in db.session.execute(statement):
+        counts = users.setdefault(
+            user_id, {"user_id": user_id, "username": username, "total": 0}
+        )
+        counts[class_name] = int(count)
+        counts["total"] += int(count)
+
+    return sorted(users.values(), key=lambda counts: -counts["total"])
+
+
+# average of every feature per class
+
+
+def feature_averages(**filters):
+    statement = summary_filters(
+        select(
+            Classification.class_name,
+            func.sum(PredictionSummary.predictions),
+            *[func.sum(getattr(PredictionSummary, column)) for column in TOTAL_COLUMNS],
+        )
+        .join(
+            Classification,
+            Classification.class_id == PredictionSummary.classification_id,
+        )
+        .group_by(Classification.class_name),
+        **filters,
+    )
+
+    averages = {}
+
+    for class_name, count, *totals in db.session.execute(statement):
+        averages[class_name] = {
+            column: int(total) / int(count) if count else None
+            for column, total in zip(FEATURE_COLUMNS, totals)
+        }
+
+    return averages
+
+
+@analytics_cli.command("rebuild")
+def rebuild_command():
+    rows = rebuild_summary()
+    click.echo(f"Prediction summary rebuilt with {rows} rows.")
+
+
+def init_app(app):
+    app.cli.add_command(analytics_cli)
@@ -0,0 +1,293 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .databaseUtils import read_from_replica
+from .metricsUtils import RESPONSE_CACHE
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# every table the cached endpoints read has a write version, a cached
+# response is keyed by its route, query args, user and the versions of its
+# tables, so a committed write makes every response built from the old rows
+# unreachable and they age out of the cache
+# versions live in a small memory-mapped file so every gunicorn worker on
+# the host sees the writes of the others, the time of the last bump of
+# every table follows the versions
+
+VERSIONED_TABLES = (
+    "users",
+    "dataset",
+    "predictions",
+    "class",
+    "prediction_summary",
+)
+
+SLOT = struct.Struct("Q")
+BUMPED_AT = struct.Struct("d")
+
+
+class TableVersions:
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = [0] * len(VERSIONED_TABLES)
+        self.local_bumped_at = [0.0] * len(VERSIONED_TABLES)
+        self._map = None
+        self._fd = None
+        self._pid = None
+
+    # the file is mapped again after a fork so every process holds its own
+    # descriptor for the record locks
+
+    def _mapped(self):
+        if self.path is None or fcntl is None:
+            return None
+
+        if self._pid != os.getpid():
+            size = (SLOT.size + BUMPED_AT.size) * len(VERSIONED_TABLES)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+
+            self._map = mmap.mmap(fd, size)
+            self._fd = fd
+            self._pid = os.getpid()
+
+        return self._map
+
+    def read(self, tables):
+        versions = self._mapped()
+        indexes = [VERSIONED_TABLES.index(table) for table in tables]
+
+        if versions is None:
+            return tuple(self.local[index] for index in indexes)
+
+        return tuple(
+            SLOT.unpack_from(versions, index * SLOT.size)[0] for index in indexes
+        )
+
+    def bumped_since(self, tables, since):
+        versions = self._mapped()
+        indexes = [VERSIONED_TABLES.index(table) for table in tables]
+
+        if versions is None:
+            return any(self.local_bumped_at[index] >= since for index in indexes)
+
+        offset = SLOT.size * len(VERSIONED_TABLES)
+
+        return any(
+            BUMPED_AT.unpack_from(versions, offset + index * BUMPED_AT.size)[0] >= since
+            for index in indexes
+        )
+
+    def bump(self, tables):
+        indexes = [
+            VERSIONED_TABLES.index(table)
+            for table in tables
+            if table in VERSIONED_TABLES
+        ]
+
+        if not indexes:
+            return
+
+        with self.lock:
+            versions = self._mapped()
+
+            now = time.time()
+
+            if versions is None:
+                for index in indexes:
+                    self.local[index] += 1
+                    self.local_bumped_at[index] = now
+                return
+
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                for index in indexes:
+                    offset = index * SLOT.size
+                    SLOT.pack_into(
+                        versions, offset, SLOT.unpack_from(versions, offset)[0] + 1
+                    )
+                    BUMPED_AT.pack_into(
+                        versions,
+                        SLOT.size * len(VERSIONED_TABLES) + index * BUMPED_AT.size,
+                        now,
+                    )
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+# least recently used entries are evicted past max_entries and entries
+# older than ttl seconds are never served
+
+
+class LRUCache:
+    def __init__(self, max_entries=512, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+table_versions = TableVersions()
+response_cache = LRUCache()
+
+
+# the tables written by a session are collected while it runs and their
+# versions are bumped once the commit went through, a rollback drops them
+
+
+def written_tables(session):
+    return session.info.setdefault("written_tables", set())
+
+
+@event.listens_for(Session, "do_orm_execute")
+def track_statement(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        written_tables(state.session).add(state.statement.table.name)
+
+
+@event.listens_for(Session, "after_flush")
+def track_flush(session, flush_context):
+    for instance in (*session.new, *session.deleted):
+        written_tables(session).add(instance.__table__.name)
+
+    # only a change of its own columns counts as a write of a dirty row, not
+    # a relationship collection that changed on the other side
+    for instance in session.dirty:
+        if session.is_modified(instance, include_collections=False):
+            written_tables(session).add(instance.__table__.name)
+
+
+@event.listens_for(Session, "after_commit")
+def bump_versions(session):
+    tables = session.info.pop("written_tables", None)
+
+    if tables:
+        table_versions.bump(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def drop_versions(session):
+    session.info.pop("written_tables", None)
+
+
+# caches the 200 responses of a GET view that reads the given tables
+# per_user keys the entries by the identity of the token for views that
+# depend on current_user, it has to be placed below jwt_required
+# responses carry an ETag and a matching If-None-Match is answered with 304
+# before the view runs
+# a replica may not have the writes of the last DB_REPLICA_STICKY_SECONDS
+# yet, a response read from one in that time is not stored, so the writer
+# never gets it from the cache instead of its own read from the primary
+
+
+def cached(*tables, per_user=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_app.config["RESPONSE_CACHE_ENABLED"]:
+                return view(*args, **kwargs)
+
+            # the versions are read before the view so a write committed
+            # while it runs can never be cached under the new versions
+            key = (
+                request.endpoint,
+                tuple(sorted(request.args.items(multi=True))),
+                get_jwt_identity() if per_user else None,
+                table_versions.read(tables),
+            )
+            # the etag also changes every ttl seconds, which bounds how long
+            # writes made outside of this host's sessions can go unnoticed
+            epoch = int(time.time() // response_cache.ttl)
+            etag = hashlib.sha1(repr((key, epoch)).encode("utf-8")).hexdigest()
+
+            if etag in request.if_none_match:
+                RESPONSE_CACHE.labels("not_modified").inc()
+                response = current_app.response_class(status=304)
+            else:
+                entry = response_cache.get(key)
+
+                if entry is not None:
+                    RESPONSE_CACHE.labels("hit").inc()
+                    response = current_app.response_class(entry[0], mimetype=entry[1])
+                else:
+                    RESPONSE_CACHE.labels("miss").inc()
+                    response = current_app.make_response(view(*args, **kwargs))
+
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+
+                    if replica_may_lag(tables):
+                        return response
+
+                    response_cache.set(key, (response.get_data(), response.mimetype))
+
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def replica_may_lag(tables):
+    sticky = current_app.config["DB_REPLICA_STICKY_SECONDS"]
+
+    return read_from_replica() and table_versions.bumped_since(
+        tables, time.time() - sticky
+    )
+
+
+def init_app(app):
+    response_cache.max_entries = app.config["RESPONSE_CACHE_SIZE"]
+    response_cache.ttl = app.config["RESPONSE_CACHE_TTL"]
+    table_versions.path = app.config["RESPONSE_CACHE_VERSIONS_FILE"] or os.path.join(
+        tempfile.gettempdir(), "seps-table-versions"
+    )
@@ -0,0 +1,285 @@
+import hashlib
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, make_url
+from sqlalchemy.pool import QueuePool
+from .metricsUtils import (
+    DB_POOL_CAPACITY,
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_TIMEOUTS,
+    DB_POOL_WAIT,
+    DB_ROUTED_READS,
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# every engine, the primary and the read replicas, gets its pool settings
+# from the DB_* config and a queue pool that reports how long checkouts
+# wait and how much of the pool is in use, labelled with its bind name
+# read-only views opt in to the replicas with read_replica, their selects
+# go to a replica unless the session already wrote, or the user wrote in
+# the last DB_REPLICA_STICKY_SECONDS so they read their own writes
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        name = self.logging_name or "primary"
+        start_time = time.perf_counter()
+
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.labels(name).inc()
+            raise
+        finally:
+            DB_POOL_WAIT.labels(name).observe(time.perf_counter() - start_time)
+
+        DB_POOL_CHECKED_OUT.labels(name).set(self.checkedout())
+
+        return record
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        DB_POOL_CHECKED_OUT.labels(self.logging_name or "primary").set(
+            self.checkedout()
+        )
+
+
+def engine_options(config, uri, name):
+    options = {"pool_logging_name": name, "pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    url = make_url(uri)
+
+    # in-memory sqlite databases keep the single connection flask-sqlalchemy
+    # gives them
+    if url.drivername.startswith("sqlite") and url.database in (None, "", ":memory:"):
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=config["DB_POOL_SIZE"],
+        max_overflow=config["DB_MAX_OVERFLOW"],
+        pool_timeout=config["DB_POOL_TIMEOUT"],
+        pool_recycle=config["DB_POOL_RECYCLE"],
+    )
+
+    timeout = config["DB_STATEMENT_TIMEOUT_MS"]
+
+    if timeout > 0 and url.drivername.startswith("postgresql"):
+        options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    elif timeout > 0 and url.drivername.startswith("mysql"):
+        options["connect_args"] = {
+            "init_command": f"SET SESSION max_execution_time={timeout}"
+        }
+
+    DB_POOL_CAPACITY.labels(name).set(
+        config["DB_POOL_SIZE"] + max(config["DB_MAX_OVERFLOW"], 0)
+    )
+
+    return options
+
+
+# sets SQLALCHEMY_ENGINE_OPTIONS and one SQLALCHEMY_BINDS entry per replica,
+# it runs before db.init_app
+
+
+def configure(app):
+    config = app.config
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+
+    if uri:
+        config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(config, uri, "primary")
+
+    binds = {}
+
+    for index, replica_uri in enumerate(config["DATABASE_REPLICA_URIS"]):
+        name = f"replica{index}"
+        binds[name] = {"url": replica_uri, **engine_options(config, replica_uri, name)}
+
+    config["SQLALCHEMY_BINDS"] = binds
+
+
+# the users that wrote in the last seconds are kept in a small table of
+# write times shared by the workers of the host, keys are direct mapped
+# and a collision only sends another user's reads to the primary
+
+
+class RecentWrites:
+    SLOT = struct.Struct("d")
+
+    def __init__(self, slots=4096, path=None):
+        self.slots = slots
+        self.path = path
+        self.lock = threading.Lock()
+        self._map = None
+        self._pid = None
+
+    def _mapped(self):
+        if self._pid != os.getpid():
+            size = self.SLOT.size * self.slots
+
+            if self.path is None or fcntl is None:
+                self._map = mmap.mmap(-1, size)
+            else:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+
+                self._map = mmap.mmap(fd, size)
+                os.close(fd)
+
+            self._pid = os.getpid()
+
+        return self._map
+
+    def _offset(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return (int.from_bytes(digest, "little") % self.slots) * self.SLOT.size
+
+    # a single aligned double is written at once, so no record lock is
+    # needed and the newest write time wins
+
+    def mark(self, key):
+        with self.lock:
+            self.SLOT.pack_into(self._mapped(), self._offset(key), time.time())
+
+    def wrote_since(self, key, since):
+        return self.SLOT.unpack_from(self._mapped(), self._offset(key))[0] >= since
+
+
+recent_writes = RecentWrites()
+
+
+def client_key():
+    if not has_request_context():
+        return None
+
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        identity = None
+
+    return f"user:{identity}" if identity else f"ip:{request.remote_addr}"
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and self.info.get("read_replica")
+            and not self._flushing
+            and not self.info.get("wrote")
+        ):
+            replicas = [
+                name
+                for name in self._db.engines
+                if isinstance(name, str) and name.startswith("replica")
+            ]
+
+            if replicas:
+                # one replica per session so a request reads one snapshot
+                name = self.info.setdefault("replica", random.choice(replicas))
+                DB_ROUTED_READS.labels("replica").inc()
+                return self._db.engines[name]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def track_statement(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def track_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def drop_writes(session):
+    session.info.pop("wrote", None)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def mark_writer(session):
+    if session.info.pop("wrote", False):
+        key = client_key()
+
+        if key is not None:
+            recent_writes.mark(key)
+
+
+# selects inside the block may go to a replica, key names the client
+# whose writes have to be visible when it is not the one of the request
+
+
+@contextmanager
+def replica_reads(key=None):
+    session = current_app.extensions["sqlalchemy"].session()
+
+    if not current_app.config["SQLALCHEMY_BINDS"]:
+        yield session
+        return
+
+    previous = session.info.get("read_replica", False)
+    sticky = current_app.config["DB_REPLICA_STICKY_SECONDS"]
+    key = key or client_key()
+
+    session.info["read_replica"] = key is None or not recent_writes.wrote_since(
+        key, time.time() - sticky
+    )
+
+    if not session.info["read_replica"]:
+        DB_ROUTED_READS.labels("sticky").inc()
+
+    try:
+        yield session
+    finally:
+        session.info["read_replica"] = previous
+
+
+# whether a select of the current session went to a replica
+
+
+def read_from_replica():
+    session = current_app.extensions["sqlalchemy"].session()
+
+    return "replica" in session.info
+
+
+# marks the writes of a client the request can not tell from its token,
+# like the user confirming their email, so the reads made as that user go
+# to the primary
+
+
+def mark_written(key):
+    recent_writes.mark(key)
+
+
+def read_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+def init_app(app):
+    recent_writes.path = app.config["DB_RECENT_WRITES_FILE"] or os.path.join(
+        tempfile.gettempdir(), "seps-recent-writes"
+    )
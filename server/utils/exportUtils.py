@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from flask import Response, stream_with_context
+from sqlalchemy import select
+from ..config import db
+from ..schema.classifications import Classification
+from ..schema.dataset import Dataset
+from ..schema.predictions import Prediction
+from .serializerUtils import DATASET_COLUMNS, PREDICTION_COLUMNS, prediction_joins
+
+# exports are streamed from a server side cursor, rows are fetched and
+# written EXPORT_CHUNK_SIZE at a time so memory stays flat whatever the
+# size of the table
+
+EXPORT_DATASET_COLUMNS = [
+    *DATASET_COLUMNS,
+    Classification.class_name.label("classification"),
+]
+
+EXPORT_PREDICTION_COLUMNS = [*PREDICTION_COLUMNS, Dataset.student_id]
+
+
+def parse_date(value, end=False):
+    date = datetime.fromisoformat(value)
+
+    # a date without a time includes the whole day
+    if end and len(value) == 10:
+        date += timedelta(days=1)
+
+    return date
+
+
+# from and to filter on the upload or prediction time, class takes a class
+# name or id and predicted filters on the predicted flag of the dataset
+# raises ValueError for an invalid filter
+
+
+def apply_filters(statement, args, date_column):
+    if args.get("from"):
+        statement = statement.where(date_column >= parse_date(args["from"]))
+
+    if args.get("to"):
+        statement = statement.where(date_column < parse_date(args["to"], end=True))
+
+    if args.get("class"):
+        value = args["class"]
+        statement = statement.where(
+            Classification.class_id == int(value)
+            if value.isdigit()
+            else Classification.class_name == value
+        )
+
+    if args.get("predicted"):
+        predicted = args["predicted"].lower()
+        if predicted not in ("true", "false"):
+            raise ValueError("predicted must be true or false")
+        statement = statement.where(Dataset.already_predicted == (predicted == "true"))
+
+    return statement
+
+
+def dataset_statement(args):
+    statement = (
+        select(*EXPORT_DATASET_COLUMNS)
+        .outerjoin(Prediction, Prediction.data_id == Dataset.data_id)
+        .outerjoin(
+            Classification, Classification.class_id == Prediction.classification_id
+        )
+        .order_by(Dataset.data_id)
+    )
+
+    return apply_filters(statement, args, Dataset.uploaded_at)
+
+
+def predictions_statement(args):
+    statement = (
+        prediction_joins(select(*EXPORT_PREDICTION_COLUMNS))
+        .join(Dataset, Dataset.data_id == Prediction.data_id)
+        .order_by(Prediction.prediction_id)
+    )
+
+    return apply_filters(statement, args, Prediction.prediction_time)
+
+
+def to_text(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def write_rows(rows, keys, export_format):
+    buffer = io.StringIO()
+
+    if export_format == "csv":
+        writer = csv.writer(buffer)
+        writer.writerows([[to_text(value) for value in row] for row in rows])
+    else:
+        for row in rows:
+            buffer.write(
+                json.dumps({key: to_text(value) for key, value in zip(keys, row)})
+            )
+            buffer.write("\n")
+
+    return buffer.getvalue().encode("utf-8")
+
+
+# yields the encoded export chunk by chunk, the csv header is sent before
+# the query runs so the first byte leaves right away
+# gzip output is flushed after every chunk so the client never waits on a
+# full compression window
+
+
+def stream_export(statement, export_format, chunk_size, compress=False):
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(data):
+        if compressor is None:
+            return data
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    keys = list(statement.selected_columns.keys())
+
+    if export_format == "csv":
+        yield encode(write_rows([keys], keys, "csv"))
+
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+
+    try:
+        for rows in result.partitions():
+            yield encode(write_rows(rows, keys, export_format))
+    finally:
+        result.close()
+
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def export_response(statement, name, export_format, chunk_size, compress=False):
+    headers = {
+        "Content-Disposition": f"attachment; filename={name}.{export_format}",
+        # keeps proxies from buffering the whole export before sending it
+        "X-Accel-Buffering": "no",
+    }
+
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(
+        stream_with_context(
+            stream_export(statement, export_format, chunk_size, compress)
+        ),
+        mimetype="text/csv" if export_format == "csv" else "application/x-ndjson",
+        headers=headers,
+    )
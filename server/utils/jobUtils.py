@@ -0,0 +1,245 @@
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, or_, select, update
+from ..config import db
+from ..model.bagged_tree import load_version
+from ..schema.dataset import Dataset
+from ..schema.jobs import ScoringJob
+from ..schema.predictions import Prediction
+from .predictionUtils import load_outdated, load_unpredicted, rescore_rows, score_rows
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# every process gets its own pool so forked gunicorn workers
+# never inherit the threads of their parent
+
+
+def get_executor():
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config["JOB_WORKERS"],
+                thread_name_prefix="scoring-job",
+            )
+            _executor_pid = os.getpid()
+
+    return _executor
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+# create a job covering every dataset that is not predicted yet
+# the job only scores rows that existed when it was submitted
+
+
+def submit_job(user_id, chunk_size=None):
+    max_data_id, total = db.session.execute(
+        select(func.max(Dataset.data_id), func.count(Dataset.data_id)).where(
+            Dataset.already_predicted == False
+        )
+    ).one()
+
+    job = ScoringJob(
+        user_id=user_id,
+        chunk_size=chunk_size or current_app.config["JOB_CHUNK_SIZE"],
+        max_data_id=max_data_id,
+        total=total,
+    )
+
+    db.session.add(job)
+    db.session.commit()
+
+    enqueue(job.job_id)
+
+    return job
+
+
+# create a job that scores every stored prediction again with the given
+# model version, predictions made after it was submitted are left out
+
+
+def submit_rescore_job(user_id, model_version, chunk_size=None):
+    load_version(model_version)
+
+    max_data_id, total = db.session.execute(
+        select(
+            func.max(Prediction.data_id), func.count(Prediction.prediction_id)
+        ).where(
+            or_(
+                Prediction.model_version != model_version,
+                Prediction.model_version == None,
+            )
+        )
+    ).one()
+
+    job = ScoringJob(
+        user_id=user_id,
+        kind="rescore",
+        model_version=model_version,
+        chunk_size=chunk_size or current_app.config["JOB_CHUNK_SIZE"],
+        max_data_id=max_data_id,
+        total=total,
+    )
+
+    db.session.add(job)
+    db.session.commit()
+
+    enqueue(job.job_id)
+
+    return job
+
+
+def enqueue(job_id):
+    app = current_app._get_current_object()
+    get_executor().submit(run_job, app, job_id)
+
+
+# pick up queued jobs and jobs whose worker stopped sending heartbeats,
+# for example after a restart, the rows they already scored are skipped
+# because they are flagged as already predicted
+
+
+def resume_jobs():
+    lease = timedelta(seconds=current_app.config["JOB_LEASE_SECONDS"])
+
+    job_ids = (
+        db.session.execute(
+            select(ScoringJob.job_id).where(
+                or_(
+                    ScoringJob.status == "queued",
+                    (ScoringJob.status == "running")
+                    & (ScoringJob.heartbeat_at < datetime.now() - lease),
+                )
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+    for job_id in job_ids:
+        enqueue(job_id)
+
+
+def claim_job(job_id, owner):
+    lease = timedelta(seconds=current_app.config["JOB_LEASE_SECONDS"])
+    now = datetime.now()
+
+    claimed = db.session.execute(
+        update(ScoringJob)
+        .where(
+            ScoringJob.job_id == job_id,
+            or_(
+                ScoringJob.status == "queued",
+                (ScoringJob.status == "running")
+                & or_(
+                    ScoringJob.heartbeat_at == None,
+                    ScoringJob.heartbeat_at < now - lease,
+                ),
+            ),
+        )
+        .values(
+            status="running",
+            worker_id=owner,
+            heartbeat_at=now,
+            started_at=func.coalesce(ScoringJob.started_at, now),
+        )
+    )
+    db.session.commit()
+
+    return claimed.rowcount == 1
+
+
+def run_job(app, job_id):
+    with app.app_context():
+        owner = f"{worker_id()}:{uuid.uuid4().hex[:8]}"
+
+        try:
+            if not claim_job(job_id, owner):
+                return
+
+            job = db.session.get(ScoringJob, job_id)
+            user_id, chunk_size, max_data_id, kind, model_version = (
+                job.user_id,
+                job.chunk_size,
+                job.max_data_id,
+                job.kind,
+                job.model_version,
+            )
+
+            if kind == "rescore":
+                model = load_version(model_version)
+
+            while True:
+                if kind == "rescore":
+                    rows = load_outdated(
+                        model_version, chunk_size, max_data_id, lock=True
+                    )
+                else:
+                    rows = load_unpredicted(
+                        limit=chunk_size, max_data_id=max_data_id, lock=True
+                    )
+
+                if not rows:
+                    break
+
+                if kind == "rescore":
+                    rescore_rows(rows, model)
+                else:
+                    score_rows(rows, user_id)
+
+                progress = db.session.execute(
+                    update(ScoringJob)
+                    .where(ScoringJob.job_id == job_id, ScoringJob.worker_id == owner)
+                    .values(
+                        processed=ScoringJob.processed + len(rows),
+                        heartbeat_at=datetime.now(),
+                    )
+                )
+
+                # another worker took over the job, drop this chunk
+                if progress.rowcount != 1:
+                    db.session.rollback()
+                    return
+
+                db.session.commit()
+
+            db.session.execute(
+                update(ScoringJob)
+                .where(ScoringJob.job_id == job_id, ScoringJob.worker_id == owner)
+                .values(status="completed", finished_at=datetime.now())
+            )
+            db.session.commit()
+        except Exception as e:
+            print(e)
+            db.session.rollback()
+            db.session.execute(
+                update(ScoringJob)
+                .where(ScoringJob.job_id == job_id, ScoringJob.worker_id == owner)
+                .values(status="failed", error=str(e), finished_at=datetime.now())
+            )
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def init_app(app):
+    with app.app_context():
+        try:
+            resume_jobs()
+        except Exception as e:
+            # the jobs table may not exist yet, for example before migrations
+            print(e)
+            db.session.rollback()
+        finally:
+            db.session.remove()
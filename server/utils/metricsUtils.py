@@ -0,0 +1,277 @@
+import os
+import time
+from flask import current_app, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# when PROMETHEUS_MULTIPROC_DIR is set every gunicorn worker writes its
+# samples to that directory and /metrics aggregates all of them
+
+FAST_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route",
+    ["blueprint", "endpoint", "method"],
+)
+REQUEST_COUNT = Counter(
+    "http_requests_total",
+    "Requests by route and status code",
+    ["blueprint", "endpoint", "method", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests currently being served",
+    ["blueprint", "endpoint"],
+    multiprocess_mode="livesum",
+)
+DB_TIME = Histogram(
+    "db_request_duration_seconds",
+    "Time spent in database statements per request",
+    ["blueprint", "endpoint"],
+    buckets=FAST_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    "db_request_queries",
+    "Database statements per request",
+    ["blueprint", "endpoint"],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89),
+)
+SQL_SLOW_QUERIES = Counter(
+    "sql_slow_queries_total",
+    "Statements slower than SQL_SLOW_QUERY_MS by endpoint",
+    ["endpoint"],
+)
+SQL_N_PLUS_ONE = Counter(
+    "sql_n_plus_one_total",
+    "Statements repeated within one request by endpoint",
+    ["endpoint"],
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a pooled connection",
+    ["pool"],
+    buckets=FAST_BUCKETS,
+)
+DB_POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total",
+    "Checkouts that gave up waiting for a pooled connection",
+    ["pool"],
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out",
+    "Pooled connections currently checked out",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_CAPACITY = Gauge(
+    "db_pool_capacity",
+    "Connections a pool may open, pool size plus overflow",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+DB_ROUTED_READS = Counter(
+    "db_routed_reads_total",
+    "Replica-eligible reads by where they were sent",
+    ["target"],
+)
+MODEL_INFERENCE = Histogram(
+    "model_inference_seconds",
+    "Time spent in a single model call",
+    buckets=FAST_BUCKETS,
+)
+MODEL_BATCH_SIZE = Histogram(
+    "model_batch_size",
+    "Rows scored by a single model call",
+    buckets=SIZE_BUCKETS,
+)
+INFERENCE_QUEUE_DELAY = Histogram(
+    "inference_queue_delay_seconds",
+    "Time a feature vector waits in the inference scheduler",
+    buckets=FAST_BUCKETS,
+)
+PASSWORD_HASH = Histogram(
+    "password_hash_seconds",
+    "Time spent hashing or checking a password",
+    ["operation"],
+)
+PASSWORD_POOL_IN_FLIGHT = Gauge(
+    "password_pool_in_flight",
+    "Password hashes running or waiting in the pool",
+    multiprocess_mode="livesum",
+)
+PASSWORD_POOL_REJECTED = Counter(
+    "password_pool_rejected_total",
+    "Password hashes rejected because the pool was saturated",
+    ["operation"],
+)
+EMAIL_OUTBOX_PENDING = Gauge(
+    "email_outbox_pending",
+    "Emails in the outbox that are not sent yet",
+    multiprocess_mode="livemostrecent",
+)
+EMAIL_SEND_LATENCY = Histogram(
+    "email_send_seconds",
+    "Time spent sending a single email over an open connection",
+)
+EMAIL_SENT = Counter(
+    "email_outbox_sends_total",
+    "Outbox send attempts by result",
+    ["result"],
+)
+ADMISSION_DECISIONS = Counter(
+    "admission_decisions_total",
+    "Admission control decisions by route group and result",
+    ["group", "result"],
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds",
+    "Time an admitted request waited in the admission queue",
+    ["group"],
+    buckets=FAST_BUCKETS,
+)
+RESPONSE_CACHE = Counter(
+    "response_cache_requests_total",
+    "Cached GET requests by result",
+    ["result"],
+)
+REVOCATION_CHECKS = Counter(
+    "token_revocation_checks_total",
+    "Token revocation checks by result",
+    ["result"],
+)
+USER_CACHE = Counter(
+    "user_cache_requests_total",
+    "JWT user lookups by cache result",
+    ["result"],
+)
+
+
+APP_STARTUP = Gauge(
+    "app_startup_seconds",
+    "Time spent starting the app by server role and phase",
+    ["role", "phase"],
+    multiprocess_mode="liveall",
+)
+FIRST_REQUEST_LATENCY = Gauge(
+    "app_first_request_seconds",
+    "Latency of the first request a process served by server role",
+    ["role"],
+    multiprocess_mode="liveall",
+)
+
+_first_request_pid = None
+
+
+def request_labels():
+    return request.blueprint or "none", request.endpoint or "none"
+
+
+def before_request():
+    g.request_start = time.perf_counter()
+    g.db_time = 0.0
+    g.db_queries = 0
+    REQUESTS_IN_PROGRESS.labels(*request_labels()).inc()
+
+
+def after_request(response):
+    if "request_start" in g:
+        blueprint, endpoint = request_labels()
+
+        REQUEST_LATENCY.labels(blueprint, endpoint, request.method).observe(
+            time.perf_counter() - g.request_start
+        )
+        REQUEST_COUNT.labels(
+            blueprint, endpoint, request.method, response.status_code
+        ).inc()
+        DB_TIME.labels(blueprint, endpoint).observe(g.db_time)
+        DB_QUERIES.labels(blueprint, endpoint).observe(g.db_queries)
+        observe_first_request()
+
+    return response
+
+
+# the first request of a worker pays for everything that was left lazy
+
+
+def observe_first_request():
+    global _first_request_pid
+
+    if _first_request_pid != os.getpid():
+        _first_request_pid = os.getpid()
+        FIRST_REQUEST_LATENCY.labels(current_app.config["SERVER_ROLE"]).set(
+            time.perf_counter() - g.request_start
+        )
+
+
+def teardown_request(exception):
+    if g.pop("request_start", None) is not None:
+        REQUESTS_IN_PROGRESS.labels(*request_labels()).dec()
+
+
+# statement timings are kept on the connection so nested or interleaved
+# statements of other threads never mix
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+
+    if has_request_context() and "db_time" in g:
+        g.db_time += elapsed
+        g.db_queries += 1
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def generate_metrics():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
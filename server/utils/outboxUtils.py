@@ -0,0 +1,261 @@
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Connection, Message
+from sqlalchemy import and_, delete, func, or_, select, update
+from ..config import db
+from ..schema.outbox import OutboxEmail
+from . import periodicUtils
+from .metricsUtils import EMAIL_OUTBOX_PENDING, EMAIL_SEND_LATENCY, EMAIL_SENT
+
+# requests only add a row to the outbox, every worker runs a dispatcher
+# thread that claims pending rows in batches and sends them over a single
+# smtp connection, kept open for as long as there are rows to claim
+# failed sends are retried with exponential backoff and given up after
+# MAIL_OUTBOX_MAX_ATTEMPTS
+
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+_wake = threading.Event()
+
+
+# flask-mail opens the smtp connection without a timeout, a server that
+# stops answering would hold the dispatcher forever
+
+
+class OutboxConnection(Connection):
+    def configure_host(self):
+        timeout = current_app.config["MAIL_TIMEOUT"]
+
+        if self.mail.use_ssl:
+            host = smtplib.SMTP_SSL(self.mail.server, self.mail.port, timeout=timeout)
+        else:
+            host = smtplib.SMTP(self.mail.server, self.mail.port, timeout=timeout)
+
+        host.set_debuglevel(int(self.mail.debug))
+
+        if self.mail.use_tls:
+            host.starttls()
+        if self.mail.username and self.mail.password:
+            host.login(self.mail.username, self.mail.password)
+
+        return host
+
+
+# the row is added to the session of the caller and only sent once the
+# caller commits
+
+
+def queue_email(subject, recipients, body, sender=None):
+    email = OutboxEmail(
+        subject=subject,
+        sender=sender or current_app.config.get("MAIL_DEFAULT_SENDER"),
+        recipients=list(recipients),
+        body=body,
+    )
+    db.session.add(email)
+
+    return email
+
+
+# wakes the dispatcher of this process instead of waiting for its interval
+
+
+def notify():
+    _wake.set()
+
+
+def claimable(now):
+    return or_(
+        and_(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now),
+        and_(OutboxEmail.status == "sending", OutboxEmail.claimed_until < now),
+    )
+
+
+# the ids are claimed with a conditional update so dispatchers of other
+# workers never send the same row, rows of a dispatcher that died are
+# claimed again once its lease ran out
+
+
+def claim_batch(owner):
+    config = current_app.config
+    now = datetime.utcnow()
+
+    email_ids = (
+        db.session.execute(
+            select(OutboxEmail.id)
+            .where(claimable(now))
+            .order_by(OutboxEmail.id)
+            .limit(config["MAIL_OUTBOX_BATCH_SIZE"])
+        )
+        .scalars()
+        .all()
+    )
+
+    if not email_ids:
+        return []
+
+    db.session.execute(
+        update(OutboxEmail)
+        .where(OutboxEmail.id.in_(email_ids), claimable(now))
+        .values(
+            status="sending",
+            claimed_by=owner,
+            claimed_until=now + timedelta(seconds=config["MAIL_OUTBOX_LEASE"]),
+        )
+    )
+    db.session.commit()
+
+    return (
+        db.session.execute(
+            select(OutboxEmail).where(
+                OutboxEmail.id.in_(email_ids),
+                OutboxEmail.claimed_by == owner,
+                OutboxEmail.status == "sending",
+            )
+        )
+        .scalars()
+        .all()
+    )
+
+
+def schedule_retry(email, error):
+    config = current_app.config
+
+    email.attempts += 1
+    email.last_error = str(error)
+    email.claimed_by = None
+    email.claimed_until = None
+
+    if email.attempts >= config["MAIL_OUTBOX_MAX_ATTEMPTS"]:
+        email.status = "failed"
+        EMAIL_SENT.labels("failed").inc()
+        return
+
+    # the jitter keeps the retries of a failed batch from arriving together
+    delay = min(
+        config["MAIL_OUTBOX_BACKOFF"] * 2 ** (email.attempts - 1),
+        config["MAIL_OUTBOX_MAX_BACKOFF"],
+    )
+    email.status = "pending"
+    email.next_attempt_at = datetime.utcnow() + timedelta(
+        seconds=random.uniform(delay / 2, delay)
+    )
+    EMAIL_SENT.labels("retry").inc()
+
+
+def send_batch(connection, emails):
+    for email in emails:
+        start_time = time.perf_counter()
+
+        try:
+            connection.send(
+                Message(
+                    subject=email.subject,
+                    sender=email.sender,
+                    recipients=email.recipients,
+                    body=email.body,
+                )
+            )
+        except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+            # the connection is gone, the rest of the batch is retried
+            raise
+        except Exception as e:
+            schedule_retry(email, e)
+            continue
+
+        EMAIL_SEND_LATENCY.observe(time.perf_counter() - start_time)
+        EMAIL_SENT.labels("sent").inc()
+
+        email.status = "sent"
+        email.sent_at = datetime.utcnow()
+        email.claimed_by = None
+        email.claimed_until = None
+
+
+def dispatch_outbox():
+    owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    emails = claim_batch(owner)
+
+    if emails:
+        try:
+            with OutboxConnection(current_app.extensions["mail"]) as connection:
+                while emails:
+                    send_batch(connection, emails)
+                    db.session.commit()
+                    emails = claim_batch(owner)
+        except (smtplib.SMTPException, OSError) as e:
+            print(f"email outbox: {e}")
+
+            for email in emails:
+                if email.status == "sending":
+                    schedule_retry(email, e)
+
+            db.session.commit()
+
+    EMAIL_OUTBOX_PENDING.set(
+        db.session.execute(
+            select(func.count(OutboxEmail.id)).where(
+                OutboxEmail.status.in_(("pending", "sending"))
+            )
+        ).scalar()
+    )
+
+
+def purge_outbox():
+    retention = timedelta(days=current_app.config["MAIL_OUTBOX_RETENTION_DAYS"])
+
+    db.session.execute(
+        delete(OutboxEmail).where(
+            OutboxEmail.status == "sent",
+            OutboxEmail.sent_at < datetime.utcnow() - retention,
+        )
+    )
+    db.session.commit()
+
+
+def run(app):
+    interval = app.config["MAIL_OUTBOX_INTERVAL"]
+
+    while True:
+        _wake.wait(interval)
+        _wake.clear()
+
+        with app.app_context():
+            try:
+                dispatch_outbox()
+            except Exception as e:
+                print(f"email outbox: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+# one dispatcher thread per process, started again after a fork
+
+
+def start(app):
+    global _thread, _thread_pid
+
+    if app.config["MAIL_OUTBOX_INTERVAL"] <= 0:
+        return
+
+    with _thread_lock:
+        if _thread is not None and _thread_pid == os.getpid():
+            return
+
+        _thread = threading.Thread(
+            target=run, args=(app,), name="email-outbox", daemon=True
+        )
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+def init_app(app):
+    periodicUtils.register("purge_outbox", 3600, purge_outbox)
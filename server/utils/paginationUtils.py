@@ -0,0 +1,152 @@
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import func, select, text, tuple_
+from ..config import db
+
+# keyset pagination, a page is read with WHERE key < last key ORDER BY key
+# LIMIT n, so every page costs the same as the first one whatever its depth
+# the key is a list of columns whose last column is unique and the cursors
+# handed to the client are opaque base64 encoded json
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps(
+        {"d": direction, "k": [encode_value(value) for value in values]},
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        direction = payload["d"]
+        values = [decode_value(value) for value in payload["k"]]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+    if direction not in ("next", "prev"):
+        raise ValueError("Invalid cursor")
+
+    return direction, values
+
+
+# returns the rows of one page and the cursors of the pages around it
+# key(row) must return the values of the key columns for a row
+
+
+def paginate(statement, columns, key, limit, descending=True, cursor=None):
+    direction, values = decode_cursor(cursor) if cursor else ("next", None)
+
+    if values is not None and len(values) != len(columns):
+        raise ValueError("Invalid cursor")
+
+    backwards = direction == "prev"
+    order_descending = descending != backwards
+
+    if values is not None:
+        sort_key = tuple_(*columns) if len(columns) > 1 else columns[0]
+        bound = tuple_(*values) if len(values) > 1 else values[0]
+        statement = statement.where(
+            sort_key < bound if order_descending else sort_key > bound
+        )
+
+    statement = statement.order_by(
+        *[column.desc() if order_descending else column.asc() for column in columns]
+    ).limit(limit + 1)
+
+    rows = db.session.execute(statement).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if backwards:
+        rows.reverse()
+
+    next_cursor = None
+    prev_cursor = None
+
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor("next", key(rows[-1]))
+        if values is not None and (has_more or not backwards):
+            prev_cursor = encode_cursor("prev", key(rows[0]))
+
+    return rows, next_cursor, prev_cursor
+
+
+# the page parameter of older clients is still served with an offset
+
+
+def paginate_offset(statement, columns, page, limit, descending=True):
+    statement = statement.order_by(
+        *[column.desc() if descending else column.asc() for column in columns]
+    )
+
+    return db.session.execute(
+        statement.offset((max(page, 1) - 1) * limit).limit(limit)
+    ).all()
+
+
+_counts = {}
+_counts_lock = threading.Lock()
+
+# totals are only computed when asked for, they are cached for
+# PAGINATION_COUNT_TTL seconds and estimate=true reads the planner estimate
+# of postgres instead of counting
+
+
+def count_rows(model, estimate=False):
+    table = model.__tablename__
+
+    if estimate and db.engine.dialect.name == "postgresql":
+        estimated = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"),
+            {"table": table},
+        ).scalar()
+        if estimated is not None and estimated >= 0:
+            return estimated
+
+    now = time.monotonic()
+
+    with _counts_lock:
+        cached = _counts.get(table)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+    total = db.session.execute(select(func.count()).select_from(model)).scalar()
+
+    with _counts_lock:
+        _counts[table] = (now + current_app.config["PAGINATION_COUNT_TTL"], total)
+
+    return total
+
+
+# total=true adds the cached count to the response, total=estimate allows an
+# estimated count, older page based clients always get the total
+
+
+def requested_total(model):
+    total = request.args.get("total", "false").lower()
+
+    if total in ("true", "estimate") or (
+        "page" in request.args and "cursor" not in request.args
+    ):
+        return count_rows(model, estimate=total == "estimate")
+
+    return None
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from flask import current_app
+from .metricsUtils import PASSWORD_HASH, PASSWORD_POOL_IN_FLIGHT, PASSWORD_POOL_REJECTED
+
+# bcrypt runs on a small process pool of each worker instead of the thread
+# serving the request, at most BCRYPT_WORKERS hashes run at once and
+# BCRYPT_QUEUE_SIZE more may wait, anything past that is rejected at once so
+# a burst of logins cannot pile up behind the pool
+# the pool processes are forked when the worker starts, before it runs any
+# other thread, BCRYPT_WORKERS=0 hashes in the request thread
+
+
+class PasswordPoolBusy(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Password hashing is saturated")
+        self.retry_after = retry_after
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+# these run in the pool processes
+
+
+def hash_in_process(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode(
+        "utf-8"
+    )
+
+
+def check_in_process(password, password_hash):
+    return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+def get_pool():
+    global _pool, _pool_pid, _slots
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            workers = current_app.config["BCRYPT_WORKERS"]
+
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(
+                workers + current_app.config["BCRYPT_QUEUE_SIZE"]
+            )
+
+        return _pool, _slots
+
+
+def reset_pool(pool):
+    global _pool
+
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def release(slots):
+    def done(_future):
+        slots.release()
+        PASSWORD_POOL_IN_FLIGHT.dec()
+
+    return done
+
+
+def run(operation, function, *args):
+    config = current_app.config
+
+    with PASSWORD_HASH.labels(operation).time():
+        if config["BCRYPT_WORKERS"] <= 0:
+            return function(*args)
+
+        pool, slots = get_pool()
+
+        if not slots.acquire(blocking=False):
+            PASSWORD_POOL_REJECTED.labels(operation).inc()
+            raise PasswordPoolBusy(config["BCRYPT_RETRY_AFTER"])
+
+        PASSWORD_POOL_IN_FLIGHT.inc()
+
+        try:
+            future = pool.submit(function, *args)
+        except BrokenProcessPool:
+            release(slots)(None)
+            reset_pool(pool)
+            raise
+
+        # the slot is given back when the hash finishes, not when this
+        # request stops waiting for it
+        future.add_done_callback(release(slots))
+
+        try:
+            return future.result(timeout=config["BCRYPT_TIMEOUT"])
+        except TimeoutError:
+            future.cancel()
+            PASSWORD_POOL_REJECTED.labels(operation).inc()
+            raise PasswordPoolBusy(config["BCRYPT_RETRY_AFTER"])
+        except BrokenProcessPool:
+            reset_pool(pool)
+            raise
+
+
+def hash_password(password):
+    return run(
+        "hash", hash_in_process, password, current_app.config["BCRYPT_LOG_ROUNDS"]
+    )
+
+
+def check_password(password, password_hash):
+    return run("check", check_in_process, password, password_hash)
+
+
+# hashes made with another cost than BCRYPT_LOG_ROUNDS are replaced on the
+# next successful login
+
+
+def needs_rehash(password_hash):
+    try:
+        rounds = int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+
+    return rounds != current_app.config["BCRYPT_LOG_ROUNDS"]
+
+
+def start(app):
+    if app.config["BCRYPT_WORKERS"] <= 0:
+        return
+
+    with app.app_context():
+        pool, _slots = get_pool()
+        pool.submit(time.sleep, 0).result()
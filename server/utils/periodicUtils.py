@@ -0,0 +1,56 @@
+import os
+import threading
+import time
+from ..config import db
+
+_tasks = {}
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+
+# maintenance tasks run every `interval` seconds on one daemon thread per
+# process, the thread is started again after a fork like the job pool
+# registering a name again replaces its task
+
+
+def register(name, interval, task):
+    if interval > 0:
+        _tasks[name] = (interval, task)
+    else:
+        _tasks.pop(name, None)
+
+
+def start(app):
+    global _thread, _thread_pid
+
+    with _thread_lock:
+        if not _tasks or (_thread is not None and _thread_pid == os.getpid()):
+            return
+
+        _thread = threading.Thread(
+            target=run, args=(app,), name="periodic-tasks", daemon=True
+        )
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+def run(app):
+    next_runs = {}
+
+    while True:
+        for name, (interval, task) in list(_tasks.items()):
+            if time.monotonic() < next_runs.get(name, 0.0):
+                continue
+
+            with app.app_context():
+                try:
+                    task()
+                except Exception as e:
+                    print(f"{name}: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+            next_runs[name] = time.monotonic() + interval
+
+        time.sleep(min(max(min(next_runs.values()) - time.monotonic(), 0.05), 1.0))
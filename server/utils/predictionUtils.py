@@ -0,0 +1,273 @@
+import time
+from datetime import datetime
+from sqlalchemy import bindparam, insert, or_, select, update
+from ..config import db
+from ..schema.classifications import Classification
+from ..schema.dataset import Dataset, FEATURE_COLUMNS
+from ..schema.predictions import Prediction
+from ..model.bagged_tree import predict_versioned
+from .analyticsUtils import record_predictions
+
+_class_names = None
+
+# the class table only holds the two default classes and never changes,
+# so it is read once per process, it is read again while it is empty in
+# case the worker started before the table was seeded
+
+
+def get_class_names():
+    global _class_names
+
+    if not _class_names:
+        _class_names = dict(
+            db.session.execute(
+                select(Classification.class_id, Classification.class_name)
+            ).all()
+        )
+
+    return _class_names
+
+
+# flag a single dataset as predicted and return its student id and features
+# in one round trip, returns None when the dataset does not exist or is
+# already predicted
+# the flag is set first so concurrent requests for the same dataset can not
+# both score it, the caller commits or rolls back
+
+
+def claim_dataset(data_id):
+    columns = [
+        Dataset.student_id,
+        *[getattr(Dataset, column) for column in FEATURE_COLUMNS],
+    ]
+    claimable = (Dataset.data_id == data_id) & (Dataset.already_predicted == False)
+
+    if db.engine.dialect.update_returning:
+        return db.session.execute(
+            update(Dataset)
+            .where(claimable)
+            .values(already_predicted=True)
+            .returning(*columns)
+            .execution_options(synchronize_session=False)
+        ).first()
+
+    data = db.session.execute(
+        select(*columns).where(claimable).with_for_update()
+    ).first()
+
+    if data is not None:
+        db.session.execute(
+            update(Dataset)
+            .where(Dataset.data_id == data_id)
+            .values(already_predicted=True)
+            .execution_options(synchronize_session=False)
+        )
+
+    return data
+
+
+# insert a new dataset row and return its id, SQLAlchemy uses
+# INSERT ... RETURNING where the backend supports it and the cursor's
+# lastrowid otherwise, so the row is never read back
+
+
+def insert_dataset(values):
+    result = db.session.execute(insert(Dataset.__table__).values(**values))
+    return result.inserted_primary_key[0]
+
+
+# insert a single prediction and add it to the analytics summary
+
+
+def insert_prediction(
+    data_id, class_id, user_id, prediction_time, features, model_version
+):
+    db.session.execute(
+        insert(Prediction.__table__).values(
+            data_id=data_id,
+            classification_id=class_id,
+            user_id=user_id,
+            prediction_time=prediction_time,
+            model_version=model_version,
+        )
+    )
+    record_predictions([(prediction_time, user_id, class_id, features)])
+
+
+# load the id, student id and the eight features of every row that still
+# needs a prediction, optionally restricted to the given dataset or student
+# ids
+# lock skips rows another transaction is already scoring where supported
+
+
+def load_unpredicted(
+    dataset_ids=None, limit=None, max_data_id=None, lock=False, student_ids=None
+):
+    statement = (
+        select(
+            Dataset.data_id,
+            Dataset.student_id,
+            *[getattr(Dataset, column) for column in FEATURE_COLUMNS],
+        )
+        .where(Dataset.already_predicted == False)
+        .order_by(Dataset.data_id)
+    )
+
+    if dataset_ids is not None:
+        statement = statement.where(Dataset.data_id.in_(dataset_ids))
+
+    if student_ids is not None:
+        statement = statement.where(Dataset.student_id.in_(student_ids))
+
+    if max_data_id is not None:
+        statement = statement.where(Dataset.data_id <= max_data_id)
+
+    if limit is not None:
+        statement = statement.limit(limit)
+
+    if lock:
+        statement = statement.with_for_update(skip_locked=True)
+
+    return db.session.execute(statement).all()
+
+
+# score the loaded rows with a single model call, insert every prediction
+# and flag the rows as predicted in the current transaction
+# the caller is responsible for committing
+
+
+def score_rows(rows, user_id):
+    if not rows:
+        return [], 0.0
+
+    import numpy as np
+
+    features = np.array([row[2:] for row in rows], dtype=np.float64)
+
+    start_time = time.perf_counter()
+    model_predictions, model_version = predict_versioned(features)
+    prediction_time = time.perf_counter() - start_time
+
+    class_names = get_class_names()
+
+    now = datetime.now()
+    prediction_rows = []
+    results = []
+
+    for row, model_prediction in zip(rows, model_predictions):
+        class_id = int(model_prediction) + 1
+
+        if class_id not in class_names:
+            raise LookupError(f"Classification {class_id} not found")
+
+        prediction_rows.append(
+            {
+                "data_id": row.data_id,
+                "classification_id": class_id,
+                "user_id": user_id,
+                "prediction_time": now,
+                "model_version": model_version,
+            }
+        )
+        results.append(
+            {
+                "dataset_id": row.data_id,
+                "student_id": row.student_id,
+                "prediction": class_names[class_id],
+            }
+        )
+
+    db.session.execute(insert(Prediction), prediction_rows)
+    record_predictions(
+        (now, user_id, prediction_row["classification_id"], row[2:])
+        for row, prediction_row in zip(rows, prediction_rows)
+    )
+    db.session.execute(
+        update(Dataset)
+        .where(Dataset.data_id.in_([row.data_id for row in rows]))
+        .values(already_predicted=True)
+    )
+
+    return results, prediction_time
+
+
+# load the predictions that were not made by the given model version
+# together with the features of their dataset, in prediction id order
+
+
+def load_outdated(model_version, limit, max_data_id=None, lock=False):
+    statement = (
+        select(
+            Prediction.prediction_id,
+            Prediction.classification_id,
+            Prediction.user_id,
+            Prediction.prediction_time,
+            *[getattr(Dataset, column) for column in FEATURE_COLUMNS],
+        )
+        .join(Dataset, Dataset.data_id == Prediction.data_id)
+        .where(
+            or_(
+                Prediction.model_version != model_version,
+                Prediction.model_version == None,
+            )
+        )
+        .order_by(Prediction.prediction_id)
+        .limit(limit)
+    )
+
+    if max_data_id is not None:
+        statement = statement.where(Prediction.data_id <= max_data_id)
+
+    if lock:
+        statement = statement.with_for_update(skip_locked=True, of=Prediction)
+
+    return db.session.execute(statement).all()
+
+
+# score the loaded predictions again with a single call of the given model
+# version, every row is updated with one executemany and the analytics
+# summary moves the predictions whose class changed
+# returns how many classes changed, the caller commits
+
+
+def rescore_rows(rows, model):
+    if not rows:
+        return 0
+
+    import numpy as np
+
+    model_predictions = model.predict(
+        np.array([row[4:] for row in rows], dtype=np.float64)
+    )
+
+    class_names = get_class_names()
+    table = Prediction.__table__
+
+    updates = []
+    removed = []
+    added = []
+
+    for row, model_prediction in zip(rows, model_predictions):
+        class_id = int(model_prediction) + 1
+
+        if class_id not in class_names:
+            raise LookupError(f"Classification {class_id} not found")
+
+        updates.append({"b_prediction_id": row.prediction_id, "b_class_id": class_id})
+
+        if class_id != row.classification_id:
+            removed.append(
+                (row.prediction_time, row.user_id, row.classification_id, row[4:])
+            )
+            added.append((row.prediction_time, row.user_id, class_id, row[4:]))
+
+    db.session.execute(
+        update(table)
+        .where(table.c.prediction_id == bindparam("b_prediction_id"))
+        .values(classification_id=bindparam("b_class_id"), model_version=model.version),
+        updates,
+    )
+    record_predictions(removed, sign=-1)
+    record_predictions(added)
+
+    return len(added)
@@ -0,0 +1,224 @@
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from . import periodicUtils
+from .metricsUtils import SQL_N_PLUS_ONE, SQL_SLOW_QUERIES
+
+# records every statement of a request, or of a query_budget block, while
+# profiling is on, it logs statements slower than SQL_SLOW_QUERY_MS with
+# their endpoint and flags a statement repeated SQL_N_PLUS_ONE_THRESHOLD
+# times within one request as a likely n+1
+# the engine hooks return right away while nothing is profiled, profiling
+# is switched for every worker of the host through a flag file that each
+# worker reads every SQL_PROFILER_SYNC_INTERVAL seconds, without the file
+# SQL_PROFILER decides
+
+_local = threading.local()
+_budgets = 0
+_budgets_lock = threading.Lock()
+
+enabled = False
+default_enabled = False
+flag_path = None
+slow_query_seconds = 0.1
+n_plus_one_threshold = 5
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryProfile:
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.seconds += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+    def summary(self, limit=5):
+        lines = [f"{self.count} queries in {self.seconds * 1000:.1f}ms"]
+
+        for statement, count in self.statements.most_common(limit):
+            lines.append(f"{count}x {' '.join(statement.split())[:200]}")
+
+        return "\n".join(lines)
+
+
+def active_profiles():
+    return getattr(_local, "profiles", None)
+
+
+def push(profile):
+    if active_profiles() is None:
+        _local.profiles = []
+
+    _local.profiles.append(profile)
+
+
+def pop(profile):
+    profiles = active_profiles()
+
+    if profiles and profile in profiles:
+        profiles.remove(profile)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if (enabled or _budgets) and active_profiles() and context is not None:
+        context._profile_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_time = getattr(context, "_profile_start", None)
+
+    if start_time is None:
+        return
+
+    elapsed = time.perf_counter() - start_time
+    profiles = active_profiles()
+
+    for profile in profiles or ():
+        profile.record(statement, elapsed)
+
+    if enabled and elapsed >= slow_query_seconds:
+        endpoint = request.endpoint if has_request_context() else None
+        SQL_SLOW_QUERIES.labels(endpoint or "none").inc()
+        print(
+            f"slow query {elapsed * 1000:.1f}ms in {endpoint}: "
+            + " ".join(statement.split())[:500]
+        )
+
+
+# counts the statements run by this thread inside the block, for example
+# around test client calls, and raises when there are more than
+# max_queries, it works whether profiling is switched on or not
+
+
+@contextmanager
+def query_budget(max_queries, label="query budget"):
+    global _budgets
+
+    profile = QueryProfile(label)
+
+    with _budgets_lock:
+        _budgets += 1
+
+    push(profile)
+
+    try:
+        yield profile
+    finally:
+        pop(profile)
+
+        with _budgets_lock:
+            _budgets -= 1
+
+    if profile.count > max_queries:
+        raise QueryBudgetExceeded(
+            f"{label}: {profile.count} queries, budget {max_queries}\n"
+            + profile.summary()
+        )
+
+
+def before_request():
+    if enabled:
+        g.sql_profile = QueryProfile(request.endpoint)
+        push(g.sql_profile)
+
+
+def after_request(response):
+    profile = g.get("sql_profile")
+
+    if profile is None:
+        return response
+
+    for statement, count in profile.repeated(n_plus_one_threshold):
+        SQL_N_PLUS_ONE.labels(request.endpoint or "none").inc()
+        print(
+            f"possible n+1 in {request.endpoint}, statement ran {count} times: "
+            + " ".join(statement.split())[:500]
+        )
+
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={profile.seconds * 1000:.1f};desc="{profile.count} queries"',
+    )
+
+    return response
+
+
+def teardown_request(exception):
+    profile = g.pop("sql_profile", None)
+
+    if profile is not None:
+        pop(profile)
+
+
+def set_enabled(value):
+    global enabled
+
+    enabled = bool(value)
+
+
+# the flag file reaches the other workers, this one switches at once
+
+
+def switch(value):
+    set_enabled(value)
+
+    temporary_path = f"{flag_path}.{os.getpid()}"
+
+    with open(temporary_path, "w") as flag_file:
+        flag_file.write("1" if value else "0")
+
+    os.replace(temporary_path, flag_path)
+
+
+def sync_enabled():
+    try:
+        with open(flag_path) as flag_file:
+            set_enabled(flag_file.read().strip() == "1")
+    except FileNotFoundError:
+        set_enabled(default_enabled)
+
+
+def init_app(app):
+    global default_enabled, flag_path, slow_query_seconds, n_plus_one_threshold
+
+    flag_path = app.config["SQL_PROFILER_FLAG_FILE"] or os.path.join(
+        tempfile.gettempdir(), "seps-sql-profiler"
+    )
+    slow_query_seconds = app.config["SQL_SLOW_QUERY_MS"] / 1000
+    n_plus_one_threshold = app.config["SQL_N_PLUS_ONE_THRESHOLD"]
+
+    default_enabled = app.config["SQL_PROFILER"]
+    sync_enabled()
+
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+
+    periodicUtils.register(
+        "sync_sql_profiler",
+        app.config["SQL_PROFILER_SYNC_INTERVAL"],
+        sync_enabled,
+    )
@@ -0,0 +1,182 @@
+import hashlib
+from datetime import datetime, timedelta
+from flask import current_app, request
+from flask_jwt_extended import create_refresh_token
+from sqlalchemy import and_, delete, or_, select, update
+from ..config import db
+from ..schema.refresh_token import RefreshToken
+from . import periodicUtils
+
+# refresh tokens are handed to browsers in an httpOnly cookie, clients that
+# do not keep cookies send the token in the X-Refresh-Token header instead
+# every refresh rotates the token, the presented one is blocklisted and a
+# new one is issued, presenting a blocklisted token again means it was
+# copied and every active token of its user is revoked
+
+REFRESH_COOKIE = "refresh_token"
+REFRESH_HEADER = "X-Refresh-Token"
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def refresh_expires():
+    expires = current_app.config["JWT_REFRESH_TOKEN_EXPIRES"]
+
+    if not isinstance(expires, timedelta):
+        expires = timedelta(seconds=expires)
+
+    return expires
+
+
+def presented_token():
+    return request.headers.get(REFRESH_HEADER) or request.cookies.get(REFRESH_COOKIE)
+
+
+# the row is added to the session of the caller, it is stored with the
+# commit of the login or the rotation
+
+
+def issue_refresh_token(user_id):
+    token = create_refresh_token(identity=user_id)
+
+    db.session.add(
+        RefreshToken(
+            user_id=user_id,
+            token_hash=hash_token(token),
+            expires_at=datetime.utcnow() + refresh_expires(),
+        )
+    )
+
+    return token
+
+
+# the token is blocklisted with a conditional update so of two requests
+# presenting the same token only one gets a new one
+# returns the new token or None when the presented one is not valid
+
+
+def rotate_refresh_token(user_id, token):
+    token_hash = hash_token(token)
+
+    result = db.session.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.user_id == user_id,
+            RefreshToken.blocklisted.is_(False),
+            RefreshToken.expires_at > datetime.utcnow(),
+        )
+        .values(blocklisted=True)
+    )
+
+    if result.rowcount != 1:
+        reused = db.session.execute(
+            select(RefreshToken.token_id).where(
+                RefreshToken.token_hash == token_hash,
+                RefreshToken.user_id == user_id,
+                RefreshToken.blocklisted.is_(True),
+            )
+        ).first()
+
+        if reused is not None:
+            revoke_refresh_tokens(user_id)
+
+        db.session.commit()
+        return None
+
+    new_token = issue_refresh_token(user_id)
+    db.session.commit()
+
+    return new_token
+
+
+# revokes the given token of the user, or all of them without one
+
+
+def revoke_refresh_tokens(user_id, token=None):
+    statement = update(RefreshToken).where(
+        RefreshToken.user_id == user_id, RefreshToken.blocklisted.is_(False)
+    )
+
+    if token is not None:
+        statement = statement.where(RefreshToken.token_hash == hash_token(token))
+
+    db.session.execute(statement.values(blocklisted=True))
+
+
+# older clients refresh without presenting a token, they are served as long
+# as the user still has an active one unless REFRESH_TOKEN_REQUIRED is set
+
+
+def has_active_refresh_token(user_id):
+    return (
+        db.session.execute(
+            select(RefreshToken.token_id)
+            .where(
+                RefreshToken.user_id == user_id,
+                RefreshToken.blocklisted.is_(False),
+                or_(
+                    RefreshToken.expires_at.is_(None),
+                    RefreshToken.expires_at > datetime.utcnow(),
+                ),
+            )
+            .limit(1)
+        ).first()
+        is not None
+    )
+
+
+# the cookie is never sent with requests from other sites, a page of
+# another site could otherwise rotate it and read the new access token
+
+
+def set_refresh_cookie(response, token):
+    response.set_cookie(
+        REFRESH_COOKIE,
+        token,
+        max_age=int(refresh_expires().total_seconds()),
+        path="/",
+        secure=current_app.config["REFRESH_COOKIE_SECURE"],
+        httponly=True,
+        samesite="Lax",
+    )
+
+    return response
+
+
+def unset_refresh_cookie(response):
+    response.delete_cookie(REFRESH_COOKIE, path="/")
+
+    return response
+
+
+# expired tokens can never be rotated, blocklisted ones are kept until then
+# so a reused token is still recognised, rows stored before tokens had an
+# expiry are removed one refresh lifetime after they were created
+
+
+def purge_refresh_tokens():
+    now = datetime.utcnow()
+
+    db.session.execute(
+        delete(RefreshToken).where(
+            or_(
+                RefreshToken.expires_at < now,
+                and_(
+                    RefreshToken.expires_at.is_(None),
+                    RefreshToken.created_at < now - refresh_expires(),
+                ),
+            )
+        )
+    )
+    db.session.commit()
+
+
+def init_app(app):
+    periodicUtils.register(
+        "purge_refresh_tokens",
+        app.config["REFRESH_TOKEN_PURGE_INTERVAL"],
+        purge_refresh_tokens,
+    )
@@ -0,0 +1,234 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import delete, select
+from ..config import db
+from ..schema.blocklist import TokenBlocklist
+from . import periodicUtils
+from .metricsUtils import REVOCATION_CHECKS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# revoked jtis are added to a bloom filter shared by the workers of a host
+# through a memory-mapped file, a token that is not in the filter is
+# certainly not revoked and only possible hits are confirmed in the database
+# a jti only matters until its token expires, so the filter has two
+# generations of one token lifetime each, the older one is cleared when a
+# new one starts and the filter never fills up
+# revocations made on other hosts, or before this process started, are
+# read from the database every TOKEN_BLOCKLIST_SYNC_INTERVAL seconds
+
+HASHES = 7
+HEADER = struct.Struct("QQ")
+
+
+class RevocationFilter:
+    def __init__(self, bits=1 << 20, period=60, path=None):
+        self.bits = bits
+        self.period = period
+        self.path = path
+        self.lock = threading.Lock()
+        self._map = None
+        self._fd = None
+        self._pid = None
+
+    # the generations and the layout of the file follow the period and the
+    # size, so they are part of its name, a filter with other settings
+    # starts from an empty file and the first sync fills it again
+
+    @property
+    def file_path(self):
+        return f"{self.path}-{self.period}-{self.bits}"
+
+    # the file is mapped again after a fork so every process holds its own
+    # descriptor for the record locks, without fcntl the filter only lives
+    # in this process
+
+    def _mapped(self):
+        if self._pid != os.getpid():
+            size = HEADER.size + 2 * (self.bits // 8)
+
+            if self.path is None or fcntl is None:
+                self._map = mmap.mmap(-1, size)
+                self._fd = None
+            else:
+                fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o600)
+
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+
+                self._map = mmap.mmap(fd, size)
+                self._fd = fd
+
+            self._pid = os.getpid()
+
+        return self._map
+
+    def _positions(self, jti):
+        digest = hashlib.blake2b(jti.encode("utf-8"), digest_size=16).digest()
+        first, second = struct.unpack("QQ", digest)
+
+        return [(first + index * second) % self.bits for index in range(HASHES)]
+
+    def _offset(self, generation):
+        return HEADER.size + (generation % 2) * (self.bits // 8)
+
+    def add(self, jti, revoked_at=None):
+        generation = int((revoked_at or time.time()) // self.period)
+
+        # a token revoked before the previous generation has expired
+        if generation < int(time.time() // self.period) - 1:
+            return
+
+        with self.lock:
+            bloom = self._mapped()
+
+            if self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+
+            try:
+                epochs = list(HEADER.unpack_from(bloom, 0))
+                offset = self._offset(generation)
+
+                if epochs[generation % 2] != generation:
+                    if epochs[generation % 2] > generation:
+                        return
+                    bloom[offset : offset + self.bits // 8] = bytes(self.bits // 8)
+                    epochs[generation % 2] = generation
+                    HEADER.pack_into(bloom, 0, *epochs)
+
+                for position in self._positions(jti):
+                    index = offset + position // 8
+                    bloom[index] = bloom[index] | (1 << (position % 8))
+            finally:
+                if self._fd is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def might_contain(self, jti):
+        bloom = self._mapped()
+        epochs = HEADER.unpack_from(bloom, 0)
+        current = int(time.time() // self.period)
+        positions = self._positions(jti)
+
+        for generation in (current, current - 1):
+            if epochs[generation % 2] != generation:
+                continue
+
+            offset = self._offset(generation)
+
+            if all(
+                bloom[offset + position // 8] & (1 << (position % 8))
+                for position in positions
+            ):
+                return True
+
+        return False
+
+
+revocation_filter = RevocationFilter()
+_synced_until = None
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# how long a revoked access token can still be presented
+
+
+def retention(app=None):
+    config = (app or current_app).config
+    expires = config["JWT_ACCESS_TOKEN_EXPIRES"]
+
+    if not isinstance(expires, timedelta):
+        expires = timedelta(seconds=expires)
+
+    return expires + timedelta(seconds=config.get("JWT_DECODE_LEEWAY", 0))
+
+
+def revoke(jti, revoked_at):
+    revocation_filter.add(jti, revoked_at.timestamp())
+
+
+# until the first sync the filter may miss older revocations, so every
+# check goes to the database
+
+
+def is_revoked(jti):
+    if _synced_until is not None and not revocation_filter.might_contain(jti):
+        REVOCATION_CHECKS.labels("filtered").inc()
+        return False
+
+    revoked = (
+        db.session.execute(select(TokenBlocklist.id).where(TokenBlocklist.jti == jti))
+        .scalars()
+        .first()
+        is not None
+    )
+    REVOCATION_CHECKS.labels("revoked" if revoked else "false_positive").inc()
+
+    return revoked
+
+
+# adds the revocations committed since the last sync, the window overlaps a
+# few seconds so rows committed slightly out of order are not missed
+
+
+def sync_revocations():
+    global _synced_until
+
+    since = utc_now() - retention()
+
+    if _synced_until is not None:
+        since = max(since, _synced_until - timedelta(seconds=5))
+
+    rows = db.session.execute(
+        select(TokenBlocklist.jti, TokenBlocklist.created_at).where(
+            TokenBlocklist.created_at >= since
+        )
+    ).all()
+
+    for jti, created_at in rows:
+        revocation_filter.add(jti, created_at.replace(tzinfo=timezone.utc).timestamp())
+
+    _synced_until = max((row.created_at for row in rows), default=since)
+
+
+# rows of tokens that have expired can never be looked up again
+
+
+def prune_blocklist():
+    db.session.execute(
+        delete(TokenBlocklist).where(
+            TokenBlocklist.created_at < utc_now() - retention()
+        )
+    )
+    db.session.commit()
+
+
+def init_app(app):
+    revocation_filter.bits = app.config["TOKEN_BLOOM_BITS"]
+    revocation_filter.period = max(int(retention(app).total_seconds()), 1)
+    revocation_filter.path = app.config["TOKEN_BLOOM_FILE"] or os.path.join(
+        tempfile.gettempdir(), "seps-revoked-tokens"
+    )
+
+    periodicUtils.register(
+        "sync_revocations",
+        app.config["TOKEN_BLOCKLIST_SYNC_INTERVAL"],
+        sync_revocations,
+    )
+    periodicUtils.register(
+        "prune_blocklist",
+        app.config["TOKEN_BLOCKLIST_PRUNE_INTERVAL"],
+        prune_blocklist,
+    )
@@ -0,0 +1,82 @@
+from werkzeug.http import http_date
+from ..schema.classifications import Classification
+from ..schema.dataset import Dataset, FEATURE_COLUMNS
+from ..schema.predictions import Prediction
+from ..schema.users import User
+
+# list endpoints select plain columns instead of ORM objects, the rows skip
+# the identity map and lazy loading entirely and every related value comes
+# from the join of the same query
+# the output matches what the endpoints returned before, datetimes of the
+# dataset and users keep the http date format of jsonify
+
+DATASET_COLUMNS = [
+    Dataset.data_id,
+    Dataset.student_id,
+    *[getattr(Dataset, column) for column in FEATURE_COLUMNS],
+    Dataset.uploaded_at,
+    Dataset.already_predicted,
+]
+
+PREDICTION_COLUMNS = [
+    Prediction.prediction_id,
+    Classification.class_name.label("classification"),
+    Prediction.data_id.label("dataset_id"),
+    User.username.label("predicted_by"),
+    User.email,
+    Prediction.prediction_time,
+    Prediction.model_version,
+]
+
+USER_COLUMNS = [
+    User.user_id,
+    User.username,
+    User.email,
+    User.verified,
+    User.created_at,
+]
+
+
+def format_datetime(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S") if value is not None else None
+
+
+def format_http_date(value):
+    return http_date(value) if value is not None else None
+
+
+DATASET_FORMATTERS = {"uploaded_at": format_http_date}
+PREDICTION_FORMATTERS = {"prediction_time": format_datetime}
+USER_FORMATTERS = {"created_at": format_http_date}
+
+
+def prediction_joins(statement):
+    return statement.join(
+        Classification, Classification.class_id == Prediction.classification_id
+    ).join(User, User.user_id == Prediction.user_id)
+
+
+# turns result rows into dicts keyed by the selected column names, the
+# formatters are looked up once per call instead of once per value
+
+
+def serialize_rows(rows, formatters=None):
+    if not rows:
+        return []
+
+    fields = rows[0]._fields
+    formatters = [
+        (index, formatters[field])
+        for index, field in enumerate(fields)
+        if formatters and field in formatters
+    ]
+
+    items = []
+
+    for row in rows:
+        values = list(row)
+        for index, formatter in formatters:
+            values[index] = formatter(values[index])
+        items.append(dict(zip(fields, values)))
+
+    return items
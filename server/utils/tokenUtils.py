@@ -1,23 +1,27 @@
 from flask import jsonify
 from flask_jwt_extended import JWTManager
-from server.schema.blocklist import TokenBlocklist
 from ..config import db
-from server.schema.users import User
+from .revocationUtils import is_revoked
+from .userCacheUtils import get_user_record
 
 jwt = JWTManager()
 
 
+# current_user is served from the user record cache
+
+
 @jwt.user_lookup_loader
 def user_lookup_loader(_jwt_headers, jwt_data):
-    identity = jwt_data["sub"]
-    return User.query.filter_by(user_id=identity).one_or_none()
+    return get_user_record(jwt_data["sub"])
+
+
+# answered from the shared bloom filter, the database is only queried when
+# the jti may have been revoked
 
 
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload: dict) -> bool:
-    jti = jwt_payload["jti"]
-    token = db.session.query(TokenBlocklist.id).filter_by(jti=jti).scalar()
-    return token is not None
+    return is_revoked(jwt_payload["jti"])
 
 
 @jwt.unauthorized_loader
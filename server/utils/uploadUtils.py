@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from ..config import db
+from ..schema.dataset import Dataset, FEATURE_COLUMNS
+from .predictionUtils import load_unpredicted, score_rows
+
+# parses a csv or ndjson body line by line as it is read from the request
+# stream and yields (line, student_id, features, error) for every row
+# csv needs a header with student_id or studentId and the eight feature
+# columns, ndjson accepts the /upload body ({"studentId", "features"}) or
+# the same named columns
+
+
+def parse_rows(stream, upload_format, feature_range=None):
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+    if upload_format == "csv":
+        reader = csv.DictReader(text)
+        records = ((reader.line_num, record) for record in reader)
+    else:
+        records = (
+            (line_number, line)
+            for line_number, line in enumerate(text, start=1)
+            if line.strip()
+        )
+
+    for line_number, record in records:
+        try:
+            if upload_format != "csv":
+                record = json.loads(record)
+
+            student_id, features = read_record(record, feature_range)
+            yield line_number, student_id, features, None
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            yield line_number, None, None, f"Invalid row: {e}"
+
+
+# feature_range is the (low, high) every feature has to be within
+
+
+def read_record(record, feature_range=None):
+    student_id = record.get("studentId", record.get("student_id"))
+
+    if "features" in record:
+        values = record["features"]
+        if len(values) != len(FEATURE_COLUMNS):
+            raise ValueError(f"expected {len(FEATURE_COLUMNS)} features")
+    else:
+        values = [record[column] for column in FEATURE_COLUMNS]
+
+    features = [to_int(value, column) for value, column in zip(values, FEATURE_COLUMNS)]
+
+    if feature_range is not None:
+        low, high = feature_range
+
+        for value, column in zip(features, FEATURE_COLUMNS):
+            if not low <= value <= high:
+                raise ValueError(f"{column} must be between {low} and {high}")
+
+    return to_int(student_id, "studentId"), features
+
+
+# text is parsed with int and never through float, which would change ids
+# above 2**53, a zero fraction like "3.0" is accepted
+
+
+def to_int(value, name):
+    if value is None or str(value).strip() == "":
+        raise ValueError(f"{name} is missing")
+
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a whole number")
+
+    if isinstance(value, int):
+        return value
+
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{name} must be a whole number")
+
+        return int(value)
+
+    whole, _, fraction = str(value).strip().partition(".")
+
+    if fraction.strip("0") or not whole.lstrip("+-").isdigit():
+        raise ValueError(f"{name} must be a whole number")
+
+    return int(whole)
+
+
+# saves one chunk of parsed rows with a single query for existing student
+# ids and one bulk insert, the chunk is committed on its own so memory and
+# transaction size stay bounded whatever the size of the upload
+
+
+def save_chunk(rows, user_id=None, predict=False):
+    student_ids = [row["student_id"] for row in rows]
+
+    for attempt in range(2):
+        existing = set(
+            db.session.execute(
+                select(Dataset.student_id).where(Dataset.student_id.in_(student_ids))
+            ).scalars()
+        )
+        new_rows = [row for row in rows if row["student_id"] not in existing]
+
+        try:
+            if new_rows:
+                db.session.execute(insert(Dataset.__table__), new_rows)
+
+            predictions = {}
+
+            if predict and new_rows:
+                scored, _ = score_rows(
+                    load_unpredicted(
+                        student_ids=[row["student_id"] for row in new_rows]
+                    ),
+                    user_id,
+                )
+                predictions = {
+                    result["student_id"]: result["prediction"] for result in scored
+                }
+
+            db.session.commit()
+            return existing, predictions
+        except IntegrityError:
+            # another upload inserted some of these students in the meantime
+            db.session.rollback()
+            if attempt == 1:
+                raise
@@ -0,0 +1,56 @@
+from collections import namedtuple
+from sqlalchemy import select
+from ..config import db
+from ..schema.users import User
+from .cacheUtils import LRUCache, replica_may_lag, table_versions
+from .databaseUtils import replica_reads
+from .metricsUtils import USER_CACHE
+
+# current_user is a lightweight read-only record instead of an ORM object,
+# records are cached per user id and stamped with the write version of the
+# users table, so a committed user write in any worker of the host makes
+# every cached record stale and the TTL bounds writes made elsewhere
+
+UserRecord = namedtuple(
+    "UserRecord", ["user_id", "username", "email", "verified", "created_at"]
+)
+
+user_cache = LRUCache()
+
+
+def get_user_record(user_id):
+    version = table_versions.read(("users",))
+    entry = user_cache.get(user_id)
+
+    if entry is not None and entry[0] == version:
+        USER_CACHE.labels("hit").inc()
+        return entry[1]
+
+    USER_CACHE.labels("miss").inc()
+
+    # read as the user, the token is not verified yet at this point
+    with replica_reads(key=f"user:{user_id}"):
+        row = db.session.execute(
+            select(
+                User.user_id, User.username, User.email, User.verified, User.created_at
+            ).where(User.user_id == user_id)
+        ).first()
+
+    if row is None:
+        return None
+
+    record = UserRecord(*row)
+
+    if not replica_may_lag(("users",)):
+        user_cache.set(user_id, (version, record))
+
+    return record
+
+
+def invalidate_user(user_id):
+    user_cache.pop(user_id)
+
+
+def init_app(app):
+    user_cache.max_entries = app.config["USER_CACHE_SIZE"]
+    user_cache.ttl = app.config["USER_CACHE_TTL"]
@@ -0,0 +1,109 @@
+import os
+import pytest
+
+# one app for the whole run, create_app registers engine listeners and
+# periodic tasks at module level, every file it shares with other
+# processes is kept in the temporary directory of the run
+# the app is created like a preloaded gunicorn app, so the worker threads
+# only start once the tables exist
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    state_dir = tmp_path_factory.mktemp("state")
+
+    os.environ.update(
+        {
+            "DATABASE_URI": f"sqlite:///{state_dir / 'test.db'}",
+            "SECRET_KEY": "test",
+            "JWT_SECRET_KEY": "test",
+            "GUNICORN_PRELOAD": "true",
+            "MODEL_LOADING": "lazy",
+            "MAIL_OUTBOX_INTERVAL": "0",
+            "RESPONSE_CACHE_ENABLED": "false",
+            "ADMISSION_STATE_DIR": str(state_dir),
+            "DB_RECENT_WRITES_FILE": str(state_dir / "recent-writes"),
+            "RESPONSE_CACHE_VERSIONS_FILE": str(state_dir / "versions"),
+            "TOKEN_BLOOM_FILE": str(state_dir / "bloom"),
+            "SQL_PROFILER_FLAG_FILE": str(state_dir / "sql-profiler"),
+        }
+    )
+
+    from server import create_app, init_worker
+    from server.config import db
+    from server.schema.classifications import Classification
+
+    app = create_app()
+    app.config["TESTING"] = True
+
+    with app.app_context():
+        db.create_all()
+        Classification.initialize_default_class()
+
+    init_worker(app)
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope="session")
+def user(app):
+    from server.config import db
+    from server.schema.users import User
+
+    with app.app_context():
+        user = User(username="alice", email="alice@example.com", password="secret")
+        user.user_id = "alice"
+        user.verified = True
+        db.session.add(user)
+        db.session.commit()
+
+    return {"user_id": "alice", "email": "alice@example.com", "password": "secret"}
+
+
+@pytest.fixture
+def auth_headers(client, user):
+    response = client.post(
+        "/login", json={"email": user["email"], "password": user["password"]}
+    )
+    assert response.status_code == 200, response.get_json()
+
+    return {"Authorization": f"Bearer {response.get_json()['accessToken']}"}
+
+
+# datasets with a prediction for every other one
+
+
+@pytest.fixture(scope="session")
+def datasets(app, user):
+    from server.config import db
+    from server.schema.dataset import FEATURE_COLUMNS, Dataset
+    from server.schema.predictions import Prediction
+
+    with app.app_context():
+        for index in range(40):
+            data = Dataset(
+                student_id=1000 + index,
+                already_predicted=index % 2 == 0,
+                **{column: index % 5 + 1 for column in FEATURE_COLUMNS},
+            )
+            db.session.add(data)
+            db.session.flush()
+
+            if data.already_predicted:
+                db.session.add(
+                    Prediction(
+                        data_id=data.data_id,
+                        classification_id=index % 4 // 2 + 1,
+                        user_id=user["user_id"],
+                        model_version="cadmlm-bt",
+                    )
+                )
+
+        db.session.commit()
+
+    return 40
@@ -0,0 +1,108 @@
+import os
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+import pytest
+from server.utils.admissionUtils import (
+    BUCKET,
+    BUCKETS,
+    SLOT,
+    AdmissionGroup,
+    load_group,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def group_config(state_dir):
+    config = {"ADMISSION_STATE_DIR": str(state_dir)}
+
+    for setting, value in (
+        ("CONCURRENCY", 1),
+        ("QUEUE_SIZE", 0),
+        ("QUEUE_TIMEOUT", 0.1),
+        ("RATE", 1.0),
+        ("BURST", 2.0),
+    ):
+        config[f"ADMISSION_TEST_{setting}"] = value
+
+    return SimpleNamespace(config=config)
+
+
+def test_missing_state_dir_is_created(tmp_path):
+    group = load_group(group_config(tmp_path / "missing" / "admission"), "test")
+
+    slot, response = group.admit("ip:127.0.0.1")
+
+    assert response is None
+    group.release(slot)
+
+
+def test_bucket_from_another_clock_is_not_drained(tmp_path):
+    group = AdmissionGroup("test", 1, 0, 0.1, rate=1.0, burst=2.0)
+    group.path = str(tmp_path / "admission")
+
+    assert group.take_token("ip:127.0.0.1") == 0
+
+    # every bucket written a day ahead, as after the clock was set back
+    state = group._mapped()
+    offset = SLOT.size * (group.concurrency + group.queue_size)
+
+    for index in range(BUCKETS):
+        key_hash, tokens, _ = BUCKET.unpack_from(state, offset + index * BUCKET.size)
+        BUCKET.pack_into(
+            state, offset + index * BUCKET.size, key_hash, tokens, time.time() + 86400
+        )
+
+    assert group.take_token("ip:127.0.0.1") == 0
+    assert 0 < group.take_token("ip:127.0.0.1") <= 1
+
+
+CHECK_PROXY = """
+from server import create_app
+
+client = create_app().test_client()
+
+
+def login(forwarded_for):
+    return client.post(
+        "/login",
+        json={},
+        headers={"X-Forwarded-For": forwarded_for},
+        environ_base={"REMOTE_ADDR": "10.0.0.1"},
+    ).status_code == 429
+
+
+print(login("192.0.2.1"), login("192.0.2.2"), login("192.0.2.1"))
+"""
+
+
+# logins are limited per client address, behind a proxy it comes from
+# X-Forwarded-For
+
+
+@pytest.mark.parametrize(
+    "proxies, statuses", [("1", "False False True"), ("0", "False True True")]
+)
+def test_login_bucket_follows_forwarded_address(tmp_path, proxies, statuses):
+    env = dict(
+        os.environ,
+        PROXY_FIX_X_FOR=proxies,
+        GUNICORN_PRELOAD="true",
+        DATABASE_URI=f"sqlite:///{tmp_path / 'proxy.db'}",
+        SECRET_KEY="test",
+        ADMISSION_STATE_DIR=str(tmp_path),
+        ADMISSION_LOGIN_RATE="0.001",
+        ADMISSION_LOGIN_BURST="1",
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_PROXY],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip().splitlines()[-1] == statuses
@@ -0,0 +1,71 @@
+import joblib
+import numpy as np
+import pytest
+from server.model.bagged_tree import COMPILED_MAX_BATCH, cadmlm_model
+from server.model.compiled import SMALL_BATCH, compile_model
+
+
+@pytest.fixture(scope="module")
+def model():
+    return joblib.load(cadmlm_model)
+
+
+@pytest.fixture(scope="module")
+def compiled(model):
+    return compile_model(model)
+
+
+def feature_rows(compiled, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    thresholds = compiled.threshold[~compiled.is_leaf()]
+    low, high = np.floor(thresholds.min()) - 1, np.ceil(thresholds.max()) + 1
+
+    return np.vstack(
+        [
+            rng.integers(low, high + 1, size=(n_rows, compiled.n_features_in_)),
+            rng.uniform(low, high, size=(n_rows, compiled.n_features_in_)),
+        ]
+    ).astype(np.float64)
+
+
+# rows sitting exactly on a split threshold, just above it and at the ends
+# of the feature range
+
+
+def edge_rows(compiled):
+    thresholds = np.unique(compiled.threshold[~compiled.is_leaf()])
+    values = np.concatenate(
+        [
+            thresholds,
+            np.nextafter(thresholds, np.inf),
+            [thresholds.min() - 1, thresholds.max() + 1],
+        ]
+    )
+
+    return np.repeat(values[:, None], compiled.n_features_in_, axis=1)
+
+
+@pytest.mark.parametrize(
+    "n_rows",
+    [1, SMALL_BATCH, SMALL_BATCH + 1, COMPILED_MAX_BATCH + 1, 2 * COMPILED_MAX_BATCH],
+)
+def test_random_rows_match_sklearn(model, compiled, n_rows):
+    X = feature_rows(compiled, n_rows)[:n_rows]
+
+    assert np.array_equal(compiled.predict(X), model.predict(X))
+    assert np.array_equal(compiled.predict_proba(X), model.predict_proba(X))
+
+
+def test_edge_rows_match_sklearn(model, compiled):
+    X = edge_rows(compiled)
+
+    assert np.array_equal(compiled.predict(X), model.predict(X))
+    assert np.array_equal(compiled.predict_proba(X), model.predict_proba(X))
+
+    for row in X:
+        assert np.array_equal(compiled.predict(row), model.predict([row]))
+
+
+def test_wrong_feature_count_is_rejected(compiled):
+    with pytest.raises(ValueError):
+        compiled.predict(np.zeros((2, compiled.n_features_in_ + 1)))
@@ -0,0 +1,19 @@
+import pytest
+from server.model import bagged_tree
+
+
+@pytest.mark.parametrize(
+    "version", ["../cadmlm-bt", "/etc/passwd", "missing", "model/../cadmlm-bt"]
+)
+def test_unknown_versions_are_not_loaded(version):
+    with pytest.raises(LookupError):
+        bagged_tree.load_version(version)
+
+
+@pytest.mark.parametrize("version", ["../../tmp/model", "/tmp/model", "missing"])
+def test_rescore_job_rejects_unknown_versions(client, auth_headers, version):
+    response = client.post(
+        "/jobs", json={"kind": "rescore", "modelVersion": version}, headers=auth_headers
+    )
+
+    assert response.status_code == 404
@@ -0,0 +1,77 @@
+import pytest
+from sqlalchemy import text
+from server.config import db
+from server.utils import profilerUtils
+from server.utils.metricsUtils import SQL_N_PLUS_ONE
+from server.utils.profilerUtils import QueryBudgetExceeded, query_budget
+
+
+@pytest.fixture
+def profiler():
+    profilerUtils.set_enabled(True)
+    yield profilerUtils
+    profilerUtils.set_enabled(False)
+
+
+def n_plus_one_count(endpoint):
+    return SQL_N_PLUS_ONE.labels(endpoint)._value.get()
+
+
+def test_request_within_budget(client, auth_headers):
+    with query_budget(2) as profile:
+        response = client.get("/user", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert profile.count <= 2
+
+
+def test_request_over_budget_raises(client, auth_headers, datasets):
+    with pytest.raises(QueryBudgetExceeded, match="budget 0"):
+        with query_budget(0):
+            client.get("/dataset?page=2&limit=5", headers=auth_headers)
+
+
+def test_repeated_statement_is_reported(app, profiler, capsys):
+    before = n_plus_one_count("user.get_users")
+
+    with app.test_request_context("/users"):
+        app.preprocess_request()
+
+        for _ in range(profiler.n_plus_one_threshold):
+            db.session.execute(text("SELECT 1")).all()
+
+        response = app.process_response(app.response_class())
+        app.do_teardown_request()
+
+    assert n_plus_one_count("user.get_users") == before + 1
+    assert "possible n+1 in user.get_users" in capsys.readouterr().out
+    assert (
+        f'{profiler.n_plus_one_threshold} queries"' in response.headers["Server-Timing"]
+    )
+
+
+def test_distinct_statements_are_not_reported(app, profiler):
+    before = n_plus_one_count("user.get_users")
+
+    with app.test_request_context("/users"):
+        app.preprocess_request()
+
+        for value in range(profiler.n_plus_one_threshold):
+            db.session.execute(text(f"SELECT {value}")).all()
+
+        app.process_response(app.response_class())
+        app.do_teardown_request()
+
+    assert n_plus_one_count("user.get_users") == before
+
+
+def test_profiler_is_switched_at_runtime(client, auth_headers):
+    response = client.post("/profiler", json={"enabled": True}, headers=auth_headers)
+
+    try:
+        assert response.get_json() == {"enabled": True}
+        assert "Server-Timing" in client.get("/user", headers=auth_headers).headers
+    finally:
+        client.post("/profiler", json={"enabled": False}, headers=auth_headers)
+
+    assert "Server-Timing" not in client.get("/user", headers=auth_headers).headers
@@ -0,0 +1,57 @@
+import pytest
+from server.utils.profilerUtils import query_budget
+
+# the list endpoints read a page with a single select of the serialized
+# columns, joins included, whatever the page size
+
+
+@pytest.fixture
+def warm_headers(client, auth_headers):
+    # the first request of a token also loads its user
+    client.get("/user", headers=auth_headers)
+
+    return auth_headers
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/dataset?limit=5",
+        "/dataset?limit=40",
+        "/predictions?limit=5",
+        "/predictions?limit=20",
+    ],
+)
+def test_list_query_count(client, warm_headers, datasets, path):
+    with query_budget(1) as profile:
+        response = client.get(path, headers=warm_headers)
+
+    assert response.status_code == 200, response.get_json()
+    assert profile.count == 1, profile.summary()
+
+
+# offset pages also report their total, the count is cached per table
+# version so it adds at most one statement
+
+
+@pytest.mark.parametrize(
+    "path", ["/dataset?page=2&limit=10", "/predictions?page=2&limit=5"]
+)
+def test_offset_page_query_count(client, warm_headers, datasets, path):
+    with query_budget(2):
+        response = client.get(path, headers=warm_headers)
+
+    assert response.status_code == 200, response.get_json()
+
+
+def test_predictions_are_serialized_with_their_joins(client, warm_headers, datasets):
+    with query_budget(1):
+        response = client.get("/predictions?limit=20", headers=warm_headers)
+
+    items = response.get_json()["predictions"]
+
+    assert len(items) == 20
+    assert {item["classification"] for item in items} == {
+        "LessEmployable",
+        "Employable",
+    }
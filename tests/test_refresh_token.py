@@ -0,0 +1,74 @@
+import pytest
+
+
+@pytest.fixture
+def login_response(client, user):
+    return client.post(
+        "/login", json={"email": user["email"], "password": user["password"]}
+    )
+
+
+def test_refresh_cookie_stays_on_its_site(login_response):
+    cookie = login_response.headers["Set-Cookie"]
+
+    assert "HttpOnly" in cookie
+    assert "SameSite=Lax" in cookie
+
+
+def test_refresh_route_only_accepts_post(client, user):
+    assert client.get(f"/{user['user_id']}/refresh_token").status_code == 405
+
+
+def test_refresh_without_token_is_rejected(client, user, login_response):
+    client.delete_cookie("refresh_token")
+
+    response = client.post(f"/{user['user_id']}/refresh_token")
+
+    assert response.status_code == 404
+    assert "accessToken" not in response.get_json()
+
+
+def test_refresh_token_is_rotated(client, user, login_response):
+    token = login_response.headers["Set-Cookie"].split(";")[0].split("=", 1)[1]
+    headers = {"X-Refresh-Token": token}
+
+    response = client.post(f"/{user['user_id']}/refresh_token", headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()["refreshToken"] != token
+
+    # presenting the rotated token again revokes the new one too
+    reused = client.post(f"/{user['user_id']}/refresh_token", headers=headers)
+
+    assert reused.status_code == 404
+
+
+def test_other_origins_are_not_allowed_credentials(client, user):
+    response = client.post(
+        f"/{user['user_id']}/refresh_token",
+        headers={"Origin": "https://attacker.example"},
+    )
+
+    assert "Access-Control-Allow-Origin" not in response.headers
+    assert "Access-Control-Allow-Credentials" not in response.headers
+
+
+def test_header_clients_get_their_first_token_at_login(client, user):
+    login = client.post(
+        "/login",
+        json={"email": user["email"], "password": user["password"]},
+        headers={"X-Refresh-Token": "1"},
+    )
+    token = login.get_json()["refreshToken"]
+    client.delete_cookie("refresh_token")
+
+    response = client.post(
+        f"/{user['user_id']}/refresh_token", headers={"X-Refresh-Token": token}
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["refreshToken"] != token
+
+
+def test_cookie_clients_do_not_get_the_token_in_the_body(login_response):
+    assert "refreshToken" not in login_response.get_json()
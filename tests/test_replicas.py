@@ -0,0 +1,163 @@
+import os
+import time
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+# a second app with its own primary and one replica, two sqlite files that
+# hold different rows so every read tells where it went
+
+
+def add_rows(session, user_ids, student_ids):
+    from server.schema.dataset import FEATURE_COLUMNS, Dataset
+    from server.schema.users import User
+
+    for user_id in user_ids:
+        user = User(username=user_id, email=f"{user_id}@example.com", password="secret")
+        user.user_id = user_id
+        session.add(user)
+
+    for student_id in student_ids:
+        session.add(
+            Dataset(student_id=student_id, **{column: 1 for column in FEATURE_COLUMNS})
+        )
+
+    session.commit()
+
+
+@pytest.fixture(scope="module")
+def replica_app(app, tmp_path_factory):
+    from server import create_app
+    from server.config import db
+
+    state_dir = tmp_path_factory.mktemp("replicas")
+    previous = {
+        name: os.environ.get(name) for name in ("DATABASE_URI", "DATABASE_REPLICA_URIS")
+    }
+
+    os.environ["DATABASE_URI"] = f"sqlite:///{state_dir / 'primary.db'}"
+    os.environ["DATABASE_REPLICA_URIS"] = f"sqlite:///{state_dir / 'replica.db'}"
+
+    try:
+        replica_app = create_app()
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    replica_app.config["TESTING"] = True
+    users = ("bob", "carol", "dave")
+
+    with replica_app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines["replica0"])
+
+        add_rows(db.session, users, (1, 2, 3))
+
+        with Session(db.engines["replica0"]) as session:
+            add_rows(session, users, (9001, 9002))
+
+    return replica_app
+
+
+@pytest.fixture
+def sticky(replica_app):
+    replica_app.config["DB_REPLICA_STICKY_SECONDS"] = 60
+    yield replica_app.config
+    replica_app.config["DB_REPLICA_STICKY_SECONDS"] = 60
+
+
+def headers_for(replica_app, user_id):
+    from flask_jwt_extended import create_access_token
+
+    with replica_app.app_context():
+        return {"Authorization": f"Bearer {create_access_token(identity=user_id)}"}
+
+
+def student_ids(response):
+    assert response.status_code == 200, response.get_json()
+
+    return {item["student_id"] for item in response.get_json()["datasets"]}
+
+
+def test_reads_go_to_the_replica(replica_app, sticky):
+    client = replica_app.test_client()
+
+    response = client.get("/dataset", headers=headers_for(replica_app, "dave"))
+
+    assert student_ids(response) == {9001, 9002}
+
+
+def test_session_that_wrote_stays_on_the_primary(replica_app, sticky):
+    from server.config import db
+    from server.schema.dataset import FEATURE_COLUMNS, Dataset
+    from server.utils.databaseUtils import replica_reads
+
+    statement = select(Dataset.student_id)
+
+    with replica_app.test_request_context():
+        with replica_reads(key="user:nobody") as session:
+            assert set(session.scalars(statement)) == {9001, 9002}
+
+            session.add(
+                Dataset(student_id=4, **{column: 1 for column in FEATURE_COLUMNS})
+            )
+            session.flush()
+
+            assert set(session.scalars(statement)) == {1, 2, 3, 4}
+
+        db.session.rollback()
+
+
+def test_writer_reads_the_primary_for_the_sticky_seconds(replica_app, sticky):
+    from server.utils.databaseUtils import recent_writes
+
+    client = replica_app.test_client()
+    headers = headers_for(replica_app, "bob")
+
+    recent_writes.mark("user:bob")
+
+    assert student_ids(client.get("/dataset", headers=headers)) == {1, 2, 3}
+
+    sticky["DB_REPLICA_STICKY_SECONDS"] = 0.05
+    time.sleep(0.1)
+
+    assert student_ids(client.get("/dataset", headers=headers)) == {9001, 9002}
+
+
+def test_confirmed_user_reads_its_own_write(replica_app, sticky):
+    from itsdangerous import URLSafeTimedSerializer
+    from server.utils.userCacheUtils import get_user_record
+
+    client = replica_app.test_client()
+    token = URLSafeTimedSerializer(os.getenv("SECRET_KEY")).dumps(
+        "carol@example.com", salt="email-confirm"
+    )
+
+    assert client.get(f"/confirm_email/{token}").status_code == 200
+
+    with replica_app.test_request_context():
+        assert get_user_record("carol").verified
+
+
+def test_replica_page_is_not_cached_for_the_writer(replica_app, sticky):
+    from server.utils.cacheUtils import table_versions
+    from server.utils.databaseUtils import recent_writes
+
+    replica_app.config["RESPONSE_CACHE_ENABLED"] = True
+    client = replica_app.test_client()
+
+    try:
+        recent_writes.mark("user:bob")
+        table_versions.bump(("dataset",))
+
+        # another user reads the replica that does not have bob's write yet
+        response = client.get("/dataset", headers=headers_for(replica_app, "dave"))
+        assert student_ids(response) == {9001, 9002}
+
+        response = client.get("/dataset", headers=headers_for(replica_app, "bob"))
+        assert student_ids(response) == {1, 2, 3}
+    finally:
+        replica_app.config["RESPONSE_CACHE_ENABLED"] = False
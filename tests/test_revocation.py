@@ -0,0 +1,34 @@
+import time
+import uuid
+from server.utils.revocationUtils import RevocationFilter
+
+
+def test_revoked_jti_is_found(tmp_path):
+    revocation_filter = RevocationFilter(
+        bits=1 << 12, period=60, path=str(tmp_path / "bloom")
+    )
+    jti = uuid.uuid4().hex
+
+    revocation_filter.add(jti)
+
+    assert revocation_filter.might_contain(jti)
+    assert not revocation_filter.might_contain(uuid.uuid4().hex)
+
+
+# a restart with a longer token lifetime computes lower generation numbers
+# than the ones the old filter stored
+
+
+def test_longer_period_does_not_reuse_the_old_file(tmp_path):
+    path = str(tmp_path / "bloom")
+    now = time.time()
+    old_filter = RevocationFilter(bits=1 << 12, period=60, path=path)
+    old_filter.add(uuid.uuid4().hex, now)
+    old_filter.add(uuid.uuid4().hex, now - 60)
+
+    new_filter = RevocationFilter(bits=1 << 12, period=3600, path=path)
+    jti = uuid.uuid4().hex
+    new_filter.add(jti, now)
+
+    assert new_filter.might_contain(jti)
+
@@ -0,0 +1,62 @@
+import threading
+import pytest
+from server.model.scheduler import InferenceScheduler
+
+
+def fake_model(X):
+    if (X < 0).any():
+        raise ValueError("negative feature")
+
+    return X.sum(axis=1), "test"
+
+
+@pytest.fixture
+def scheduler():
+    return InferenceScheduler(fake_model, max_wait=0.05, n_features=3)
+
+
+@pytest.mark.parametrize(
+    "features", [["a", 1, 2], [None, 1, 2], [1, 2], [[1, 2, 3]], [1, float("nan"), 2]]
+)
+def test_bad_features_are_rejected_before_queueing(scheduler, features):
+    with pytest.raises(ValueError):
+        scheduler.predict(features)
+
+    assert not scheduler._pending
+
+
+# the vectors are submitted together so they end up in one batch
+
+
+def predict_together(scheduler, vectors):
+    results = [None] * len(vectors)
+
+    def run(index):
+        try:
+            results[index] = scheduler.predict(vectors[index])
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(vectors))]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def test_failing_vector_only_fails_its_own_request(scheduler):
+    results = predict_together(scheduler, [[1, 2, 3], [-1, 0, 0], [4, 5, 6]])
+
+    assert results[0] == (6.0, "test")
+    assert isinstance(results[1], ValueError)
+    assert results[2] == (15.0, "test")
+
+
+def test_vectors_are_batched(scheduler):
+    results = predict_together(scheduler, [[i, i, i] for i in range(8)])
+
+    assert [result[0] for result in results] == [3.0 * i for i in range(8)]
+    assert scheduler.stats()["largest_batch"] > 1
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK_IMPORTS = """
+import sys
+from server import create_app
+create_app()
+print(",".join(sorted({"numpy", "joblib", "sklearn"} & set(sys.modules))))
+"""
+
+
+def ml_modules_after_create_app(tmp_path, role, loading):
+    env = dict(
+        os.environ,
+        SERVER_ROLE=role,
+        MODEL_LOADING=loading,
+        GUNICORN_PRELOAD="true",
+        DATABASE_URI=f"sqlite:///{tmp_path / 'startup.db'}",
+        SECRET_KEY="test",
+        ADMISSION_STATE_DIR=str(tmp_path),
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_IMPORTS],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ""
+
+
+@pytest.mark.parametrize(
+    "role, loading",
+    [("auth", "eager"), ("predict", "lazy"), ("all", "lazy"), ("all", "background")],
+)
+def test_ml_stack_is_not_imported_before_first_use(tmp_path, role, loading):
+    assert ml_modules_after_create_app(tmp_path, role, loading) == ""
+
+
+def test_lazy_model_scores_on_first_request(client, auth_headers, datasets):
+    response = client.post("/predict", json={"datasetId": 2}, headers=auth_headers)
+
+    assert response.status_code == 200, response.get_json()
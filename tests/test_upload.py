@@ -0,0 +1,131 @@
+import io
+import json
+import pytest
+from server.schema.dataset import FEATURE_COLUMNS
+from server.utils.uploadUtils import parse_rows, to_int
+
+BIG_ID = 2**53 + 1
+
+
+def csv_body(rows):
+    lines = [",".join(("student_id", *FEATURE_COLUMNS))]
+    lines += [",".join(str(value) for value in row) for row in rows]
+
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def ndjson_body(records):
+    return "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+
+def parsed(body, upload_format, feature_range=(1, 5)):
+    return list(parse_rows(io.BytesIO(body), upload_format, feature_range))
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(str(BIG_ID), BIG_ID), (BIG_ID, BIG_ID), ("3.0", 3), (" 4 ", 4), (5.0, 5)],
+)
+def test_to_int_keeps_every_digit(value, expected):
+    assert to_int(value, "value") == expected
+
+
+@pytest.mark.parametrize("value", ["3.5", 3.5, "abc", "1e3", "", None, True, "."])
+def test_to_int_rejects_other_values(value):
+    with pytest.raises(ValueError):
+        to_int(value, "value")
+
+
+def test_csv_rows():
+    rows = parsed(
+        csv_body([(BIG_ID, 1, 2, 3, 4, 5, 1, 2, 3), (7001, 1, 2, 3, 4, 9, 1, 2, 3)]),
+        "csv",
+    )
+
+    assert rows[0] == (2, BIG_ID, [1, 2, 3, 4, 5, 1, 2, 3], None)
+    assert rows[1][0] == 3 and "self_confidence" in rows[1][3]
+
+
+def test_ndjson_rows():
+    rows = parsed(
+        ndjson_body(
+            [
+                {"studentId": str(BIG_ID), "features": [1, 2, 3, 4, 5, 1, 2, 3]},
+                {"studentId": 7002, "features": [1, 2, 3]},
+                {"features": [1, 2, 3, 4, 5, 1, 2, 3]},
+            ]
+        )
+        + b"not json\n",
+        "ndjson",
+    )
+
+    assert rows[0] == (1, BIG_ID, [1, 2, 3, 4, 5, 1, 2, 3], None)
+    assert [row[3] is not None for row in rows] == [False, True, True, True]
+
+
+@pytest.fixture
+def small_chunks(app):
+    chunk_size = app.config["BULK_UPLOAD_CHUNK_SIZE"]
+    app.config["BULK_UPLOAD_CHUNK_SIZE"] = 2
+    yield
+    app.config["BULK_UPLOAD_CHUNK_SIZE"] = chunk_size
+
+
+def test_bulk_upload(client, auth_headers, datasets, small_chunks):
+    body = csv_body(
+        [
+            (BIG_ID, 1, 2, 3, 4, 5, 1, 2, 3),
+            (7010, 1, 1, 1, 1, 1, 1, 1, 1),
+            (7011, 2, 2, 2, 2, 2, 2, 2, 2),
+            (7012, 0, 2, 2, 2, 2, 2, 2, 2),
+            (7010, 3, 3, 3, 3, 3, 3, 3, 3),
+            (1000, 3, 3, 3, 3, 3, 3, 3, 3),
+            (BIG_ID, 4, 4, 4, 4, 4, 4, 4, 4),
+        ]
+    )
+
+    response = client.post(
+        "/upload/bulk",
+        data=body,
+        headers={**auth_headers, "Content-Type": "text/csv"},
+    )
+    results = response.get_json()["results"]
+
+    assert response.status_code == 200, response.get_json()
+    assert [result["status"] for result in results] == [
+        "accepted",
+        "accepted",
+        "accepted",
+        "rejected",
+        "rejected",
+        "rejected",
+        "rejected",
+    ]
+    assert results[0]["student_id"] == BIG_ID
+    assert results[4]["reason"] == "Student Id is repeated in the upload"
+    assert results[5]["reason"] == "Student Id Already Exists"
+    assert results[6]["reason"] == "Student Id is repeated in the upload"
+
+
+def test_bulk_upload_rejects_ids_saved_by_an_earlier_chunk(
+    client, auth_headers, small_chunks
+):
+    records = [
+        {"studentId": 7020 + index, "features": [1, 2, 3, 4, 5, 1, 2, 3]}
+        for index in range(3)
+    ]
+    first = client.post(
+        "/upload/bulk?format=ndjson", data=ndjson_body(records), headers=auth_headers
+    )
+    second = client.post(
+        "/upload/bulk?format=ndjson",
+        data=ndjson_body(records[1:] + [{"studentId": 7030, "features": [2] * 8}]),
+        headers=auth_headers,
+    )
+
+    assert first.get_json()["accepted"] == 3
+    assert [result["status"] for result in second.get_json()["results"]] == [
+        "rejected",
+        "rejected",
+        "accepted",
+    ]
@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "features",
+    [
+        ["a", 1, 1, 1, 1, 1, 1, 1],
+        [None, 1, 1, 1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1, 1, 1],
+        [0, 1, 1, 1, 1, 1, 1, 1],
+        [6, 1, 1, 1, 1, 1, 1, 1],
+        [1.5, 1, 1, 1, 1, 1, 1, 1],
+        "12345678",
+    ],
+)
+def test_bad_evaluations_are_rejected(client, auth_headers, features):
+    response = client.post(
+        "/upload_predict",
+        json={"studentId": 5000, "features": features},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 400, response.get_json()
+
+
+def test_evaluation_is_scored_and_saved(client, auth_headers):
+    response = client.post(
+        "/upload_predict",
+        json={"studentId": "5001", "features": ["3", 4, 5, 4, 3, 4, 5, 4]},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200, response.get_json()
+    assert "#5001" in response.get_json()["message"]
+
+    repeated = client.post(
+        "/upload_predict",
+        json={"studentId": 5001, "features": [3, 4, 5, 4, 3, 4, 5, 4]},
+        headers=auth_headers,
+    )
+
+    assert repeated.status_code == 400